@@ -0,0 +1,73 @@
+"""Compares Tilemap.autotile with the old tile by tile implementation on generated maps.
+
+Run from the root of the repo:
+    python -m benchmarks.autotile [sizes...]
+"""
+import sys
+import time
+
+import numpy as np
+
+from scripts.tilemap import Tilemap, AUTOTILE_MAP, AUTOTILE_TYPES
+
+TILE_TYPES = ['grass', 'stone', 'mossy_stone', 'blue_grass', 'vine', 'dark_vine']
+SIZES = [10_000, 100_000, 1_000_000]
+# The old implementation takes several seconds per 100k tiles, it is only timed up to this size
+REFERENCE_LIMIT = 100_000
+
+
+class Game:
+    pass
+
+
+def reference_autotile(tilemap):
+    # Tilemap.autotile as it was before the neighbour masks
+    grid = tilemap.grid
+    for x, y, t, variant in list(grid.cells()):
+        neighbors = set()
+        for shift in [(1, 0), (-1, 0), (0, -1), (0, 1)]:
+            if grid.type_at(x + shift[0], y + shift[1]) == t:
+                neighbors.add(shift)
+        neighbors = tuple(sorted(neighbors))
+        if (grid.type_names[t] in AUTOTILE_TYPES) and (neighbors in AUTOTILE_MAP):
+            grid.set(x, y, grid.type_names[t], AUTOTILE_MAP[neighbors], grid.infos.get((x, y)))
+
+
+def generate_map(n_tiles, seed=0):
+    """Fills about 60% of a square with blobs of tile types, variants are random"""
+    rng = np.random.default_rng(seed)
+    side = int((n_tiles / 0.6) ** 0.5) + 1
+    filled = rng.random((side, side)) < 0.6
+    # Blocks of 8x8 share a type so that the map has real neighbourhoods
+    types = rng.integers(0, len(TILE_TYPES), (side // 8 + 1, side // 8 + 1)).repeat(8, 0).repeat(8, 1)
+    variants = rng.integers(0, 3, (side, side))
+    tilemap = Tilemap(Game())
+    for y, x in zip(*np.nonzero(filled)):
+        tilemap.grid.set(int(x) - side // 2, int(y) - side // 2, TILE_TYPES[types[y, x]], int(variants[y, x]))
+    return tilemap
+
+
+def snapshot(tilemap):
+    return sorted((x, y, tilemap.grid.type_names[t], variant) for x, y, t, variant in tilemap.grid.cells())
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or SIZES
+    for size in sizes:
+        tilemap = generate_map(size)
+        print(str(len(tilemap.grid)) + ' tiles')
+
+        start = time.perf_counter()
+        tilemap.autotile()
+        print('  vectorized: %.1f ms' % ((time.perf_counter() - start) * 1000))
+
+        if size <= REFERENCE_LIMIT:
+            reference = generate_map(size)
+            start = time.perf_counter()
+            reference_autotile(reference)
+            print('  reference:  %.1f ms' % ((time.perf_counter() - start) * 1000))
+            print('  identical: ' + str(snapshot(tilemap) == snapshot(reference)))
+
+
+if __name__ == '__main__':
+    main()
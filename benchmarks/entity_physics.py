@@ -0,0 +1,53 @@
+"""Times the update of groups of throwables resting and sliding on a level, moved one by one and in a batch.
+
+Run from the root of the repo:
+    python -m benchmarks.entity_physics [counts...]
+"""
+import random
+import sys
+import time
+
+from main import Game
+from scripts.entities import Throwable, update_entities
+
+LEVEL = 0
+COUNTS = [8, 16, 32, 64, 80, 100, 500]
+TICKS = 100
+
+
+def scatter(game, count, seed=0):
+    """Throwables dropped over random floor cells of the level, sliding left or right"""
+    rng = random.Random(seed)
+    grid = game.tilemap.grid
+    floors = sorted((x, y) for x, y, t, variant in grid.cells()
+                    if grid.solidity_at(x, y) and not grid.solidity_at(x, y - 1))
+    objects = []
+    for _ in range(count):
+        x, y = rng.choice(floors)
+        thrown = Throwable(game, "blue_rock", [x * game.tile_size, (y - 3) * game.tile_size], (16, 16))
+        thrown.velocity = [rng.uniform(-3, 3), 0]
+        objects.append(thrown)
+    return objects
+
+
+def main():
+    counts = [int(count) for count in sys.argv[1:]] or COUNTS
+    game = Game(headless=True)
+    game.load_level(LEVEL)
+    for count in counts:
+        timings = []
+        positions = []
+        for batched in (False, True):
+            objects = scatter(game, count)
+            start = time.perf_counter()
+            for _ in range(TICKS):
+                # Batched whatever the count, to see where it starts paying off (BATCH_MIN_ENTITIES)
+                update_entities(objects, game.tilemap, batched, batch_min=0)
+            timings.append((time.perf_counter() - start) / TICKS * 1e6)
+            positions.append([list(o.pos) for o in objects])
+        print('%4d entities: %6.0f us/tick one by one, %6.0f us/tick batched%s' %
+              (count, timings[0], timings[1], '' if positions[0] == positions[1] else ', DIFFERENT RESULTS'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Compares Tilemap.load on json maps and on binary levels (.lvl).
+
+Run from the root of the repo:
+    python -m benchmarks.level_load [sizes...]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.autotile import Game, generate_map
+from scripts.tilemap import Tilemap
+
+SIZES = [10_000, 100_000, 1_000_000]
+REPEATS = 5
+
+
+def time_load(path):
+    tilemap = Tilemap(Game())
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        tilemap.load(path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, tilemap
+
+
+def compare(name, json_path, level_path):
+    json_time, from_json = time_load(json_path)
+    level_time, from_level = time_load(level_path)
+    print(name)
+    print('  json: %.1f ms (%d kB)' % (json_time * 1000, os.path.getsize(json_path) // 1024))
+    print('  lvl:  %.1f ms (%d kB)' % (level_time * 1000, os.path.getsize(level_path) // 1024))
+    print('  identical: ' + str(from_json.export() == from_level.export()))
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or SIZES
+    with tempfile.TemporaryDirectory() as folder:
+        for map_file in sorted(os.listdir('data/maps')):
+            if map_file.endswith('.json'):
+                tilemap = Tilemap(Game())
+                tilemap.load(os.path.join('data/maps', map_file))
+                level_path = os.path.join(folder, map_file[:-5] + '.lvl')
+                tilemap.save(level_path)
+                compare('data/maps/' + map_file, os.path.join('data/maps', map_file), level_path)
+
+        for size in sizes:
+            tilemap = generate_map(size)
+            json_path, level_path = os.path.join(folder, 'map.json'), os.path.join(folder, 'map.lvl')
+            tilemap.save(json_path)
+            tilemap.save(level_path)
+            compare(str(len(tilemap.grid)) + ' tiles', json_path, level_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Times apply_lighting for 1, 10 and 100 lights in the view: drawing every light mask on every frame as it used to,
+then taking them from the LightMaskCache with a LightMap at the resolutions of RESOLUTIONS.
+
+Run from the root of the repo:
+    python -m benchmarks.lighting [counts...]
+"""
+import random
+import sys
+import time
+
+from main import Game
+from scripts.display import apply_lighting, register_light_emitting_tile, LightMaskCache, LightMap
+
+LEVEL = 0
+COUNTS = [1, 10, 100]
+FRAMES = 50
+RESOLUTIONS = [1, 2, 4]
+# Half of the lights flicker, like torches and lava
+LIGHT_TYPES = ('glowing_mushroom', 'torch')
+
+
+def light_view(game, count, seed=0):
+    """Replaces the lights of the level by count lights scattered over the view"""
+    rng = random.Random(seed)
+    game.light_emitting_tiles = []
+    width, height = game.display.get_size()
+    for i in range(count):
+        pos = (game.scroll[0] + rng.uniform(0, width), game.scroll[1] + rng.uniform(0, height))
+        register_light_emitting_tile(game, pos, LIGHT_TYPES[i % len(LIGHT_TYPES)])
+
+
+def measure(game, frames):
+    render_scroll = (round(game.scroll[0]), round(game.scroll[1]))
+    start = time.perf_counter()
+    for _ in range(frames):
+        apply_lighting(game, render_scroll)
+    return (time.perf_counter() - start) / frames * 1000
+
+
+def main():
+    counts = [int(count) for count in sys.argv[1:]] or COUNTS
+    game = Game(headless=True)
+    game.load_level(LEVEL)
+    for count in counts:
+        # The player light is one of the lights
+        light_view(game, count - 1)
+        game.light_masks = LightMaskCache(max_masks=0)
+        game.light_map = LightMap(game.display.get_size(), 1)
+        timings = ['%7.2f ms/frame drawing the masks' % measure(game, FRAMES)]
+        game.light_masks = LightMaskCache()
+        for resolution in RESOLUTIONS:
+            game.light_map = LightMap(game.display.get_size(), resolution)
+            measure(game, FRAMES)
+            timings.append('%5.2f at 1/%d' % (measure(game, FRAMES), resolution))
+        print('%4d lights: %s, cached %s' % (count, timings[0], ', '.join(timings[1:])))
+
+
+if __name__ == '__main__':
+    main()
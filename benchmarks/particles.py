@@ -0,0 +1,78 @@
+"""Times the update and the drawing of crowds of leaves in the ParticleEngine, against the old particles, one
+object with its own Animation copy each.
+
+Run from the root of the repo:
+    python -m benchmarks.particles [counts...]
+"""
+import random
+import sys
+import time
+
+from main import Game
+from scripts.particle import ParticleEngine
+
+LEVEL = 0
+COUNTS = [10, 100, 1000]
+TICKS = 100
+
+
+class ReferenceParticle:
+    # Particle as it was before the engine
+    def __init__(self, game, p_type, pos, velocity, frame):
+        self.pos = list(pos)
+        self.velocity = list(velocity)
+        self.animation = game.assets['particle/' + p_type].copy()
+        self.animation.frame = frame
+
+    def update(self):
+        kill = self.animation.done
+        self.pos[0] += self.velocity[0]
+        self.pos[1] += self.velocity[1]
+        self.animation.update()
+        return kill
+
+    def render(self, surf, offset):
+        img = self.animation.img()
+        surf.blit(img, (self.pos[0] - offset[0] - img.get_width() // 2,
+                        self.pos[1] - offset[1] - img.get_height() // 2))
+
+
+def leaves(game, count, seed=0):
+    """(pos, velocity, frame) of count leaves falling around the player, some of them out of the view"""
+    rng = random.Random(seed)
+    px, py = game.player.pos
+    return [((px + rng.uniform(-400, 400), py + rng.uniform(-200, 200)), (-0.1, 0.3), rng.randint(0, 20))
+            for _ in range(count)]
+
+
+def main():
+    counts = [int(count) for count in sys.argv[1:]] or COUNTS
+    game = Game(headless=True)
+    game.load_level(LEVEL)
+    offset = (game.player.pos[0] - 240, game.player.pos[1] - 144)
+    for count in counts:
+        spawned = leaves(game, count)
+        particles = [ReferenceParticle(game, 'leaf', pos, velocity, frame) for pos, velocity, frame in spawned]
+        start = time.perf_counter()
+        for _ in range(TICKS):
+            for particle in particles[:]:
+                if particle.update():
+                    particles.remove(particle)
+            for particle in particles:
+                particle.render(game.display, offset)
+        reference = (time.perf_counter() - start) / TICKS * 1e6
+
+        engine = ParticleEngine(game.assets, budget=max(count, 1))
+        for pos, velocity, frame in spawned:
+            engine.spawn('leaf', pos, velocity, frame)
+        start = time.perf_counter()
+        for _ in range(TICKS):
+            engine.update()
+            engine.render(game.display, offset)
+        vectorized = (time.perf_counter() - start) / TICKS * 1e6
+        print('%5d particles: %7.0f us/tick one by one, %7.0f us/tick in the engine, %d and %d left' %
+              (count, reference, vectorized, len(particles), len(engine)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Times PhysicsPlayer.render spinning in the air with a full dash ghost trail, against the old implementation that
+converted, tinted and rotated every image on every frame.
+
+Run from the root of the repo:
+    python -m benchmarks.player_render [frames]
+"""
+import sys
+import time
+import tracemalloc
+
+import pygame
+
+from main import Game
+from scripts.physics import GHOST_LIFETIME, MAX_GHOSTS
+from scripts.utils import ROTATION_STEP
+
+FRAMES = 2000
+# The images counted as new are all kept in memory, fewer frames are counted
+COUNTED_FRAMES = 200
+
+
+def reference_render(player, surf, offset=(0, 0)):
+    # PhysicsPlayer.render as it was before the sprite cache, the ghosts held a copy of their frame
+    for ghost in player.ghost_images:
+        alpha = int(255 * (ghost["lifetime"] / 20) ** 2)
+        ghost_surf = ghost["img"].copy()
+        ghost_surf.fill((255, 255, 255, 0), special_flags=pygame.BLEND_RGBA_MAX)
+        ghost_surf.fill((109, 156, 159, 70), special_flags=pygame.BLEND_RGBA_MIN)
+        ghost_surf.set_alpha(alpha)
+        if ghost["angle"] != 0:
+            ghost_surf = pygame.transform.rotate(ghost_surf, ghost["angle"])
+        ghost_rect = ghost_surf.get_rect(center=(ghost["pos"][0] - offset[0] + player.size[0] // 2,
+                                                 ghost["pos"][1] - offset[1] + player.size[1] // 2))
+        ghost_rect.x -= 11
+        ghost_rect.y -= 5
+        surf.blit(ghost_surf, ghost_rect)
+
+    img = player.animation.img().convert_alpha()
+    if player.rotation_angle != 0:
+        rotated_img = pygame.transform.rotate(img, player.rotation_angle)
+        center = (player.pos[0] - offset[0] + player.size[0] // 2, player.pos[1] - offset[1] + player.size[1] // 2)
+        surf.blit(rotated_img, rotated_img.get_rect(center=center))
+    else:
+        surf.blit(img, (player.pos[0] - offset[0], player.pos[1] - offset[1]))
+
+
+def spin(player, frame):
+    # Airborne spin and a trail of ghosts at every stage of their fade out
+    player.rotation_angle = (frame * ROTATION_STEP) % 360
+    player.animation.update()
+    player.ghost_images = [{"pos": player.rect().center, "img": player.animation.img(),
+                            "lifetime": 1 + i * GHOST_LIFETIME // MAX_GHOSTS,
+                            "angle": (frame - i) * ROTATION_STEP % 360} for i in range(MAX_GHOSTS)]
+
+
+class CountingSurface:
+    """Forwards blits to a surface and counts the images it never saw before, the ones made for the frame"""
+
+    def __init__(self, surf):
+        self.surf = surf
+        # Kept alive so that a new image can't take the id of a freed one
+        self.seen = {}
+        self.new_images = 0
+
+    def blit(self, source, dest):
+        if id(source) not in self.seen:
+            self.seen[id(source)] = source
+            self.new_images += 1
+        return self.surf.blit(source, dest)
+
+
+def measure(render, player, surf, frames):
+    """Returns the time per frame in microseconds, the images allocated per frame and the peak of python memory
+    allocated by a frame in bytes"""
+    for frame in range(frames):
+        # Warms the caches up
+        spin(player, frame)
+        render(player, surf, (0, 0))
+    total = 0
+    for frame in range(frames):
+        spin(player, frame)
+        start = time.perf_counter()
+        render(player, surf, (0, 0))
+        total += time.perf_counter() - start
+
+    counting = CountingSurface(surf)
+    for _ in range(2):
+        # The first pass shows the cached images to the counter
+        counting.new_images = 0
+        for frame in range(COUNTED_FRAMES):
+            spin(player, frame)
+            render(player, counting, (0, 0))
+
+    # Traced apart, tracemalloc slows everything down
+    peak = 0
+    tracemalloc.start()
+    for frame in range(frames):
+        spin(player, frame)
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        render(player, surf, (0, 0))
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    return total / frames * 1e6, counting.new_images / COUNTED_FRAMES, peak
+
+
+def main():
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else FRAMES
+    game = Game(headless=True)
+    game.load_level(0)
+    player = game.player
+
+    for name, render in (('reference', reference_render), ('cached', type(player).render)):
+        per_frame, images, peak = measure(render, player, game.display, frames)
+        print('%-10s %6.1f us/frame, %5.1f images and at most %5d bytes of python objects allocated per frame' %
+              (name, per_frame, images, peak))
+    print('%d cached sprites' % len(player.sprites.images))
+
+
+if __name__ == '__main__':
+    main()
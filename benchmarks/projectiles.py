@@ -0,0 +1,80 @@
+"""Times the update and the drawing of crowds of projectiles in the ProjectilePool, against the old projectile dicts
+moved, checked and drawn one by one.
+
+Run from the root of the repo:
+    python -m benchmarks.projectiles [counts...]
+"""
+import math
+import random
+import sys
+import time
+
+from main import Game
+from scripts.projectiles import ProjectilePool, PROJECTILE_LIFETIME
+
+LEVEL = 0
+COUNTS = [10, 100, 1000]
+TICKS = 100
+
+
+def reference_step(game, projectiles, surf, offset):
+    # The projectile loop of Game.simulation_step and of Game.render_frame before the pool
+    for projectile in projectiles[:]:
+        projectile['pos'][0] += projectile['direction'][0]
+        projectile['pos'][1] += projectile['direction'][1]
+        projectile['timer'] += 1
+        if game.tilemap.solid_check(projectile['pos']) or projectile['timer'] > PROJECTILE_LIFETIME:
+            projectiles.remove(projectile)
+        elif game.player.rect().collidepoint(projectile['pos']):
+            projectiles.remove(projectile)
+    for projectile in projectiles:
+        img = game.assets[projectile['type']].convert_alpha()
+        surf.blit(img, (projectile['pos'][0] - img.get_width() / 2 - offset[0],
+                        projectile['pos'][1] - img.get_height() / 2 - offset[1]))
+
+
+def volley(game, count, seed=0):
+    """(pos, direction) of count projectiles fired around the player in every direction"""
+    rng = random.Random(seed)
+    px, py = game.player.pos
+    shots = []
+    for _ in range(count):
+        angle = rng.uniform(0, 2 * math.pi)
+        shots.append(((px + rng.uniform(-200, 200), py + rng.uniform(-120, 120)), (math.cos(angle), math.sin(angle))))
+    return shots
+
+
+def main():
+    counts = [int(count) for count in sys.argv[1:]] or COUNTS
+    game = Game(headless=True)
+    game.load_level(LEVEL)
+    offset = (game.player.pos[0] - 240, game.player.pos[1] - 144)
+    # Converts the images and warms numpy up
+    warm_up = ProjectilePool()
+    warm_up.spawn("glorbo_projectile", game.player.pos, (1, 0))
+    warm_up.update(game.tilemap, game.player.rect())
+    warm_up.render(game.display, game.assets, offset)
+    for count in counts:
+        shots = volley(game, count)
+        projectiles = [{"type": "glorbo_projectile", "pos": list(pos), "direction": list(direction), "timer": 0}
+                       for pos, direction in shots]
+        start = time.perf_counter()
+        for _ in range(TICKS):
+            reference_step(game, projectiles, game.display, offset)
+        reference = (time.perf_counter() - start) / TICKS * 1e6
+
+        pool = ProjectilePool()
+        for pos, direction in shots:
+            pool.spawn("glorbo_projectile", pos, direction)
+        start = time.perf_counter()
+        for _ in range(TICKS):
+            pool.save_previous()
+            pool.update(game.tilemap, game.player.rect())
+            pool.render(game.display, game.assets, offset)
+        pooled = (time.perf_counter() - start) / TICKS * 1e6
+        print('%5d projectiles: %7.0f us/tick one by one, %7.0f us/tick pooled, %d and %d left' %
+              (count, reference, pooled, len(projectiles), len(pool)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""Runs the game headless on a level with scripted input and times the simulation steps.
+
+Run from the root of the repo:
+    python -m benchmarks.simulation [level] [ticks]
+"""
+import sys
+import time
+
+from main import Game
+from scripts.timestep import TICK_RATE
+
+LEVEL = 0
+TICKS = 3600
+
+
+def scripted_inputs(ticks):
+    """Runs right and left, jumping and dashing on a fixed pattern, the same keys on every run"""
+    for tick in range(ticks):
+        keys = {}
+        phase = (tick // 60) % 6
+        if phase < 3:
+            keys["key_right"] = 1
+        elif phase == 3:
+            keys["key_left"] = 1
+        if tick % 45 < 10:
+            keys["key_jump"] = 1
+        if tick % 97 < 3:
+            keys["key_dash"] = 1
+        yield keys
+
+
+def main():
+    level = int(sys.argv[1]) if len(sys.argv) > 1 else LEVEL
+    ticks = int(sys.argv[2]) if len(sys.argv) > 2 else TICKS
+
+    start = time.perf_counter()
+    game = Game(headless=True)
+    game.load_level(level)
+    print('setup: %.0f ms' % ((time.perf_counter() - start) * 1000))
+
+    start = time.perf_counter()
+    game.step(ticks, scripted_inputs(ticks))
+    elapsed = time.perf_counter() - start
+    print('%d ticks: %.0f ms, %.0f us/tick, %.0fx real time' %
+          (ticks, elapsed * 1000, elapsed / ticks * 1e6, ticks / TICK_RATE / elapsed))
+    print('player at ' + str([round(v, 3) for v in game.player.pos]) + ', ' + game.player.action)
+
+
+if __name__ == '__main__':
+    main()
@@ -40,7 +40,7 @@ class Editor:
         self.environments = self.load_environments()
         # This maps the UI index (0, 1, 2) to the File ID (0.json, 5.json, etc.)
         # Initially, it's just a sequence [0, 1, 2, ... N] based on existing files
-        total_files = sum(1 for entry in os.listdir('data/maps/') if os.path.isfile(os.path.join('data/maps/', entry)))
+        total_files = sum(1 for entry in os.listdir('data/maps/') if entry.endswith('.json'))
         self.active_maps = list(range(total_files))
 
         self.selecting_environment_mode = False
@@ -155,10 +155,7 @@ class Editor:
     # --- UNDO/REDO METHODS ---
     def create_snapshot(self):
         # Creates a deep copy of the current map state
-        return {
-            'tilemap': copy.deepcopy(self.tilemap.tilemap),
-            'offgrid': copy.deepcopy(self.tilemap.offgrid_tiles)
-        }
+        return copy.deepcopy(self.tilemap.export())
 
     def save_action(self):
         # 1. Create snapshot
@@ -179,8 +176,7 @@ class Editor:
 
     def restore_snapshot(self, snapshot):
         # 1. Load data
-        self.tilemap.tilemap = copy.deepcopy(snapshot['tilemap'])
-        self.tilemap.offgrid_tiles = copy.deepcopy(snapshot['offgrid'])
+        self.tilemap.import_data(copy.deepcopy(snapshot))
 
         # 2. Refresh derived ID sets (Doors, Levers, etc.)
         self.levers_ids = set()
@@ -370,7 +366,7 @@ class Editor:
     def change_level(self, new_level):
         # Save current level (using current file ID)
         current_file_id = self.get_file_id(self.level)
-        if self.tilemap.tilemap != {}:
+        if not self.tilemap.is_empty():
             self.tilemap.save('data/maps/' + str(current_file_id) + '.json')
             self.save_edited_values()
 
@@ -771,12 +767,12 @@ class Editor:
         self.activators_types["All"] = set()
         for a in ["Levers", "Teleporters", "Buttons"]:
             self.activators_types[a] = set()
-            self.activators[a] = {pos: {"id": self.tilemap.tilemap[pos]["id"], "pos": self.tilemap.tilemap[pos]["pos"]}
-                                  for pos in self.tilemap.tilemap if
-                                  a.lower()[:-1] in self.tilemap.tilemap[pos]["type"]}
-            for pos in self.tilemap.tilemap:
-                if a.lower()[:-1] in self.tilemap.tilemap[pos]["type"]:
-                    self.activators_types[a].add(self.tilemap.tilemap[pos]['type'])
+            self.activators[a] = {}
+            for tile in self.tilemap.tiles():
+                if a.lower()[:-1] in tile["type"]:
+                    self.activators[a][str(tile["pos"][0]) + ";" + str(tile["pos"][1])] = {"id": tile["id"],
+                                                                                         "pos": tile["pos"]}
+                    self.activators_types[a].add(tile['type'])
             self.activators_types["All"] = self.activators_types["All"] | self.activators_types[a]
             activators_actions = load_activators_actions()
 
@@ -813,9 +809,9 @@ class Editor:
             if os.path.exists(src):
                 shutil.copy2(src, dst)  # Copy is safer than move
 
-        # 4. Clear the main maps folder
+        # 4. Clear the main maps folder (binary levels too, they would no longer match their ids)
         for f in os.listdir('data/maps/'):
-            if f.endswith('.json'):
+            if f.endswith('.json') or f.endswith('.lvl'):
                 os.remove(f'data/maps/{f}')
 
         # 5. Move files back from temp
@@ -893,9 +889,8 @@ class Editor:
 
                     self.change_level(self.return_to_level)
 
-                    tile_loc = str(self.transition_edit_pos[0]) + ";" + str(self.transition_edit_pos[1])
-                    if tile_loc in self.tilemap.tilemap:
-                        self.tilemap.tilemap[tile_loc]["dest_pos"] = selected_pos
+                    if self.tilemap.has_tile(self.transition_edit_pos):
+                        self.tilemap.update_tile(self.transition_edit_pos, dest_pos=selected_pos)
                         print(f"Updated dest_pos to {selected_pos}")
 
                     self.selecting_dest_pos = False
@@ -927,15 +922,15 @@ class Editor:
                         else:
                             self.display.blit(current_tile_img, mpos_scaled)
                     else:
-                        tile_loc = str(tile_pos[0]) + ";" + str(tile_pos[1])
-                        if tile_loc in self.tilemap.tilemap:
-                            if self.tilemap.tilemap[tile_loc]["type"] in self.activators_types[
-                                self.current_activator_category] or self.tilemap.tilemap[tile_loc][
+                        tile = self.tilemap.get_tile(tile_pos)
+                        if tile is not None:
+                            if tile["type"] in self.activators_types[
+                                self.current_activator_category] or tile[
                                 "type"] == "transition" and not self.clicking:
-                                element = self.tilemap.tilemap[tile_loc]["type"]
+                                element = tile["type"]
                                 shining_image = \
                                     self.assets[self.tile_list[self.tile_list.index(element)]][
-                                        self.tilemap.tilemap[tile_loc]["variant"]].copy()
+                                        tile["variant"]].copy()
                                 shining_image.fill((255, 255, 255, 100), special_flags=pygame.BLEND_ADD)
                                 self.display.blit(shining_image, (tile_pos[0] * self.tilemap.tile_size - self.scroll[0],
                                                                   tile_pos[1] * self.tilemap.tile_size - self.scroll[
@@ -948,10 +943,8 @@ class Editor:
                 self.change_level(self.return_to_level)
 
                 # 2. Update the specific transition tile
-                tile_loc = str(self.transition_edit_pos[0]) + ";" + str(self.transition_edit_pos[1])
-
-                if tile_loc in self.tilemap.tilemap:
-                    self.tilemap.tilemap[tile_loc]["dest_pos"] = selected_pos
+                if self.tilemap.has_tile(self.transition_edit_pos):
+                    self.tilemap.update_tile(self.transition_edit_pos, dest_pos=selected_pos)
                     print(f"Updated dest_pos to {selected_pos}")
                 else:
                     print("Error: Original transition tile not found.")
@@ -980,32 +973,22 @@ class Editor:
                                 print("id already used")
                                 iD = int(input("Enter the door id: "))
                             self.doors_ids.add(iD)
-                            self.tilemap.tilemap[str(tile_pos[0]) + ";" + str(tile_pos[1])] = {
-                                'type': self.tile_list[self.tile_group],
-                                'variant': self.tile_variant,
-                                'pos': tile_pos,
-                                'id': iD}
+                            self.tilemap.set_tile(tile_pos, self.tile_list[self.tile_group], self.tile_variant, id=iD)
                         elif self.tile_list[self.tile_group] == "transition":
                             # Default transition placement without console input
                             dest = 0
-                            self.tilemap.tilemap[str(tile_pos[0]) + ";" + str(tile_pos[1])] = {
-                                'type': "transition",
-                                'variant': self.tile_variant,
-                                'pos': tile_pos,
-                                'destination': dest,
-                                'dest_pos':[0, 0]}
+                            self.tilemap.set_tile(tile_pos, "transition", self.tile_variant,
+                                                  destination=dest, dest_pos=[0, 0])
                         elif self.tile_list[self.tile_group] == "spawners" and self.tile_variant == 0 and self.tilemap.extract([("spawners", 0)], keep=True):
 
                             print("Player spawner already placed in this map")
                         else:
-                            self.tilemap.tilemap[str(tile_pos[0]) + ";" + str(tile_pos[1])] = {
-                                'type': self.tile_list[self.tile_group],
-                                'variant': self.tile_variant,
-                                'pos': tile_pos}
+                            self.tilemap.set_tile(tile_pos, self.tile_list[self.tile_group], self.tile_variant)
                     else:
                         tile_loc = str(tile_pos[0]) + ";" + str(tile_pos[1])
-                        if tile_loc in self.tilemap.tilemap:
-                            t = self.tilemap.tilemap[tile_loc]["type"]
+                        tile = self.tilemap.get_tile(tile_pos)
+                        if tile is not None:
+                            t = tile["type"]
                             if t in self.activators_types[self.current_activator_category]:
                                 self.set_window_mode()
                                 self.showing_properties_window = True
@@ -1023,9 +1006,9 @@ class Editor:
                                     "image": self.assets[t][0],
                                     "infos": {
                                         "type": "transition",
-                                        "destination": self.tilemap.tilemap[tile_loc].get('destination', 0),
-                                        "dest_pos": self.tilemap.tilemap[tile_loc].get('dest_pos', [0,0]),
-                                        "pos": self.tilemap.tilemap[tile_loc]['pos']
+                                        "destination": tile.get('destination', 0),
+                                        "dest_pos": tile.get('dest_pos', [0,0]),
+                                        "pos": tile['pos']
                                     }
                                 }
                                 self.clicking = False
@@ -1033,25 +1016,27 @@ class Editor:
             if self.right_clicking and mpos_in_mainarea:
                 if not self.window_mode:
                     if not self.edit_properties_mode_on:
-                        tile_loc = str(tile_pos[0]) + ";" + str(tile_pos[1])
-                        if tile_loc in self.tilemap.tilemap:
-                            if self.tilemap.tilemap[tile_loc]['type'] in (l[0] for l in self.levers):
-                                self.levers_ids.remove(self.tilemap.tilemap[tile_loc]["id"])
-                            if self.tilemap.tilemap[tile_loc]['type'] in (d[0] for d in self.doors):
-                                self.doors_ids.remove(self.tilemap.tilemap[tile_loc]["id"])
-                            if self.tilemap.tilemap[tile_loc]['type'] in (tp[0] for tp in self.teleporters):
-                                self.tps_ids.remove(self.tilemap.tilemap[tile_loc]["id"])
-                            if self.tilemap.tilemap[tile_loc]['type'] in (b[0] for b in self.buttons):
-                                self.buttons_ids.remove(self.tilemap.tilemap[tile_loc]["id"])
-                            del self.tilemap.tilemap[tile_loc]
-                        for tile in self.tilemap.offgrid_tiles.copy():
+                        tile = self.tilemap.remove_tile(tile_pos)
+                        if tile is not None:
+                            if tile['type'] in (l[0] for l in self.levers):
+                                self.levers_ids.remove(tile["id"])
+                            if tile['type'] in (d[0] for d in self.doors):
+                                self.doors_ids.remove(tile["id"])
+                            if tile['type'] in (tp[0] for tp in self.teleporters):
+                                self.tps_ids.remove(tile["id"])
+                            if tile['type'] in (b[0] for b in self.buttons):
+                                self.buttons_ids.remove(tile["id"])
+                        clicked = pygame.Rect(min(mpos_scaled[0], mpos[0]) + self.scroll[0],
+                                              min(mpos_scaled[1], mpos[1]) + self.scroll[1],
+                                              abs(mpos_scaled[0] - mpos[0]) + 1, abs(mpos_scaled[1] - mpos[1]) + 1)
+                        for tile in self.tilemap.offgrid_in(clicked):
                             tile_img = self.assets[tile['type']][tile['variant']]
                             tile_r = pygame.Rect(tile['pos'][0] - self.scroll[0],
                                                  tile['pos'][1] - self.scroll[1],
                                                  tile_img.get_width(),
                                                  tile_img.get_height())
                             if tile_r.collidepoint(mpos_scaled) or tile_r.collidepoint(mpos):  # Check both to be safe
-                                self.tilemap.offgrid_tiles.remove(tile)
+                                self.tilemap.remove_offgrid_tile(tile)
 
             if not self.edit_properties_mode_on:
                 self.display.blit(current_tile_img, (5, 5))
@@ -1080,11 +1065,11 @@ class Editor:
                         if event.button == 1:
                             self.clicking = True
                             if not self.ongrid:
-                                self.tilemap.offgrid_tiles.append({'type': self.tile_list[self.tile_group],
-                                                                   'variant': self.tile_variant,
-                                                                   'pos': (
-                                                                       mpos_scaled[0] + self.scroll[0],
-                                                                       mpos_scaled[1] + self.scroll[1])})
+                                self.tilemap.add_offgrid_tile({'type': self.tile_list[self.tile_group],
+                                                               'variant': self.tile_variant,
+                                                               'pos': (
+                                                                   mpos_scaled[0] + self.scroll[0],
+                                                                   mpos_scaled[1] + self.scroll[1])})
                         if event.button == 3:
                             self.right_clicking = True
                         if not self.shift and self.tile_group:
@@ -1126,8 +1111,13 @@ class Editor:
                         if event.key == pygame.K_g:
                             self.ongrid = not self.ongrid
                         if event.key == pygame.K_t:
-                            self.tilemap.autotile()
-                            self.save_action()
+                            if self.shift:
+                                # Shift + T: keep variants autotiled while painting
+                                self.tilemap.live_autotile = not self.tilemap.live_autotile
+                                print("Live autotile " + ("on" if self.tilemap.live_autotile else "off"))
+                            else:
+                                self.tilemap.autotile()
+                                self.save_action()
                         if event.key == pygame.K_LSHIFT:
                             self.shift = True
                         if event.key == pygame.K_o:
@@ -1137,20 +1127,12 @@ class Editor:
                         # Shortcut for placing transitions
                         if event.key == pygame.K_p:
                             dest = 0  # Default value
-                            self.tilemap.tilemap[str(tile_pos[0]) + ";" + str(tile_pos[1])] = {
-                                'type': "transition",
-                                'variant': self.tile_variant,
-                                'pos': tile_pos,
-                                'destination': dest,
-                                'dest_pos' : [0,0]}
+                            self.tilemap.set_tile(tile_pos, "transition", self.tile_variant,
+                                                  destination=dest, dest_pos=[0, 0])
                             self.save_action()
                         # Shortcut for placing checkpoints
                         if event.key == pygame.K_j:
-                            self.tilemap.tilemap[str(tile_pos[0]) + ";" + str(tile_pos[1])] = {
-                                'type': "checkpoint",
-                                'variant': 0,
-                                'pos': tile_pos
-                            }
+                            self.tilemap.set_tile(tile_pos, "checkpoint", 0)
                             self.save_action()
                         # Shortcut for placing portals
 
@@ -1223,13 +1205,13 @@ class Editor:
                                             self.edited_value) if self.edited_value.isdigit() else self.edited_value
                                         self.selected_activator["infos"][self.edited_info] = new_val
 
-                                        tile_loc = str(self.selected_activator["infos"]["pos"][0]) + ";" + \
-                                                   str(self.selected_activator["infos"]["pos"][1])
+                                        activator_pos = self.selected_activator["infos"]["pos"]
+                                        tile_loc = str(activator_pos[0]) + ";" + str(activator_pos[1])
+                                        tile = self.tilemap.get_tile(activator_pos)
 
                                         # A. Save Logic for Transitions
                                         if self.selected_activator_type == "Transitions":
-                                            if tile_loc in self.tilemap.tilemap:
-                                                self.tilemap.tilemap[tile_loc][self.edited_info] = new_val
+                                            self.tilemap.update_tile(activator_pos, **{self.edited_info: new_val})
                                             self.edited_value = None
                                             self.edited_info = ""
                                         # B. Save Logic for Activators (Levers, Buttons, Teleporters)
@@ -1238,19 +1220,14 @@ class Editor:
                                             self.activators_ids[self.selected_activator_type].add(iD)
 
                                             # Handle changing the main ID of an object
-                                            if tile_loc in self.tilemap.tilemap and self.edited_info == "id" and \
-                                                    self.edited_value != str(self.tilemap.tilemap[tile_loc]["id"]):
-                                                self.activators_ids[self.selected_activator_type].remove(
-                                                    self.tilemap.tilemap[tile_loc]["id"])
+                                            if tile is not None and self.edited_info == "id" and \
+                                                    self.edited_value != str(tile["id"]):
+                                                self.activators_ids[self.selected_activator_type].remove(tile["id"])
 
                                             # Create tile entry if it somehow doesn't exist (e.g. newly placed)
-                                            elif tile_loc not in self.tilemap.tilemap:
-                                                self.tilemap.tilemap[tile_loc] = {
-                                                    'type': self.tile_list[self.tile_group],
-                                                    'variant': self.tile_variant,
-                                                    'pos': self.selected_activator["infos"]["pos"],
-                                                    'id': iD
-                                                }
+                                            elif tile is None:
+                                                self.tilemap.set_tile(activator_pos, self.tile_list[self.tile_group],
+                                                                      self.tile_variant, id=iD)
 
                                             # Ensure activator entry exists
                                             if tile_loc not in self.activators[self.selected_activator_type]:
@@ -1259,8 +1236,8 @@ class Editor:
                                             # Save data
                                             self.activators[self.selected_activator_type][tile_loc] = \
                                             self.selected_activator["infos"]
-                                            self.tilemap.tilemap[tile_loc]["id"] = \
-                                            self.activators[self.selected_activator_type][tile_loc]["id"]
+                                            self.tilemap.update_tile(
+                                                activator_pos, id=self.activators[self.selected_activator_type][tile_loc]["id"])
 
                                             self.edited_value = None
                                             self.edited_info = ""
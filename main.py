@@ -11,17 +11,23 @@ import time
 from scripts.entities import *
 from scripts.utils import *
 from scripts.tilemap import Tilemap
+from scripts.tilegrid import SOLID, ONE_WAY
+from scripts.levelfile import level_path, STREAM_EXTENSION
+from scripts.streaming import LevelStream, STREAMED_OBJECTS, object_pos
+from scripts.broadphase import Broadphase, DYNAMIC_SLACK, entity_bounds, rect_bounds, point_bounds, column_bounds
+from scripts.projectiles import ProjectilePool
 from scripts.physics import PhysicsPlayer
-from scripts.particle import Particle
+from scripts.particle import ParticleEngine
 from scripts.activators import *
 from scripts.user_interface import Menu, start_menu
 from scripts.saving import Save, save_game
 from scripts.doors import Door
 from scripts.display import *
 from scripts.text import load_game_texts, display_bottom_text, update_bottom_text
-from scripts.spark import Spark
 from scripts.sound import set_game_volume, change_music
 from scripts.modes import *
+from scripts.timestep import FixedTimestep, GameClock, TICK_RATE, MAX_CATCH_UP_STEPS, interpolate, interpolated_offset
+from scripts.replay import RandomStreams, InputRecorder, InputReplayer
 
 
 class Game:
@@ -32,11 +38,20 @@ class Game:
     asset loading, level streaming, and the rendering pipeline (lighting, particles, UI).
     """
 
-    def __init__(self):
+    def __init__(self, headless=False):
         """
         Initializes the Pygame context, display settings, and global game variables.
         Loads all base assets and prepares the internal state for the first level.
+
+        Args:
+            headless (bool): Runs without a window nor sound card (SDL dummy drivers), menus, backgrounds or
+                autosaves, for regression runs, bots and benchmarks driven with step().
         """
+        self.headless = headless
+        if headless:
+            # Must be set before pygame.init
+            os.environ["SDL_VIDEODRIVER"] = "dummy"
+            os.environ["SDL_AUDIODRIVER"] = "dummy"
         pygame.init()
 
         # --- Window Setup ---
@@ -46,6 +61,17 @@ class Game:
         # The internal rendering surface (half size for a pixel-art aesthetic)
         self.display = pygame.Surface((480, 288))
         self.clock = pygame.time.Clock()
+        # Simulation at a fixed rate, rendering as fast as max_fps allows (0 for no limit)
+        self.timestep = FixedTimestep(TICK_RATE, MAX_CATCH_UP_STEPS)
+        self.max_fps = 60
+        self.previous_scroll = (0, 0)
+        self.previous_positions = {}
+        # Gameplay timers and randomness, reproducible from a seed and the inputs (see scripts.replay)
+        self.game_clock = GameClock(TICK_RATE)
+        self.rng = RandomStreams()
+        self.recorder = None
+        self.replayer = None
+        self.record_path = None  # Recording started with the game (--record)
 
         # --- State Management ---
         # Controls which 'loop' the game is currently running
@@ -54,9 +80,10 @@ class Game:
 
         # --- Icon Setup ---
         try:
-            icon_img = pygame.image.load("assets/images/logo.png").convert_alpha()
-            icon_img = pygame.transform.smoothscale(icon_img, (32, 32))
-            pygame.display.set_icon(icon_img)
+            if not headless:
+                icon_img = pygame.image.load("assets/images/logo.png").convert_alpha()
+                icon_img = pygame.transform.smoothscale(icon_img, (32, 32))
+                pygame.display.set_icon(icon_img)
         except FileNotFoundError:
             pass
 
@@ -121,7 +148,9 @@ class Game:
         self.assets.update(load_tiles())
         self.assets.update(load_entities(self.e_info))
         self.assets.update(load_player())
-        self.assets.update(load_backgrounds(self.b_info))
+        # Backgrounds are only drawn, they are most of the loading time
+        if not headless:
+            self.assets.update(load_backgrounds(self.b_info))
 
         # --- Map Object Caching ---
         # Pre-loads and pairs interactive objects for efficient lookup during level loading
@@ -148,16 +177,22 @@ class Game:
             print(f"Error initializing sound: {e}")
 
         # --- Input & Level Tracking ---
+        # key_interact and key_respawn are presses, consumed by the next simulation step
         self.dict_kb = {"key_right": 0, "key_left": 0, "key_up": 0, "key_down": 0,
-                        "key_jump": 0, "key_dash": 0, "key_noclip": 0, "key_attack": 0}
+                        "key_jump": 0, "key_dash": 0, "key_noclip": 0, "key_attack": 0,
+                        "key_interact": 0, "key_respawn": 0}
 
         self.tilemap = Tilemap(self, self.tile_size)
+        self.level_stream = None
+        self.parked_regions = {}
         self.level = 0
         self.default_level = self.level
 
 
         self.activators = []
-        self.projectiles = []
+        self.projectiles = ProjectilePool()
+        # Grid of the objects of the level, the overlap tests only look at the objects around the player or the view
+        self.broadphase = Broadphase()
         self.activators_actions = load_activators_actions()
         self.spawner_pos = {}
 
@@ -165,7 +200,7 @@ class Game:
         self.current_checkpoint = None
         self.sections = {0: (0, 1, 2)}
 
-        self.levels = {i:{} for i in range(len(os.listdir("data/maps")))}
+        self.levels = {i:{} for i in range(len([f for f in os.listdir("data/maps") if f.endswith(".json")]))}
 
 
         # --- Player Stats & Combat ---
@@ -186,7 +221,6 @@ class Game:
         self.cutscene = False
         self.game_texts = load_game_texts()
         self.bottom_text = None
-        self.doors_rects = []
 
         # --- Lighting System ---
         self.darkness_level = 150
@@ -209,7 +243,9 @@ class Game:
 
         self.light_infos = {i: {"darkness_level": 180, "light_radius": 200} for i in range(5)}
         self.light_mask = pygame.Surface((self.light_radius * 2, self.light_radius * 2), pygame.SRCALPHA)
-        create_light_mask(self.light_radius)
+        # Light masks are drawn once per kind of light and reused every frame
+        self.light_masks = LightMaskCache()
+        self.light_map = LightMap(self.display.get_size(), LIGHT_RESOLUTION)
         self.player_light = self.light_properties["player"]
 
         # --- Interactions & VFX ---
@@ -218,21 +254,27 @@ class Game:
         self.damage_flash_active = False
         self.damage_flash_end_time = 0
         self.damage_flash_duration = 100
-        self.particles = []
-        self.sparks = []
+        # Particles
+        self.particles = ParticleEngine(self.assets)
 
         # --- Menu & System Configuration ---
         self.selected_language = "English"
-        self.menu = Menu(self)
+        self.menu = None if headless else Menu(self)
         self.keyboard_layout = "azerty"
         self.save_system = Save(self)
         self.current_slot = None  # Tracking the active save slot
+        self.autosave = not headless  # Saves on checkpoints and at the start of the game
+        # Enemies and throwables are moved in batches (see scripts.batchphysics) when there are many of them
+        self.batched_physics = True
 
         # --- Modes configuration ---
         self.current_mode = "default"
 
         # --- Hitboxes
         self.show_spikes_hitboxes = False
+        # Tile queries made by the last simulation step, shown with the hitboxes
+        self.tick_tile_queries = 0
+        self.debug_font = None
 
         self.playtime = 0
         self.menu_time = 0
@@ -274,102 +316,281 @@ class Game:
 
     def load_level(self, map_id, transition_effect=True):
         """
-        Loads level data from a JSON file, extracts entities, and sets up level-specific logic.
+        Loads level data (streamed .lvls, binary .lvl if up to date, else JSON), extracts entities, and sets up
+        level-specific logic.
 
         Args:
             map_id (int): The index of the level to load.
             :param transition_effect:
         """
-        self.tilemap.load("data/maps/" + str(map_id) + ".json")
+        if self.level_stream is not None:
+            self.level_stream.close()
+            self.level_stream = None
+        path = level_path("data/maps/" + str(map_id))
         self.display = pygame.Surface((480, 288))
         self.light_emitting_tiles = []
         self.light_emitting_objects = []
 
-        # --- Checkpoints & Traps ---
-        self.checkpoints = self.tilemap.extract([("checkpoint", 0)])
-
+        self.checkpoints = []
         self.spikes = []
+        self.throwable = []
+        self.leaf_spawners = []
+        self.crystal_spawners = []
+        self.enemies = []
+        self.activators = []
+        self.doors = []
+        self.transitions = []
+        self.parked_regions = {}
+
+        if path.endswith(STREAM_EXTENSION):
+            # Only the regions around the camera are in the tilemap, the level wide objects are read from the file
+            self.level_stream = LevelStream(self.tilemap, path)
+            self.populate_level_logic(map_id, self.level_stream.find)
+            self.scroll = [self.player.pos[0], self.player.pos[1]]
+            self.stream_level()
+        else:
+            self.tilemap.load(path)
+            self.populate_level_logic(map_id, self.tilemap.extract)
+            self.populate_area()
+            self.scroll = [self.player.pos[0], self.player.pos[1]]
+
+        self.bin_static_objects()
+        self.bin_dynamic_objects()
+
+        # Reset VFX and interaction pools
+        self.interactable = self.throwable.copy() + self.activators.copy()
+        self.cutscene = False
+        self.particles.clear()
+        self.transition = -30 if transition_effect else 0
+        self.max_falling_depth = 50000000000
+        # Nothing is interpolated from the previous level
+        self.previous_scroll = tuple(self.scroll)
+        self.previous_positions = {}
+        update_light(self)
+
+    def populate_level_logic(self, map_id, extract):
+        """Creates the objects that matter to the whole level (spawn, checkpoints, activators, doors, transitions)
+        from the tiles given by extract"""
+        self.checkpoints += extract([("checkpoint", 0)])
+
+        for spawner in extract([('spawners', 0)]):
+            self.spawners[str(map_id)] = spawner["pos"].copy()
+            self.spawner_pos[str(map_id)] = spawner["pos"]
+            self.player.pos = spawner["pos"].copy()
+            self.spawn_point = {"pos": spawner["pos"].copy(), "level": map_id}
+
+        for activator in extract(self.levers_id_pairs + self.buttons_id_pairs + self.tp_id_pairs):
+            a = Activator(self, activator['pos'], activator['type'], i=activator["id"])
+            a.state = activator["variant"]
+            self.activators.append(a)
+
+        for door in extract(self.doors_id_pairs):
+            door_type = door["type"]
+            speed = 0.01 if door_type == 'breakable_stalactite' else 1
+            door_id = None if door_type == 'breakable_stalactite' else door["id"]
+            self.doors.append(
+                Door(self.d_info[door_type]["size"], door["pos"], door_type, door_id, False, speed, self))
+
+        self.transitions += extract([("transition", 0)])
+
+    def populate_area(self, area=None):
+        """Creates the local objects (traps, throwables, decor spawners, enemies) of the map, or of an area of it in
+        pixels"""
         spike_types = []
         for n in range(4):
             spike_types += [("spikes", n), ("bloody_spikes", n), ("big_spikes", n), ("big_bloody_spikes", n)]
 
-        for spike in self.tilemap.extract(spike_types, keep=True):
+        for spike in self.tilemap.extract(spike_types, keep=True, area=area):
             self.spikes.append(DamageBlock(self, spike["pos"], self.assets[spike["type"]][spike["variant"]]))
 
         # --- Objects & Particles ---
-        self.throwable = []
-        for o in self.tilemap.extract([('throwable', 0)]):
+        for o in self.tilemap.extract([('throwable', 0)], area=area):
             self.throwable.append(Throwable(self, "blue_rock", o['pos'], (16, 16)))
 
-        self.leaf_spawners = []
         for plant in self.tilemap.extract([('vine_decor', 3), ('vine_decor', 4), ('vine_decor', 5),
-                                           ('mossy_stone_decor', 15), ('mossy_stone_decor', 16)], keep=True):
+                                           ('mossy_stone_decor', 15), ('mossy_stone_decor', 16)], keep=True, area=area):
             self.leaf_spawners.append(pygame.Rect(4 + plant['pos'][0], 4 + plant['pos'][1], 23, 13))
 
-        self.crystal_spawners = []
-        for mushroom in self.tilemap.extract([("blue_decor", 14), ("blue_decor", 15)], keep=True):
+        for mushroom in self.tilemap.extract([("blue_decor", 14), ("blue_decor", 15)], keep=True, area=area):
             register_light_emitting_tile(self, (mushroom['pos'][0] + 8, mushroom['pos'][1] + 8), "glowing_mushroom")
             self.crystal_spawners.append(pygame.Rect(4 + mushroom['pos'][0], 4 + mushroom['pos'][1], 23, 13))
 
-        # Initial setup for enemies and interactive objects
-        self.enemies = []
-        for spawner in self.tilemap.extract([('spawners', 0), ('spawners', 1), ('spawners', 3)]):
-            if spawner['variant'] == 0:
-                self.spawners[str(map_id)] = spawner["pos"].copy()
-                self.spawner_pos[str(map_id)] = spawner["pos"]
-                self.player.pos = spawner["pos"].copy()
-                self.spawn_point = {"pos": spawner["pos"].copy(), "level": map_id}
-            elif spawner['variant'] == 1:
+        # Initial setup for enemies
+        for spawner in self.tilemap.extract([('spawners', 1), ('spawners', 3)], area=area):
+            if spawner['variant'] == 1:
                 self.enemies.append(Enemy(self, "picko", spawner['pos'], (16, 16), 100,
                                           {"attack_distance": 20, "attack_dmg": 10, "attack_time": 1.5}))
             elif spawner['variant'] == 3:
                 self.enemies.append(DistanceEnemy(self, "glorbo", spawner['pos'], (16, 16), 100,
                                                   {"attack_distance": 100, "attack_dmg": 10, "attack_time": 1.5}))
 
-        self.activators = []
-        for activator in self.tilemap.extract(self.levers_id_pairs + self.buttons_id_pairs + self.tp_id_pairs):
-            a = Activator(self, activator['pos'], activator['type'], i=activator["id"])
-            a.state = activator["variant"]
-            self.activators.append(a)
+    def bin_static_objects(self):
+        """Bins the objects that don't move in the broadphase, when the level or its loaded regions change"""
+        self.broadphase.bin('spikes', self.spikes, rect_bounds)
+        self.broadphase.bin('activators', self.activators, rect_bounds)
+        self.broadphase.bin('checkpoints', self.checkpoints, column_bounds)
+        self.broadphase.bin('transitions', self.transitions, point_bounds)
+
+    def bin_dynamic_objects(self):
+        """Bins the moving objects in the broadphase, after every step"""
+        self.broadphase.bin('enemies', self.enemies, entity_bounds, DYNAMIC_SLACK)
+        self.broadphase.bin('throwable', self.throwable, entity_bounds, DYNAMIC_SLACK)
+
+    def camera_view(self):
+        """-> Rect
+        the part of the level the camera shows"""
+        return pygame.Rect(self.scroll[0], self.scroll[1], self.display.get_width(), self.display.get_height())
+
+    def stream_level(self):
+        """Loads the regions of a streamed level around the camera and unloads the far ones. The local objects of
+        unloaded regions are parked, and given back as they were when their region comes back"""
+        loaded, unloaded = self.level_stream.update(self.camera_view(), self.player.velocity)
+        for region in unloaded:
+            area = self.level_stream.region_rect(region)
+            parked = {}
+            for name in STREAMED_OBJECTS:
+                objects = getattr(self, name)
+                parked[name] = [o for o in objects if area.collidepoint(object_pos(o))]
+                setattr(self, name, [o for o in objects if not area.collidepoint(object_pos(o))])
+            self.parked_regions[region] = parked
+        for region in loaded:
+            area = self.level_stream.region_rect(region)
+            # The tiles of the level wide objects come back with the region, they already exist
+            self.tilemap.extract([("checkpoint", 0), ('spawners', 0), ("transition", 0)] + self.levers_id_pairs
+                                 + self.buttons_id_pairs + self.tp_id_pairs + self.doors_id_pairs, area=area)
+            if region in self.parked_regions:
+                self.tilemap.extract([('throwable', 0), ('spawners', 1), ('spawners', 3)], area=area)
+                for name, objects in self.parked_regions.pop(region).items():
+                    getattr(self, name).extend(objects)
+            else:
+                self.populate_area(area)
+        if loaded or unloaded:
+            self.bin_static_objects()
+            self.bin_dynamic_objects()
+            self.interactable = self.throwable.copy() + self.activators.copy()
 
-        self.doors = []
-        for door in self.tilemap.extract(self.doors_id_pairs):
-            door_type = door["type"]
-            speed = 0.01 if door_type == 'breakable_stalactite' else 1
-            door_id = None if door_type == 'breakable_stalactite' else door["id"]
-            self.doors.append(
-                Door(self.d_info[door_type]["size"], door["pos"], door_type, door_id, False, speed, self))
+    def main_game_logic(self):
+        """
+        One frame of the game while 'PLAYING': reads the input, runs as many fixed simulation steps as the time since
+        the last frame calls for, then renders once, moving objects drawn between their last two states.
+        """
+        self.handle_events()
+        if not self.game_initialized:
+            self.start_time = time.time()
 
-        self.transitions = self.tilemap.extract([("transition", 0)])
-        self.scroll = [self.player.pos[0], self.player.pos[1]]
+        for _ in range(self.timestep.advance(self.clock.tick(self.max_fps))):
+            self.simulation_step()
+        if not self.headless:
+            self.render_frame(self.timestep.alpha())
 
-        # Reset VFX and interaction pools
-        self.interactable = self.throwable.copy() + self.activators.copy()
-        self.cutscene = False
-        self.particles = []
-        self.sparks = []
-        self.transition = -30 if transition_effect else 0
-        self.max_falling_depth = 50000000000
-        update_light(self)
+        if not self.game_initialized:
+            self.game_initialized = True
+            if self.autosave and not os.path.exists(f"saves/save_{self.current_slot}.json"):
+                save_game(self, self.current_slot)
 
-    def main_game_logic(self):
+    def step(self, ticks=1, inputs=None):
         """
-        The core gameplay loop. Handles physics, collision, rendering order,
-        entity updates, and UI blitting. This is called once per frame while state is 'PLAYING'.
-        """
-        update_camera(self)
-        render_scroll = (round(self.scroll[0]), round(self.scroll[1]))
+        Runs simulation steps without rendering nor waiting for the clock, as fast as the machine allows.
 
-        display_level_bg(self, self.level)
-        self.tilemap.render(self.display, offset=render_scroll)
-        self.tilemap.render_over(self.display, offset=render_scroll)
+        Args:
+            ticks (int): The number of steps to run.
+            inputs (iterable): The keys held at each step, dicts like dict_kb (missing keys are released). The
+                run stops early when it runs out. None keeps the keys currently held.
 
+        Returns:
+            int: The number of steps run.
+        """
         if not self.game_initialized:
             self.start_time = time.time()
+            self.game_initialized = True
+        inputs = iter(inputs) if inputs is not None else None
+        for tick in range(ticks):
+            if inputs is not None:
+                keys = next(inputs, None)
+                if keys is None:
+                    return tick
+                for key in self.dict_kb:
+                    self.dict_kb[key] = keys.get(key, 0)
+            self.simulation_step()
+        return ticks
+
+    def start_recording(self, path, seed=0):
+        """
+        Reloads the current level with a fresh clock and random seed and records the inputs from there, so that
+        start_replay can play the session again exactly.
+
+        Args:
+            path (str): The recording to write (.rec).
+            seed (int): The seed of the random streams.
+        """
+        self.stop_recording()
+        self.restart_session(self.level, seed)
+        self.recorder = InputRecorder(path, self.level, seed, self.dict_kb.keys())
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def start_replay(self, path):
+        """Loads the level of a recording in the state it was recorded from, the next steps replay its inputs"""
+        self.replayer = InputReplayer(path)
+        for key in self.dict_kb: self.dict_kb[key] = 0
+        self.restart_session(self.replayer.level, self.replayer.seed)
+
+    def restart_session(self, level, seed):
+        # Same starting point for a recording and its replays: a new player on a freshly loaded level
+        self.game_clock.reset()
+        self.rng.seed(seed)
+        self.player = PhysicsPlayer(self, self.tilemap, (100, 0), (16, 16))
+        self.player_hp = 100
+        self.player_last_attack_time = 0
+        self.holding_attack = False
+        self.attacking = False
+        self.player_grabbing = False
+        self.teleporting = False
+        self.tp_id = None
+        self.last_teleport_time = 0
+        self.moving_visual = False
+        self.current_checkpoint = None
+        self.projectiles.clear()
+        self.level = level
+        self.load_level(level, transition_effect=False)
+
+    def simulation_step(self):
+        """
+        Advances the game by one fixed step: camera, level logic, projectiles, enemies, player physics, doors and
+        VFX. Nothing is drawn here.
+        """
+        # Keys of the step, recorded or read from a recording
+        if self.replayer is not None:
+            self.replayer.apply(self.game_clock.ticks, self.dict_kb, self)
+        if self.recorder is not None:
+            self.recorder.record(self.game_clock.ticks, self.dict_kb, self)
+
+        if self.dict_kb["key_respawn"]:
+            self.dict_kb["key_respawn"] = 0
+            kill_player(self, self.screen, self.spawn_point["pos"], self.spawn_point["level"], animation=False)
+        if self.dict_kb["key_interact"]:
+            # Interact with items or levers
+            self.dict_kb["key_interact"] = 0
+            update_throwable_objects_action(self)
+            if not self.player_grabbing: update_activators_actions(self, self.level)
+
+        # Positions before the step, the renderer interpolates from them
+        self.previous_scroll = tuple(self.scroll)
+        self.previous_positions = {id(o): tuple(o.pos) for o in [self.player] + self.enemies + self.throwable}
+        self.projectiles.save_previous()
+
+        update_camera(self)
+        if self.level_stream is not None:
+            self.stream_level()
         self.screenshake = max(0, self.screenshake - 1)
 
         # --- Transition & Level Switching ---
-        for transition in self.transitions:
+        player_rect = self.player.rect()
+        for i, transition in self.broadphase.query('transitions', player_rect.centerx - 16, player_rect.top,
+                                                   player_rect.centerx, player_rect.bottom):
             if (transition['pos'][0] + 16 > self.player.rect().centerx >= transition['pos'][0] and
                     self.player.rect().bottom >= transition['pos'][1] >= self.player.rect().top):
                 self.level = transition["destination"]
@@ -383,14 +604,16 @@ class Game:
         # --- Teleportation & Checkpoints ---
         if self.teleporting: update_teleporter(self, self.tp_id)
 
-        for checkpoint in self.checkpoints:
+        # Checkpoints are binned by column, see column_bounds
+        for i, checkpoint in self.broadphase.query('checkpoints', self.player.pos[0], 0, self.player.pos[0], 0):
             pos = checkpoint["pos"]
             if pos[0] <= self.player.pos[0] <= pos[0] + 16 and self.current_checkpoint != checkpoint:
                 self.current_checkpoint = checkpoint
                 if self.spawn_point["pos"] == self.current_checkpoint["pos"] :
                     continue
                 self.spawn_point = {"pos": self.current_checkpoint["pos"], "level": self.level}
-                save_game(self, self.current_slot)
+                if self.autosave:
+                    save_game(self, self.current_slot)
 
 
         # Define respawn point based on current section or checkpoint
@@ -405,80 +628,60 @@ class Game:
 
         self.player.disablePlayerInput = self.cutscene or self.moving_visual or self.teleporting
 
-        # --- Rendering Sequence ---
-        # 1. Background
-
-        # 2. Ambient Particles (Leaves)
+        # Ambient Particles (Leaves)
         for rect in self.leaf_spawners:
-            if random.random() * 49999 < rect.width * rect.height:
-                pos = (rect.x + random.random() * rect.width, rect.y + random.random() * rect.height)
-                self.particles.append(Particle(self, 'leaf', pos, velocity=[-0.1, 0.3], frame=random.randint(0, 20)))
-
-        # 3. Projectiles
-        for projectile in self.projectiles[:]:
-            projectile['pos'][0] += projectile['direction'][0]
-            projectile['pos'][1] += projectile['direction'][1]
-            projectile['timer'] += 1
-            img = self.assets[projectile['type']].convert_alpha()
-            self.display.blit(img, (projectile['pos'][0] - img.get_width() / 2 - render_scroll[0],
-                                    projectile['pos'][1] - img.get_height() / 2 - render_scroll[1]))
-
-            # Remove projectiles on wall collision or timeout
-            if self.tilemap.solid_check(projectile['pos']) or projectile['timer'] > 360:
-                self.projectiles.remove(projectile)
-            elif self.player.rect().collidepoint(projectile['pos']):
-                self.player_hp -= projectile.get('damage', 10)
-                self.damage_flash_active = True
-                self.damage_flash_end_time = pygame.time.get_ticks() + self.damage_flash_duration
-                self.projectiles.remove(projectile)
-
-        # 4. Tilemap & Entities
-
-        for activator in self.activators: activator.render(self.display, offset=render_scroll)
+            if self.rng.particles.random() * 49999 < rect.width * rect.height:
+                pos = (rect.x + self.rng.particles.random() * rect.width,
+                       rect.y + self.rng.particles.random() * rect.height)
+                self.particles.spawn('leaf', pos, velocity=(-0.1, 0.3), frame=self.rng.particles.randint(0, 20))
+
+        # Projectiles
+        damage = self.projectiles.update(self.tilemap, self.player.rect())
+        if damage:
+            self.player_hp -= damage
+            self.damage_flash_active = True
+            self.damage_flash_end_time = pygame.time.get_ticks() + self.damage_flash_duration
+
+        # Enemies
+        # Line of sight of every enemy in one batch, their between_check calls then read the results
+        # Only the enemies close to the camera or the player move, and only the thinking ones look for the player,
+        # see active_entities
+        enemies, thinking = active_entities(self.enemies, self.camera_view(), self.player.rect(),
+                                            self.game_clock.ticks, self.broadphase)
+        self.tilemap.reset_raycasts()
+        self.tilemap.raycast_many([self.tilemap.sight_line(self.player.pos, enemy.pos) for enemy in enemies
+                                   if enemy in thinking])
+        update_entities(enemies, self.tilemap, self.batched_physics, thinking=thinking)
+        # Every enemy, the sleeping ones that died or fell have to play their death too
+        updated = set(enemies)
         for enemy in self.enemies.copy():
-            enemy.update(self.tilemap, (0, 0))
-            enemy.render(self.display, offset=render_scroll)
             if enemy.hp <= 0 or enemy.pos[1] > self.max_falling_depth:
                 enemy.set_action("death")
+                if enemy not in updated:
+                    enemy.animation.update()
                 if enemy.animation.done: self.enemies.remove(enemy)
 
-        for spike_hitbox in self.spikes:
+        for spike_hitbox in self.broadphase.near('spikes', self.player.rect()):
             if self.player.rect().colliderect(spike_hitbox.rect()) and not self.player.noclip:
                 deal_dmg(self, spike_hitbox, "player", 200, 0.5)
 
-        # 5. Player & Physics
+        # Player & Physics
         attacking_update(self)
         self.player.physics_process(self.tilemap, self.dict_kb)
-        self.player.render(self.display, offset=render_scroll)
-
-        for o in self.throwable:
-            o.update(self.tilemap, (0, 0))
-            o.render(self.display, offset=render_scroll)
 
-        # 6. Foreground & Lighting
-        if self.show_spikes_hitboxes:
-            for spike_hitbox in self.spikes:
-                spike_hitbox.render(self.display, offset=render_scroll)
-        display_level_fg(self, self.level)
-        apply_lighting(self, render_scroll)
+        update_entities(self.throwable, self.tilemap, self.batched_physics)
 
         # Doors (Colliders updated for physics)
         ds = []
         for door in self.doors:
-            door.update()
-            door.render(self.display, offset=render_scroll)
+            if not door.is_at_rest():
+                door.update()
             if not door.opened:
                 ds.append(door.rect())
-        self.doors_rects = ds
+        self.tilemap.set_colliders(ds)
 
-        # 7. VFX (Sparks/Particles)
-        for spark in self.sparks[:]:
-            if spark.update(): self.sparks.remove(spark)
-            spark.render(self.display, offset=render_scroll)
-
-        for particle in self.particles[:]:
-            if particle.update(): self.particles.remove(particle)
-            particle.render(self.display, offset=render_scroll)
+        # VFX (Particles)
+        self.particles.update()
 
         # --- Death Handling ---
         if self.player.pos[1] > self.max_falling_depth or self.player_hp <= 0:
@@ -486,19 +689,35 @@ class Game:
             for key in self.dict_kb.keys(): self.dict_kb[key] = 0
             self.player_hp = 100
 
-        # --- Input Handling ---
+        self.bin_dynamic_objects()
+
+        # Persist enemy and object state for the level
+        self.levels[self.level]["enemies"] = self.enemies.copy()
+        self.levels[self.level]["activators"] = self.activators.copy()
+        self.levels[self.level]["doors"] = self.doors.copy()
+
+        self.tick_tile_queries = self.tilemap.tile_queries
+        self.tilemap.tile_queries = 0
+        if self.recorder is not None:
+            self.recorder.end_tick(self.dict_kb)
+        self.game_clock.tick()
+
+    def handle_events(self):
+        """Reads the window and keyboard events of the frame, they apply to the next simulation steps"""
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
+                self.stop_recording()
                 pygame.quit()
                 sys.exit()
             if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_ESCAPE:
+                # A headless game has no menu to open
+                if event.key == pygame.K_ESCAPE and self.menu is not None:
                     self.menu.menu_display()
                     for key in self.dict_kb.keys(): self.dict_kb[key] = 0
+                    # The time spent in the menu is not simulated
+                    self.clock.tick()
                 if event.key == pygame.K_e:
-                    # Interact with items or levers
-                    update_throwable_objects_action(self)
-                    if not self.player_grabbing: update_activators_actions(self, self.level)
+                    self.dict_kb["key_interact"] = 1
                 if event.key == pygame.K_F11: toggle_fullscreen(self)
                 if event.key == pygame.K_f and not self.holding_attack:
                     self.dict_kb["key_attack"] = 1
@@ -506,7 +725,7 @@ class Game:
                 if event.key == pygame.K_h:
                     self.toggle_hitboxes()
                 if event.key == pygame.K_r:
-                    kill_player(self, self.screen, self.spawn_point["pos"], self.spawn_point["level"], animation=False)
+                    self.dict_kb["key_respawn"] = 1
             if event.type == pygame.KEYUP:
                 if event.key == pygame.K_f:
                     self.dict_kb["key_attack"] = 0
@@ -517,19 +736,71 @@ class Game:
                 key_map = self.get_key_map()
                 if event.key in key_map: self.dict_kb[key_map[event.key]] = state
 
+    def render_offset(self, obj, render_scroll, alpha):
+        """Offset drawing a moving object alpha of the way between its position before and after the last step"""
+        pos = obj['pos'] if isinstance(obj, dict) else obj.pos
+        return interpolated_offset(render_scroll, self.previous_positions.get(id(obj)), pos, alpha)
+
+    def render_frame(self, alpha):
+        """
+        Draws the current state of the game, the camera and the moving objects alpha of the way between their
+        previous and current step.
+        """
+        scroll = interpolate(self.previous_scroll, self.scroll, alpha)
+        render_scroll = (round(scroll[0]), round(scroll[1]))
+
+        # --- Rendering Sequence ---
+        # 1. Background
+        display_level_bg(self, self.level)
+        self.tilemap.render(self.display, offset=render_scroll)
+        self.tilemap.render_over(self.display, offset=render_scroll)
+
+        # 2. Projectiles
+        self.projectiles.render(self.display, self.assets, render_scroll, alpha)
+
+        # 3. Tilemap & Entities
+        # Objects out of the view are not drawn, the margin keeps sprites bigger than their rect
+        view = pygame.Rect(render_scroll, self.display.get_size()).inflate(2 * ACTIVE_MARGIN, 2 * ACTIVE_MARGIN)
+        for activator in self.broadphase.near('activators', view):
+            activator.render(self.display, offset=render_scroll)
+        for enemy in self.broadphase.near('enemies', view):
+            if view.colliderect(enemy.rect()):
+                enemy.render(self.display, offset=self.render_offset(enemy, render_scroll, alpha))
+
+        # 4. Player
+        player_offset = self.render_offset(self.player, render_scroll, alpha)
+        self.player.render(self.display, offset=player_offset)
+
+        for o in self.broadphase.near('throwable', view):
+            if view.colliderect(o.rect()):
+                o.render(self.display, offset=self.render_offset(o, render_scroll, alpha))
+
+        # 5. Foreground & Lighting
+        if self.show_spikes_hitboxes:
+            for spike_hitbox in self.spikes:
+                spike_hitbox.render(self.display, offset=render_scroll)
+        display_level_fg(self, self.level)
+        apply_lighting(self, render_scroll, player_offset)
+
+        for door in self.doors:
+            door.render(self.display, offset=render_scroll)
+
+        # 6. VFX (Sparks/Particles)
+        self.particles.render(self.display, offset=render_scroll)
+
         # --- Final UI Blits ---
         update_bottom_text(self)
+        if self.show_spikes_hitboxes:
+            if self.debug_font is None:
+                self.debug_font = pygame.font.Font(None, 16)
+            self.display.blit(self.debug_font.render("tile queries/tick: " + str(self.tick_tile_queries), True,
+                                                     (255, 255, 255)), (4, 4))
         if self.cutscene:
             draw_cutscene_border(self.display)
         else:
             #draw_health_bar(self)
             pass
 
-        # Persist enemy and object state for the level
-        self.levels[self.level]["enemies"] = self.enemies.copy()
-        self.levels[self.level]["activators"] = self.activators.copy()
-        self.levels[self.level]["doors"] = self.doors.copy()
-
         # Handle Circle Transition Effect
         if self.transition:
             transition_surf = pygame.Surface(self.display.get_size())
@@ -560,13 +831,6 @@ class Game:
 
         pygame.display.update()
 
-        if not self.game_initialized:
-            self.game_initialized = True
-            if not os.path.exists(f"saves/save_{self.current_slot}.json"):
-                save_game(self, self.current_slot)
-
-        self.clock.tick(60)
-
     def run(self):
         """
         The main program entry point.
@@ -586,6 +850,8 @@ class Game:
                 # If a profile is chosen, start the game; otherwise return to intro
                 if self.menu.profile_selection_menu():
                     self.state = "PLAYING"
+                    if self.record_path is not None and self.recorder is None:
+                        self.start_recording(self.record_path)
                 else:
                     self.state = "START_SCREEN"
 
@@ -597,4 +863,8 @@ class Game:
 
 if __name__ == "__main__":
     # Instantiate the game and start the loop
-    Game().run()
\ No newline at end of file
+    # python main.py --record path.rec records the inputs of the session, see scripts.replay to play it back
+    game = Game()
+    if "--record" in sys.argv:
+        game.record_path = sys.argv[sys.argv.index("--record") + 1]
+    game.run()
\ No newline at end of file
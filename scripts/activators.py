@@ -2,7 +2,6 @@ import pygame
 import time
 import json
 import random
-from scripts.particle import Particle
 from scripts.display import move_visual, screen_shake
 
 class Activator:
@@ -18,7 +17,7 @@ class Activator:
         self.activated = "progressive_teleporter" not in self.type
 
     def toggle(self):#Basically change the state of the lever from activated to not activated. Takes into account the countdown(useful for silly people trying to destroy the game)
-        current_time = time.time()
+        current_time = self.game.game_clock.time()
         if current_time - self.last_interaction_time >= self.interaction_cooldown:
             self.state = int(not self.state)
             self.last_interaction_time = current_time
@@ -46,20 +45,19 @@ def load_activators_actions():
 def update_teleporter(game, t_id):
     if t_id is not None:
         action = game.activators_actions[str(game.level)]["teleporters"][str(t_id)]
-        if time.time() - game.last_teleport_time < action["time"] - 0.2:
-            pos = (game.player.rect().x + random.random() * game.player.rect().width,
-                   game.player.rect().y + 5 + random.random() * game.player.rect().height)
-            game.particles.append(
-                Particle(game, 'crystal_fragment', pos, velocity=[-0.1, -4], frame=0))
+        if game.game_clock.time() - game.last_teleport_time < action["time"] - 0.2:
+            pos = (game.player.rect().x + game.rng.particles.random() * game.player.rect().width,
+                   game.player.rect().y + 5 + game.rng.particles.random() * game.player.rect().height)
+            game.particles.spawn('crystal_fragment', pos, velocity=(-0.1, -4))
             pass
         else:
-            game.last_teleport_time = time.time()
+            game.last_teleport_time = game.game_clock.time()
             game.player.pos = action["dest"].copy()
             game.teleporting = False
             game.tp_id = None
 
 def update_activators_actions(game, level):
-    for activator in game.activators:
+    for activator in game.broadphase.near('activators', game.player.rect().inflate(2, 2)):
         if activator.can_interact(game.player.rect()):
             activator_id = str(activator.id)
             if activator_id in game.activators_actions[str(level)][activator.type.rsplit('_', 1)[-1]+'s']:
@@ -87,6 +85,6 @@ def update_activators_actions(game, level):
                             break
 
                 if action["type"] in ("normal_tp", "progressive_tp"):
-                    game.last_teleport_time = time.time()
+                    game.last_teleport_time = game.game_clock.time()
                     game.teleporting = True
                     game.tp_id = activator_id
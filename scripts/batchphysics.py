@@ -0,0 +1,164 @@
+import numpy as np
+import pygame
+
+from scripts.tilegrid import SOLID, ONE_WAY
+
+# Groups of entities smaller than this are moved one by one, numpy costs more than it saves on a few entities.
+# Measured with benchmarks.entity_physics: one by one is faster up to about 64 entities, batching from about 80
+BATCH_MIN_ENTITIES = 80
+
+
+def overlapping(x, y, w, h, rx, ry, rw, rh):
+    # Rect.colliderect of arrays of rects
+    return (x < rx + rw) & (x + w > rx) & (y < ry + rh) & (y + h > ry)
+
+
+class PhysicsBatch:
+    """The positions, velocities and sizes of a group of entities packed in arrays, moved together by move().
+
+    The entities keep their state (AI, saves and rendering read it), the batch packs it for one move and writes the
+    results back. move() gives the same results as PhysicsEntity.move on each entity: the cells around all the
+    entities are read from the solidity bitmap at once, then every cell PhysicsEntity.move would try, in the same
+    order, is tried on all the entities at once. Doors are few, only the entities touching one try them one by one."""
+
+    def __init__(self, tilemap, entities, movements):
+        self.tilemap = tilemap
+        self.entities = entities
+        self.movements = [(m[0] + e.velocity[0], m[1] + e.velocity[1]) for e, m in zip(entities, movements)]
+        sizes = np.array([e.size for e in entities], dtype=np.int64).reshape(-1, 2)
+        self.w, self.h = sizes[:, 0], sizes[:, 1]
+        self.collisions = {side: np.zeros(len(entities), dtype=bool) for side in ('up', 'down', 'right', 'left')}
+
+    def cells(self, x0, y0, x1, y1, mask):
+        """array x4, int -> tuple
+        the cells of the boxes x0, y0, x1, y1 (one per entity, in cells, included) in the order the tilemap lists
+        them (column by column) as (xs, ys, in mask) arrays of shape (entities, cells)"""
+        columns, rows = int((x1 - x0).max(initial=0)) + 1, int((y1 - y0).max(initial=0)) + 1
+        dx, dy = np.divmod(np.arange(columns * rows), rows)
+        xs, ys = x0[:, None] + dx, y0[:, None] + dy
+        self.tilemap.tile_queries += 1
+        blocking = (self.tilemap.grid.solidity_of_cells(xs, ys) & mask) != 0
+        return xs, ys, blocking & (xs <= x1[:, None]) & (ys <= y1[:, None])
+
+    def door_lists(self, region, rx, ry):
+        """tuple, array, array -> list
+        (entity index, colliders in its list) of the entities overlapping one of the colliders Tilemap.colliders_in
+        gives for their region. The others can't hit any, whatever the order they are tried in"""
+        if not self.tilemap.colliders:
+            return []
+        ts = self.tilemap.tile_size
+        x0, y0, x1, y1 = (v[:, None] for v in region)
+        doors = np.array([tuple(door) for door in self.tilemap.colliders], dtype=np.int64)
+        dx, dy, dw, dh = doors[:, 0], doors[:, 1], doors[:, 2], doors[:, 3]
+        near = overlapping((x0 - 1) * ts, (y0 - 1) * ts, (x1 - x0 + 3) * ts, (y1 - y0 + 3) * ts, dx, dy, dw, dh)
+        hit = near & overlapping(rx[:, None], ry[:, None], self.w[:, None], self.h[:, None], dx, dy, dw, dh)
+        return [(i, [self.tilemap.colliders[j] for j in np.nonzero(near[i])[0].tolist()])
+                for i in np.nonzero(hit.any(axis=1))[0].tolist()]
+
+    def region_around(self, x, y):
+        # Tilemap.region_around of every entity
+        ts = self.tilemap.tile_size
+        # Like the tilemap, the row is found with the width
+        tx = np.floor_divide(x + self.w / 2, ts).astype(np.int64)
+        ty = np.floor_divide(y + self.w / 2, ts).astype(np.int64)
+        return tx - 1, ty - 1, tx + np.ceil(self.w / ts).astype(np.int64), ty + np.ceil(self.h / ts).astype(np.int64)
+
+    def region_under(self, x, y):
+        # Tilemap.region_under of every entity
+        x0, y0, x1, y1 = self.region_around(x, y)
+        return x0, y1, x1, y1
+
+    def swept(self, axis, positions):
+        # Tilemap.swept_move of every entity, only the moves longer than a tile have to be swept
+        moves = []
+        for entity, pos, movement in zip(self.entities, positions, self.movements):
+            move = movement[axis]
+            if abs(move) >= self.tilemap.tile_size:
+                mask = SOLID if axis == 0 or move <= 0 else SOLID | ONE_WAY
+                move = self.tilemap.swept_move(pos, entity.size, axis, move, mask, colliders=axis == 0 or move > 0)
+            moves.append(move)
+        return moves
+
+    def move(self):
+        # PhysicsEntity.move of every entity
+        w, h = self.w, self.h
+        fm = np.array(self.movements, dtype=np.float64).reshape(-1, 2)
+
+        # Horizontal: the python values keep the types PhysicsEntity.move gives (ints until something is added)
+        xs = [e.pos[0] + move for e, move in zip(self.entities, self.swept(0, [e.pos for e in self.entities]))]
+        ys = [e.pos[1] for e in self.entities]
+        x, y = np.array(xs, dtype=np.float64), np.array(ys, dtype=np.float64)
+        rx, ry = np.trunc(x), np.trunc(y)
+        snapped = np.zeros(len(xs), dtype=bool)
+        region = self.region_around(x, y)
+        for rects, hits in self.rects(region, SOLID):
+            hit = hits & overlapping(rx, ry, w, h, *rects)
+            rx = np.where(hit & (fm[:, 0] > 0), rects[0] - w, rx)
+            rx = np.where(hit & (fm[:, 0] < 0), rects[0] + rects[2], rx)
+            self.collisions['right'] |= hit & (fm[:, 0] > 0)
+            self.collisions['left'] |= hit & (fm[:, 0] < 0)
+            snapped |= hit
+        # Doors come after the cells, the few entities touching one go through them like in PhysicsEntity.move
+        for i, doors in self.door_lists(region, rx, ry):
+            rect = pygame.Rect(int(rx[i]), int(ry[i]), int(w[i]), int(h[i]))
+            for door in doors:
+                if rect.colliderect(door):
+                    if fm[i, 0] > 0:
+                        rect.right = door.left
+                        self.collisions['right'][i] = True
+                    if fm[i, 0] < 0:
+                        rect.left = door.right
+                        self.collisions['left'][i] = True
+                    snapped[i] = True
+            rx[i] = rect.x
+        xs = [int(v) if snap else value for value, v, snap in zip(xs, rx.tolist(), snapped.tolist())]
+        x = np.where(snapped, rx, x)
+
+        # Vertical, down on the row under the entities then up against the solid cells around them
+        ys = [value + move for value, move in zip(ys, self.swept(1, [[a, b] for a, b in zip(xs, ys)]))]
+        y = np.array(ys, dtype=np.float64)
+        rx, ry = np.trunc(x), np.trunc(y)
+        snapped = np.zeros(len(ys), dtype=bool)
+        region = self.region_under(x, y)
+        for rects, hits in self.rects(region, SOLID | ONE_WAY):
+            hit = hits & overlapping(rx, ry, w, h, *rects)
+            ry = np.where(hit & (fm[:, 1] > 0), rects[1] - h, ry)
+            self.collisions['down'] |= hit & (fm[:, 1] > 0)
+            snapped |= hit
+        for i, doors in self.door_lists(region, rx, ry):
+            rect = pygame.Rect(int(rx[i]), int(ry[i]), int(w[i]), int(h[i]))
+            for door in doors:
+                if rect.colliderect(door):
+                    if fm[i, 1] > 0:
+                        rect.bottom = door.top
+                        self.collisions['down'][i] = True
+                    snapped[i] = True
+            ry[i] = rect.y
+        for rects, hits in self.rects(self.region_around(x, np.where(snapped, ry, y)), SOLID):
+            hit = hits & overlapping(rx, ry, w, h, *rects)
+            ry = np.where(hit & (fm[:, 1] < 0), rects[1] + rects[3], ry)
+            self.collisions['up'] |= hit & (fm[:, 1] < 0)
+            # PhysicsEntity.move puts the entity on its rect for every solid cell around it
+            snapped |= hits
+        ys = [int(v) if snap else value for value, v, snap in zip(ys, ry.tolist(), snapped.tolist())]
+
+        collisions = {side: hits.tolist() for side, hits in self.collisions.items()}
+        for i, entity in enumerate(self.entities):
+            entity.pos[0], entity.pos[1] = xs[i], ys[i]
+            entity.collisions = {side: hits[i] for side, hits in collisions.items()}
+
+    def rects(self, region, mask):
+        """tuple, int -> iterator
+        (rect, entities whose list holds it) of the cells of the regions, a rect is (x, y, w, h) of arrays"""
+        ts = self.tilemap.tile_size
+        xs, ys, blocking = self.cells(*region, mask)
+        for i in range(xs.shape[1]):
+            if blocking[:, i].any():
+                yield (xs[:, i] * ts, ys[:, i] * ts, ts, ts), blocking[:, i]
+
+
+def move_batch(entities, movements, tilemap):
+    """list, list, Tilemap -> None
+    PhysicsEntity.move(tilemap, movement) for every entity and its movement, in one batch"""
+    if entities:
+        PhysicsBatch(tilemap, entities, movements).move()
@@ -0,0 +1,69 @@
+from scripts.spatialhash import SpatialHash
+
+# Side of the cells of the broadphase grid, in pixels
+BROADPHASE_CELL = 64
+# Pixels a dynamic object may have moved between its binning and a query, entities move less than a tile per tick
+DYNAMIC_SLACK = 16
+
+
+def entity_bounds(entity):
+    return entity.pos[0], entity.pos[1], entity.size[0], entity.size[1]
+
+
+def rect_bounds(obj):
+    # Activators hold their rect, spikes compute it
+    rect = obj.rect() if callable(obj.rect) else obj.rect
+    return rect.x, rect.y, rect.width, rect.height
+
+
+def point_bounds(obj):
+    # Transitions are points (dicts with a pos)
+    return obj['pos'][0], obj['pos'][1], 0, 0
+
+
+def column_bounds(obj):
+    # Checkpoints are crossed anywhere along their column, they are all binned on the row 0
+    return obj['pos'][0], 0, 16, 0
+
+
+class Broadphase:
+    """Uniform grid of the objects of the level, one SpatialHash per layer ('spikes', 'enemies'...), so that the
+    objects around a box are found by looking at the cells around it instead of at the whole level.
+
+    Objects are binned by the top left corner of their bounds, a query looks as far before the box as the biggest
+    object of its layer so that it finds all the objects overlapping it. Static layers are binned when the level or
+    its loaded regions change, dynamic ones after the objects moved, with some slack for the moves made before the
+    next binning. Queries give candidates in the order of the binned list, callers run the exact test they ran on
+    the whole list on them."""
+
+    def __init__(self, cell_size=BROADPHASE_CELL):
+        self.cell_size = cell_size
+        # Layer -> (SpatialHash, margin before the box in x and y, margin after it)
+        self.layers = {}
+
+    def bin(self, layer, objects, bounds, slack=0):
+        """str, list, function, int -> None
+        replaces the objects of a layer, bounds gives the (x, y, w, h) of an object"""
+        index = SpatialHash(self.cell_size)
+        width = height = 0
+        for i, obj in enumerate(objects):
+            x, y, w, h = bounds(obj)
+            index.insert(i, x, y, (i, obj))
+            width, height = max(width, w), max(height, h)
+        self.layers[layer] = (index, width + slack, height + slack, slack)
+
+    def query(self, layer, left, top, right, bottom):
+        """str, float, float, float, float -> list
+        (index in the binned list, object) of the objects of a layer that may overlap the box, sorted by index"""
+        if layer not in self.layers:
+            return []
+        index, width, height, slack = self.layers[layer]
+        return index.query(left - width, top - height, right + slack, bottom + slack)
+
+    def near(self, layer, rect):
+        """str, Rect -> list
+        the objects of a layer that may overlap rect, in the order of the binned list"""
+        return [obj for i, obj in self.query(layer, rect.left, rect.top, rect.right, rect.bottom)]
+
+    def clear(self):
+        self.layers = {}
@@ -3,8 +3,6 @@ import time
 import pygame
 import random
 
-from scripts.particle import Particle
-from scripts.spark import Spark
 from pygame.sprite import collide_rect
 from scripts.sound import *
 
@@ -30,20 +28,19 @@ class Door:
 
         if self.type == 'breakable_stalactite' and self.game.attacking and self.rect().colliderect(
                 self.game.player.rect().inflate(32, 32)):
-            pos = (self.rect().x + random.random() * self.rect().width,
-                   self.rect().y + 5 + random.random() * self.rect().height)
-            self.game.particles.append(
-                Particle(self.game, 'crystal_fragment', pos, velocity=[-0.1, 1.2], frame=0))
+            pos = (self.rect().x + self.game.rng.particles.random() * self.rect().width,
+                   self.rect().y + 5 + self.game.rng.particles.random() * self.rect().height)
+            self.game.particles.spawn('crystal_fragment', pos, velocity=(-0.1, 1.2))
             self.open()
 
         if self.action == "opening" and not self.opened:
-            if time.time() - self.last_time_interacted >= self.opening_speed:
+            if self.game.game_clock.time() - self.last_time_interacted >= self.opening_speed:
                 self.set_action("opened")
                 self.opened = True
 
         if self.action == "closing":
             self.opened = False
-            if time.time() - self.last_time_interacted >= self.opening_speed:
+            if self.game.game_clock.time() - self.last_time_interacted >= self.opening_speed:
                 self.set_action("closed")
 
         if not self.opened and self.action == "opened":
@@ -51,10 +48,15 @@ class Door:
         elif self.opened and self.action != "opened":
             self.set_action("opened")
 
+    def is_at_rest(self):
+        # Fully opened or closed with its animation over, update() would not change anything
+        return (self.action in ("closed", "opened") and self.animation.done and self.type != 'breakable_stalactite'
+                and self.opened == (self.action == "opened"))
+
     def open(self):#mainly useful for the state of door and sound play
         if not self.opened:
             self.set_action("opening")
-            self.last_time_interacted = time.time()
+            self.last_time_interacted = self.game.game_clock.time()
 
             if self.type == 'breakable_stalactite':
                 self.breaking_sound.play()
@@ -62,7 +64,7 @@ class Door:
     def close(self):#not useful for the moment but might in the future
         if self.opened:
             self.set_action("closing")
-            self.last_time_interacted = time.time()
+            self.last_time_interacted = self.game.game_clock.time()
 
     def rect(self):#is very useful because when the door is broken the player has to be able to go through the updated frame
         if self.action == "opened":
@@ -4,6 +4,8 @@ import random
 import math
 
 from scripts.display import update_light
+from scripts.tilegrid import SOLID, ONE_WAY
+from scripts.batchphysics import move_batch, BATCH_MIN_ENTITIES
 
 
 class PhysicsEntity:
@@ -39,13 +41,25 @@ class PhysicsEntity:
 
     def update(self, tilemap, movement=(0, 0)):
         # Update entity position, handle collisions with environment and apply physics
+        movement = self.prepare_update(tilemap, movement)
+        if movement is not None:
+            self.move(tilemap, movement)
+            self.finish_update(movement)
+
+    def prepare_update(self, tilemap, movement, think=True):
+        # What the entity does before moving (AI...), returns its movement for the tick or None if it doesn't move.
+        # think is False on the ticks where it only keeps doing what it decided, see active_entities
+        return movement
+
+    def move(self, tilemap, movement):
+        # Moves by movement + velocity and resolves the collisions with the environment, see also move_batch
         self.collisions = {'up': False, 'down': False, 'right': False, 'left': False}
 
         frame_movement = (movement[0] + self.velocity[0], movement[1] + self.velocity[1])
 
-        self.pos[0] += frame_movement[0]
+        self.pos[0] += tilemap.swept_move(self.pos, self.size, 0, frame_movement[0])
         entity_rect = self.rect()
-        for rect in tilemap.physics_rects_around(self.pos, self.size) + self.game.doors_rects:
+        for rect in tilemap.colliders_around(self.pos, self.size):
             if entity_rect.colliderect(rect):
                 if frame_movement[0] > 0:
                     entity_rect.right = rect.left
@@ -55,9 +69,12 @@ class PhysicsEntity:
                     self.collisions['left'] = True
                 self.pos[0] = entity_rect.x
 
-        self.pos[1] += frame_movement[1]
+        # Moving up, the entity is only pushed out of solid tiles (physics_rects_around), doors are not swept
+        self.pos[1] += tilemap.swept_move(self.pos, self.size, 1, frame_movement[1],
+                                          SOLID | ONE_WAY if frame_movement[1] > 0 else SOLID,
+                                          colliders=frame_movement[1] > 0)
         entity_rect = self.rect()
-        for rect in tilemap.physics_rects_under(self.pos, self.size) + self.game.doors_rects:
+        for rect in tilemap.colliders_under(self.pos, self.size):
             if entity_rect.colliderect(rect):
                 if frame_movement[1] > 0:
                     entity_rect.bottom = rect.top
@@ -70,6 +87,8 @@ class PhysicsEntity:
                     self.collisions['up'] = True
             self.pos[1] = entity_rect.y
 
+    def finish_update(self, movement):
+        # Orientation, gravity and animation once the entity moved
         if movement[0] > 0:
             self.flip = False
         if movement[0] < 0:
@@ -119,27 +138,29 @@ class Enemy(PhysicsEntity):
         self.knockback_dir = [0, 0]
         self.animation = self.game.assets[self.enemy_type + '/idle'].copy()
 
-    def update(self, tilemap, movement=(0, 0)):
-        # Update enemy behavior, AI and combat state
+    def prepare_update(self, tilemap, movement, think=True):
+        # Update enemy behavior, AI and combat state, returns the movement it decided. Without think, the checks
+        # against the player (distance, line of sight) are skipped and the enemy keeps walking or chasing
         self.player_x = self.game.player.rect().centerx
         self.enemy_x = self.rect().centerx
-        self.is_attacked = (self.game.attacking
+        self.is_attacked = (think
+                            and self.game.attacking
                             and self.distance_with_player() <= self.game.player_attack_dist
                             and self.player_looking_at_entity()
                             and not self.is_attacked)
 
         if self.hp <= 0:
             self.animation.update()
-            return
+            return None
 
         if self.is_attacked and not self.hit:
             self.is_attacking = True
             self.is_chasing = True
-            if time.time() - self.game.player_last_attack_time >= self.game.player_attack_time:
+            if self.game.game_clock.time() - self.game.player_last_attack_time >= self.game.player_attack_time:
                 deal_dmg(self.game, 'player', self)
                 self.stunned = True
                 self.hit = True
-                self.last_stun_time = time.time()
+                self.last_stun_time = self.game.game_clock.time()
 
         if not self.game.holding_attack and (
                 not ("attack" in self.game.player.action) or self.game.player.animation.done):
@@ -153,7 +174,7 @@ class Enemy(PhysicsEntity):
             self.is_attacking = False
 
             # Calculate time since stun started
-            stun_elapsed = time.time() - self.last_stun_time
+            stun_elapsed = self.game.game_clock.time() - self.last_stun_time
             stun_duration = 0.5
 
             if stun_elapsed >= stun_duration:
@@ -162,12 +183,8 @@ class Enemy(PhysicsEntity):
                 self.is_chasing = True
 
             else:
-                # Add stun animation/movement here
-                movement = deal_knockback(self.game.player, self, 1)
-                super().update(tilemap, movement=movement)
-                self.flip = self.player_x < self.enemy_x
-                self.animations(movement)
-                return  # Skip the rest of the normal update logic
+                # Add stun animation/movement here, knocked back instead of the normal behavior
+                return deal_knockback(self.game.player, self, 1)
         self.knockback_dir = [0, 0]
 
         # Regular (non-stunned) behavior continues below
@@ -184,9 +201,15 @@ class Enemy(PhysicsEntity):
                 self.is_chasing = False
 
         elif not (self.is_attacking or self.is_chasing):
-            rand = random.random()
+            rand = self.game.rng.ai.random()
             if rand < 0.01:
-                self.walking = random.randint(30, 120)
+                self.walking = self.game.rng.ai.randint(30, 120)
+
+        if not think:
+            if self.is_chasing and not self.is_attacking and tilemap.solid_check(
+                    (self.rect().centerx + (-7 if self.flip else 7), self.pos[1] + 23)):
+                movement = (movement[0] - 1 if self.flip else 1, movement[1])
+            return movement
 
         if self.distance_with_player() <= self.vision_distance:
             if tilemap.solid_check((self.rect().centerx + (-7 if self.flip else 7), self.pos[1] + 23)):
@@ -219,7 +242,13 @@ class Enemy(PhysicsEntity):
         if self.distance_with_player() > self.vision_distance and self.is_chasing:
             self.is_chasing = False
 
-        super().update(tilemap, movement=movement)
+        return movement
+
+    def finish_update(self, movement):
+        super().finish_update(movement)
+        if self.stunned:
+            # Knocked back, facing the player
+            self.flip = self.player_x < self.enemy_x
         self.animations(movement)
 
     def set_action(self, action):
@@ -231,12 +260,12 @@ class Enemy(PhysicsEntity):
     def update_attack(self):
         # Handle enemy attack logic and timing
         if self.is_attacking and not self.stunned:
-            if time.time() - self.first_attack_time >= self.attack_time / 5:
+            if self.game.game_clock.time() - self.first_attack_time >= self.attack_time / 5:
                 deal_dmg(self.game, self, 'player', self.attack_dmg, self.attack_time)
                 self.is_dealing_damage = False
         elif not self.is_attacking:
             self.last_attack_time = 0
-            self.first_attack_time = time.time()
+            self.first_attack_time = self.game.game_clock.time()
 
     def check_if_player_close(self, vision_distance, mono_direction=True):
         # Check if the player is within detection distance and line of sight
@@ -315,19 +344,16 @@ class DistanceEnemy(Enemy):
     def update_attack(self):
         # Handle ranged attack logic and create projectiles
         if self.is_attacking and not self.stunned:
-            if time.time() - self.first_attack_time >= self.attack_time / 5:
-                if time.time() - self.last_attack_time >= self.attack_time:
-                    self.last_attack_time = time.time()
-                    self.game.projectiles.append({"type": self.enemy_type + "_projectile",
-                                                  "pos": self.pos.copy(),
-                                                  "direction": [-1 if self.flip else 1, 0],
-                                                  "timer": 0,
-                                                  "dmg": 10})
+            if self.game.game_clock.time() - self.first_attack_time >= self.attack_time / 5:
+                if self.game.game_clock.time() - self.last_attack_time >= self.attack_time:
+                    self.last_attack_time = self.game.game_clock.time()
+                    self.game.projectiles.spawn(self.enemy_type + "_projectile", self.pos,
+                                                (-1 if self.flip else 1, 0), 10)
                     self.is_dealing_damage = True
                 self.is_dealing_damage = False
         elif not self.is_attacking:
             self.last_attack_time = 0
-            self.first_attack_time = time.time()
+            self.first_attack_time = self.game.game_clock.time()
 
 class Throwable(PhysicsEntity):
     def __init__(self, game, o_type, pos, size):
@@ -341,26 +367,39 @@ class Throwable(PhysicsEntity):
             pass
         self.grabbed = False
         self.grabbing_entity = None
+        # (grid version, colliders version) of the tiles and doors the object sleeps on, None while it moves
+        self.resting_on = None
+        self.last_pos = None
 
-    def update(self, tilemap, movement=(0, 0)):
-        # Update physics for throwable objects, handle grabbing state
+    def prepare_update(self, tilemap, movement, think=True):
+        # Handle grabbing state, a free object moves with physics (handles physics and movement)
         if not self.grabbed:
             self.game.player_grabbing = False
+            if (self.resting_on == (tilemap.grid.version, tilemap.colliders_version)
+                    and not (self.velocity[0] or self.velocity[1]) and tuple(self.pos) == self.last_pos):
+                # Lying still and nothing moved it or changed around it since, physics would leave it there
+                return None
+            self.resting_on = None
+            self.last_pos = tuple(self.pos)
+            return (0, 0)
+
+        self.game.player_grabbing = True
+        self.pos = [
+            self.grabbing_entity.rect().centerx + 5 if self.grabbing_entity.last_direction == 1 else self.grabbing_entity.rect().centerx - 15,
+            self.grabbing_entity.rect().centery - 10]
+        return None
+
+    def finish_update(self, movement):
+        super().finish_update(movement)
+        # Check if we've collided with something
+        # If we hit something horizontally, stop horizontal movement
+        if self.collisions["left"] or self.collisions["right"] or self.collisions["down"] or self.collisions["up"]:
+            self.velocity[0] = 0
+        # We keep vertical velocity for gravity effects
 
-            # Call parent update (handles physics and movement)
-            super().update(tilemap, movement=(0, 0))
-
-            # Check if we've collided with something (implement based on your collision system)
-            # If we hit something horizontally, stop horizontal movement
-            if self.collisions["left"] or self.collisions["right"] or self.collisions["down"] or self.collisions["up"]:
-                self.velocity[0] = 0
-            # We keep vertical velocity for gravity effects
-
-        else:
-            self.game.player_grabbing = True
-            self.pos = [
-                self.grabbing_entity.rect().centerx + 5 if self.grabbing_entity.last_direction == 1 else self.grabbing_entity.rect().centerx - 15,
-                self.grabbing_entity.rect().centery - 10]
+        # Landed where it already was: asleep until it is thrown, grabbed or the tiles and doors around change
+        if self.collisions["down"] and not (self.velocity[0] or self.velocity[1]) and tuple(self.pos) == self.last_pos:
+            self.resting_on = (self.game.tilemap.grid.version, self.game.tilemap.colliders_version)
 
     def can_interact(self, player_rect, interaction_distance=2):
         # Check if player is close enough to interact with this object
@@ -492,7 +531,7 @@ def kill_player(game, screen, spawn_pos, spawn_level, animation=True):
     # Handle player death, respawn them at the proper position
     game.cutscene = False
 
-    if animation:
+    if animation and not game.headless:
         death_animation(screen)
     game.level = spawn_level
     game.load_level(spawn_level, transition_effect=animation)
@@ -503,22 +542,22 @@ def kill_player(game, screen, spawn_pos, spawn_level, animation=True):
 
 def deal_dmg(game, source, target, att_dmg=5, att_time=1):
     # Handle damage dealing between entities
-    current_time = time.time()
+    current_time = game.game_clock.time()
     if target == "player" and current_time - source.last_attack_time >= att_time:
-        source.last_attack_time = time.time()
+        source.last_attack_time = current_time
         game.player_hp -= att_dmg
         game.damage_flash_active = True
         source.is_dealing_damage = True
         game.damage_flash_end_time = pygame.time.get_ticks() + game.damage_flash_duration
 
     elif target != "player" and current_time - game.player_last_attack_time >= game.player_attack_time:
-        game.player_last_attack_time = time.time()
+        game.player_last_attack_time = current_time
         target.hp -= game.player_dmg
 
 
 def deal_knockback(entity, target, strenght, knockback=None, stun_duration=0.5):
     # Apply knockback force to targets when hit
-    stun_elapsed = time.time() - target.last_stun_time
+    stun_elapsed = target.game.game_clock.time() - target.last_stun_time
     knockback_force = max(0, strenght * (1.0 - stun_elapsed / stun_duration))
 
     if not target.knockback_dir[0] and not target.knockback_dir[1] and knockback is None:
@@ -527,9 +566,64 @@ def deal_knockback(entity, target, strenght, knockback=None, stun_duration=0.5):
     return target.knockback_dir[0] * knockback_force, target.knockback_dir[1] * knockback_force
 
 
+# Activity levels: entities within ACTIVE_MARGIN of the view or the player think and move every tick, the ones within
+# ACTIVATION_RADIUS of them move every tick but think every REDUCED_RATE ticks, the others sleep until the camera or
+# the player come close
+ACTIVE_MARGIN = 32
+ACTIVATION_RADIUS = 320
+REDUCED_RATE = 4
+
+
+def active_entities(entities, view, player_rect, tick, broadphase=None, layer='enemies'):
+    """list, Rect, Rect, int, Broadphase, str -> list, set
+    the entities to update this tick and the set of the ones that think, the ones thinking at the reduced rate are
+    spread over its ticks. With a broadphase where the entities are binned as layer, only the ones around the view
+    and the player are looked at"""
+    active = []
+    thinking = set()
+    on_screen = (view.inflate(2 * ACTIVE_MARGIN, 2 * ACTIVE_MARGIN),
+                 player_rect.inflate(2 * ACTIVE_MARGIN, 2 * ACTIVE_MARGIN))
+    near = (view.inflate(2 * ACTIVATION_RADIUS, 2 * ACTIVATION_RADIUS),
+            player_rect.inflate(2 * ACTIVATION_RADIUS, 2 * ACTIVATION_RADIUS))
+    candidates = enumerate(entities)
+    if broadphase is not None:
+        found = {}
+        for rect in near:
+            found.update(broadphase.query(layer, rect.left, rect.top, rect.right, rect.bottom))
+        candidates = sorted(found.items(), key=lambda candidate: candidate[0])
+    for i, entity in candidates:
+        rect = entity.rect()
+        if rect.collidelist(on_screen) >= 0:
+            active.append(entity)
+            thinking.add(entity)
+        elif rect.collidelist(near) >= 0:
+            active.append(entity)
+            if (tick + i) % REDUCED_RATE == 0:
+                thinking.add(entity)
+    return active, thinking
+
+
+def update_entities(entities, tilemap, batched=True, batch_min=BATCH_MIN_ENTITIES, thinking=None):
+    """list, Tilemap, bool, int, set -> None
+    update() of every entity, the moves are done in one batch (see batchphysics) when batched and at least
+    batch_min entities move. When thinking is given, the entities out of it move without thinking"""
+    moving = []
+    for entity in entities:
+        movement = entity.prepare_update(tilemap, (0, 0), thinking is None or entity in thinking)
+        if movement is not None:
+            moving.append((entity, movement))
+    if batched and len(moving) >= batch_min:
+        move_batch([entity for entity, movement in moving], [movement for entity, movement in moving], tilemap)
+    else:
+        for entity, movement in moving:
+            entity.move(tilemap, movement)
+    for entity, movement in moving:
+        entity.finish_update(movement)
+
+
 def update_throwable_objects_action(game):
-    # Handle interaction with throwable objects
-    for o in game.throwable:
+    # Handle interaction with throwable objects, the grabbed one is held next to the player
+    for o in game.broadphase.near('throwable', game.player.rect().inflate(2, 2)):
         if not o.grabbed and not game.player_grabbing:
             if o.can_interact(game.player.rect()):
                 o.grab(game.player)
@@ -541,7 +635,7 @@ def update_throwable_objects_action(game):
 
 def attacking_update(game):
     # Update player attack state and handle attack direction
-    game.attacking = ((game.dict_kb["key_attack"] == 1 and time.time() - game.player_last_attack_time >= 0.03)
+    game.attacking = ((game.dict_kb["key_attack"] == 1 and game.game_clock.time() - game.player_last_attack_time >= 0.03)
                       or game.player.action in (
                       "attack/left", "attack/right")) and not game.player.is_stunned and not game.player_grabbing
     if game.attacking and game.player.action == "attack/right" and game.player.get_direction("x") == -1:
@@ -553,4 +647,4 @@ def attacking_update(game):
 
     if game.attacking and game.player.animation.done:
         game.dict_kb["key_attack"] = 0
-        game.player_last_attack_time = time.time()
\ No newline at end of file
+        game.player_last_attack_time = game.game_clock.time()
\ No newline at end of file
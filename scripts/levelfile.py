@@ -0,0 +1,158 @@
+import json
+import mmap
+import os
+import struct
+import sys
+
+import numpy as np
+
+# Binary levels (.lvl), little endian:
+#   header      MAGIC, format version, tile size, number of tile types, on-grid tiles, offgrid tiles, extras size
+#   types       tile type names, utf-8, separated by newlines (u32 byte length first), padded to 8 bytes
+#   tiles       x int32[n], y int32[n], type id int16[n], variant int16[n]
+#   offgrid     type id int16[m], variant int16[m], pos float64[m][2]
+#   extras      json {"tiles": {"x;y": infos}, "offgrid": {"index": infos}} for the few tiles with more keys
+# Every array is read in place with numpy.frombuffer on a memory map of the file
+MAGIC = b'ANIMALVL'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sHHIIII')
+BINARY_EXTENSION = '.lvl'
+# Streamed levels, see streaming
+STREAM_EXTENSION = '.lvls'
+
+
+def pad(size):
+    return -size % 8
+
+
+def pack_level(tile_size, type_names, tiles, infos, offgrid_tiles):
+    """int, list, tuple, dict, list -> bytes
+    packs tiles given as (x, y, type id, variant) arrays, the infos of the tiles that have some ({(x, y): dict})
+    and offgrid tiles into the bytes of a binary level"""
+    xs, ys, types, variants = tiles
+    type_names = list(type_names)
+    type_ids = {name: i for i, name in enumerate(type_names)}
+    for tile in offgrid_tiles:
+        if tile['type'] not in type_ids:
+            type_ids[tile['type']] = len(type_names)
+            type_names.append(tile['type'])
+
+    extras = {'tiles': {str(x) + ';' + str(y): tile_infos for (x, y), tile_infos in infos.items() if tile_infos},
+              'offgrid': {}}
+    for i, tile in enumerate(offgrid_tiles):
+        tile_infos = {k: v for k, v in tile.items() if k not in ('type', 'variant', 'pos')}
+        if tile_infos:
+            extras['offgrid'][str(i)] = tile_infos
+
+    names = '\n'.join(type_names).encode('utf-8')
+    extras = json.dumps(extras).encode('utf-8')
+    parts = [HEADER.pack(MAGIC, FORMAT_VERSION, tile_size, len(type_names), len(xs), len(offgrid_tiles), len(extras)),
+             struct.pack('<I', len(names)) + names + bytes(pad(4 + len(names)))]
+    for array in (xs, ys):
+        parts.append(array.astype('<i4').tobytes())
+    for array in (types, variants):
+        parts.append(array.astype('<i2').tobytes())
+    parts.append(bytes(pad(len(xs) * 4)))
+    parts.append(np.array([type_ids[tile['type']] for tile in offgrid_tiles], dtype='<i2').tobytes())
+    parts.append(np.array([tile['variant'] for tile in offgrid_tiles], dtype='<i2').tobytes())
+    parts.append(bytes(pad(len(offgrid_tiles) * 4)))
+    parts.append(np.array([tile['pos'] for tile in offgrid_tiles], dtype='<f8').reshape(-1, 2).tobytes())
+    parts.append(extras)
+    return b''.join(parts)
+
+
+def write_level(path, tile_size, grid, offgrid_tiles):
+    """str, int, TileGrid, list -> None
+    writes the grid and the offgrid tiles of a map as a binary level"""
+    with open(path, 'wb') as f:
+        f.write(pack_level(tile_size, grid.type_names, grid.to_arrays(), grid.infos, offgrid_tiles))
+
+
+def map_file(path):
+    # Read only memory map of a whole file, it stays valid after the file is closed
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def unpack_level(data, offset=0, name='level'):
+    """buffer, int, str -> dict
+    reads the binary level starting at offset in data. The arrays of the result are views on data, nothing is
+    parsed per tile"""
+    magic, version, tile_size, n_types, n_tiles, n_offgrid, extras_size = HEADER.unpack_from(data, offset)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError(name + " is not a version " + str(FORMAT_VERSION) + " level")
+    offset += HEADER.size
+
+    def array(dtype, count):
+        nonlocal offset
+        result = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+        offset += result.nbytes
+        return result
+
+    names_size = struct.unpack_from('<I', data, offset)[0]
+    offset += 4
+    type_names = bytes(data[offset:offset + names_size]).decode('utf-8').split('\n') if n_types else []
+    offset += names_size + pad(4 + names_size)
+
+    level = {'tilesize': tile_size, 'type_names': type_names}
+    level['xs'], level['ys'] = array('<i4', n_tiles), array('<i4', n_tiles)
+    level['types'], level['variants'] = array('<i2', n_tiles), array('<i2', n_tiles)
+    offset += pad(n_tiles * 4)
+    level['offgrid_types'], level['offgrid_variants'] = array('<i2', n_offgrid), array('<i2', n_offgrid)
+    offset += pad(n_offgrid * 4)
+    level['offgrid_pos'] = array('<f8', n_offgrid * 2).reshape(-1, 2)
+    extras = json.loads(bytes(data[offset:offset + extras_size]).decode('utf-8'))
+    level['infos'] = {tuple(int(v) for v in key.split(';')): infos for key, infos in extras['tiles'].items()}
+    level['offgrid_infos'] = {int(i): infos for i, infos in extras['offgrid'].items()}
+    return level
+
+
+def read_level(path):
+    """str -> dict
+    maps a binary level in memory, see unpack_level"""
+    return unpack_level(map_file(path), name=path)
+
+
+def offgrid_from_level(level):
+    # The offgrid table back to the dicts used by the tilemap, integral positions come back as ints like in json
+    tiles = []
+    names = level['type_names']
+    positions = level['offgrid_pos'].tolist()
+    for i, (t, variant) in enumerate(zip(level['offgrid_types'].tolist(), level['offgrid_variants'].tolist())):
+        tile = {'type': names[t], 'variant': variant,
+                'pos': [int(v) if v.is_integer() else v for v in positions[i]]}
+        tile.update(level['offgrid_infos'].get(i, {}))
+        tiles.append(tile)
+    return tiles
+
+
+def level_path(base):
+    """str -> str
+    returns base + '.lvls' or else base + '.lvl' when it exists and is at least as recent as base + '.json', else
+    the json"""
+    text = base + '.json'
+    for extension in (STREAM_EXTENSION, BINARY_EXTENSION):
+        path = base + extension
+        if os.path.exists(path) and (not os.path.exists(text) or os.path.getmtime(path) >= os.path.getmtime(text)):
+            return path
+    return text
+
+
+def convert(path):
+    """Converts a json map to a binary level next to it"""
+    from scripts.tilegrid import TileGrid
+
+    with open(path, 'r') as f:
+        map_data = json.load(f)
+    grid = TileGrid()
+    grid.from_dict(map_data['tilemap'])
+    out = os.path.splitext(path)[0] + BINARY_EXTENSION
+    write_level(out, map_data['tilesize'], grid, map_data['offgrid'])
+    return out
+
+
+if __name__ == '__main__':
+    # python -m scripts.levelfile [maps...], converts every data/maps/*.json by default
+    paths = sys.argv[1:] or sorted(os.path.join('data/maps', f) for f in os.listdir('data/maps') if f.endswith('.json'))
+    for map_path in paths:
+        print(map_path + ' -> ' + convert(map_path))
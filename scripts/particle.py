@@ -1,27 +1,169 @@
-class Particle:
-    def __init__(self, game, p_type, pos, velocity=[0, 0], frame=0):
-        self.game = game
-        self.type = p_type
-        self.pos = list(pos)
-        self.velocity = list(velocity)
-        self.animation = self.game.assets['particle/' + p_type].copy()
-        self.animation.frame = frame
+import math
+
+import numpy as np
+
+# Particles alive at most, the ones spawned past it are dropped
+MAX_PARTICLES = 2000
+PARTICLES_CAPACITY = 256
+# Below this many particles, update() and render() go through them one by one: the numpy calls cost more than they
+# save on a few particles. Measured with benchmarks.particles
+PARTICLES_BATCH_MIN = 32
+
+
+class ParticleEngine:
+    """The particles (animated images: leaves, crystal fragments...) of the game, held in arrays (position, velocity,
+    frame, loops left, type) and advanced all at once.
+
+    A particle plays the 'particle/<type>' animation of the assets from a frame and disappears on the update after
+    the animation is done, like an Animation copy would. Dead particles are removed by compacting the arrays, which
+    keeps them in the order they were spawned in, the order they are drawn in. render() skips the particles out of
+    the surface and draws the others with one blits call. With fewer than PARTICLES_BATCH_MIN particles, both go
+    through them one by one and give the same results.
+
+    budget is the number of particles alive at most, spawning more does nothing."""
+
+    def __init__(self, assets, budget=MAX_PARTICLES):
+        self.assets = assets
+        self.budget = budget
+        # Images of the animations of all the types, one after the other, and their sizes
+        self.images = []
+        self.image_sizes = np.zeros((0, 2), dtype=np.int64)
+        # By type id: index of its first image, frame duration, frames and loops of its animation
+        self.first_image = np.zeros(0, dtype=np.int64)
+        self.durations = np.zeros(0, dtype=np.int64)
+        self.frames = np.zeros(0, dtype=np.int64)
+        self.loops = []
+        self.type_ids = {}
+        self.count = 0
+        self.allocate(PARTICLES_CAPACITY)
+
+    def allocate(self, capacity):
+        old = (self.pos, self.velocity, self.frame, self.loop, self.done, self.type_id) if self.count else None
+        self.pos = np.zeros((capacity, 2))
+        self.velocity = np.zeros((capacity, 2))
+        self.frame = np.zeros(capacity, dtype=np.int64)
+        self.loop = np.zeros(capacity)
+        self.done = np.zeros(capacity, dtype=bool)
+        self.type_id = np.zeros(capacity, dtype=np.int64)
+        if old is not None:
+            for array, values in zip((self.pos, self.velocity, self.frame, self.loop, self.done, self.type_id), old):
+                array[:self.count] = values[:self.count]
+
+    def __len__(self):
+        return self.count
+
+    def type_of(self, p_type):
+        if p_type not in self.type_ids:
+            animation = self.assets['particle/' + p_type]
+            # loop=True plays forever, numbers are the times it plays before it stops on its last frame
+            self.loops.append(math.inf if animation.loop is True else animation.loop)
+            self.type_ids[p_type] = len(self.type_ids)
+            self.first_image = np.append(self.first_image, len(self.images))
+            self.durations = np.append(self.durations, animation.img_duration)
+            self.frames = np.append(self.frames, int(animation.img_duration * len(animation.images)))
+            self.images += animation.images
+            self.image_sizes = np.array([img.get_size() for img in self.images], dtype=np.int64)
+        return self.type_ids[p_type]
+
+    def spawn(self, p_type, pos, velocity=(0, 0), frame=0):
+        """str, tuple, tuple, int -> bool
+        adds a particle playing the animation of p_type from frame, returns False when the budget is spent"""
+        if self.count >= self.budget:
+            return False
+        if self.count == len(self.done):
+            self.allocate(2 * len(self.done))
+        type_id = self.type_of(p_type)
+        i = self.count
+        self.pos[i] = pos
+        self.velocity[i] = velocity
+        self.frame[i] = frame
+        self.loop[i] = self.loops[type_id]
+        self.done[i] = False
+        self.type_id[i] = type_id
+        self.count += 1
+        return True
+
+    def clear(self):
+        self.count = 0
 
     def update(self):
-        kill = False
-        if self.animation.done:
-            kill = True
+        """Advances every particle by one tick and removes the finished ones"""
+        if not self.count:
+            return
+        if self.count < PARTICLES_BATCH_MIN:
+            self.update_few()
+            return
+        n = self.count
+        frames = self.frames[self.type_id[:n]]
+        kill = self.done[:n].copy()
+        self.pos[:n] += self.velocity[:n]
 
-        self.pos[0] += self.velocity[0]
-        self.pos[1] += self.velocity[1]
+        # Animation.update: looping animations wrap and count their loops down, the others stop on their last
+        # frame and are done there
+        looping = self.loop[:n] > 0
+        frame = self.frame[:n]
+        frame[:] = np.where(looping, (frame + 1) % frames, np.minimum(frame + 1, frames - 1))
+        self.loop[:n] -= np.where(looping, 1 / frames, 0)
+        self.done[:n] |= ~looping & (frame >= frames - 1)
+        if kill.any():
+            self.compact(~kill)
 
-        self.animation.update()
+    def update_few(self):
+        # update() one particle at a time, on python values read from the arrays and written back at once
+        n = self.count
+        pos, velocity = self.pos[:n].tolist(), self.velocity[:n].tolist()
+        frame, loop, done = self.frame[:n].tolist(), self.loop[:n].tolist(), self.done[:n].tolist()
+        frames = self.frames[self.type_id[:n]].tolist()
+        keep = [not kill for kill in done]
+        for i in range(n):
+            pos[i][0] += velocity[i][0]
+            pos[i][1] += velocity[i][1]
+            if loop[i] > 0:
+                frame[i] = (frame[i] + 1) % frames[i]
+                loop[i] -= 1 / frames[i]
+            else:
+                frame[i] = min(frame[i] + 1, frames[i] - 1)
+                done[i] = done[i] or frame[i] >= frames[i] - 1
+        self.pos[:n], self.frame[:n], self.loop[:n], self.done[:n] = pos, frame, loop, done
+        if not all(keep):
+            self.compact(np.array(keep))
 
-        return kill
+    def compact(self, keep):
+        n = self.count
+        self.count = int(np.count_nonzero(keep))
+        for array in (self.pos, self.velocity, self.frame, self.loop, self.done, self.type_id):
+            array[:self.count] = array[:n][keep]
 
     def render(self, surf, offset=(0, 0)):
-        img = self.animation.img()
-        surf.blit(img, (self.pos[0] - offset[0] - img.get_width() // 2,
-                        self.pos[1] - offset[1] - img.get_height() // 2))
-
+        """Surface, tuple -> None
+        draws the particles on the surface"""
+        if not self.count:
+            return
+        if self.count < PARTICLES_BATCH_MIN:
+            self.render_few(surf, offset)
+            return
+        n = self.count
+        types = self.type_id[:n]
+        # Animation.img of every particle
+        image = self.first_image[types] + self.frame[:n] // self.durations[types]
+        sizes = self.image_sizes[image]
+        dest = self.pos[:n] - offset - sizes // 2
+        width, height = surf.get_size()
+        visible = np.flatnonzero((dest[:, 0] > -sizes[:, 0]) & (dest[:, 0] < width) & (dest[:, 1] > -sizes[:, 1]) &
+                                 (dest[:, 1] < height))
+        surf.blits([(self.images[k], xy) for k, xy in zip(image[visible].tolist(), dest[visible].tolist())],
+                   doreturn=False)
 
+    def render_few(self, surf, offset):
+        # render() one particle at a time
+        n = self.count
+        width, height = surf.get_size()
+        first_image, durations = self.first_image.tolist(), self.durations.tolist()
+        blits = []
+        for (x, y), frame, t in zip(self.pos[:n].tolist(), self.frame[:n].tolist(), self.type_id[:n].tolist()):
+            img = self.images[first_image[t] + frame // durations[t]]
+            w, h = img.get_size()
+            x, y = x - offset[0] - w // 2, y - offset[1] - h // 2
+            if -w < x < width and -h < y < height:
+                blits.append((img, (x, y)))
+        surf.blits(blits, doreturn=False)
@@ -11,11 +11,16 @@ from time import sleep
 
 import random
 
-from scripts.particle import Particle
 from scripts.tilemap import Tilemap
+from scripts.tilegrid import SOLID, ONE_WAY
+from scripts.utils import SpriteCache, ROTATION_STEP
 from scripts.sound import *
 from scripts.entities import deal_knockback, update_throwable_objects_action
 
+# Ticks a dash ghost stays visible, and the most ghosts drawn at once
+GHOST_LIFETIME = 20
+MAX_GHOSTS = 20
+
 class PhysicsPlayer:
     def __init__(self, game, tilemap, pos, size):
 
@@ -77,6 +82,7 @@ class PhysicsPlayer:
         # Tilemap (stage)
         self.tilemap = tilemap
         self.ghost_images = []
+        self.sprites = SpriteCache()
 
         self.jumping = False
 
@@ -85,6 +91,9 @@ class PhysicsPlayer:
         self.animation = self.game.assets['player/' + "idle"].copy()
         self.collision = {'left': False, 'right': False, 'bottom': False}
         self.get_block_on = {'left': False, 'right': False}
+        # What the player touches, refreshed by update_contacts when the player or the map moved (see contacts())
+        self.contact_record = None
+        self.contact_key = None
         self.air_time = 0
         self.disablePlayerInput = False
 
@@ -177,7 +186,7 @@ class PhysicsPlayer:
 
         if self.is_stunned:
             # Calculate time since stun started
-            stun_elapsed = time.time() - self.last_stun_time
+            stun_elapsed = self.game.game_clock.time() - self.last_stun_time
             stun_duration = 0.2
 
             if stun_elapsed < stun_duration:
@@ -204,7 +213,7 @@ class PhysicsPlayer:
 
         if not self.is_on_floor() and self.can_walljump["available"] == False:
             # Spin speed (Adjust "8" to make it faster/slower)
-            rotation_speed = 6.5
+            rotation_speed = ROTATION_STEP
 
             # Spin based on direction (Clockwise if facing right, CCW if left)
             # We use last_direction so you keep spinning even if you stop pressing keys in mid-air
@@ -379,18 +388,55 @@ class PhysicsPlayer:
 
     def apply_particle(self):
         '''if self.velocity[1] < 0 and self.air_time < 20:
-            self.game.particles.append(Particle(self.game, 'leaf', self.pos, velocity=[-0.1, 0.3], frame=random.randint(0, 20)))'''
+            self.game.particles.spawn('leaf', self.pos, velocity=(-0.1, 0.3), frame=random.randint(0, 20))'''
 
     def rect(self):
         return pygame.Rect(self.pos[0], self.pos[1], self.size[0], self.size[1])
 
+    def update_contacts(self):
+        """Queries the tiles and colliders touching the player once and records them: floor, ceiling, left and right
+        walls, and the walls to slide on when facing each direction (wall_slide[1], wall_slide[-1])"""
+        tilemap = self.tilemap
+        entity_rect = self.rect()
+        contacts = {'floor': False, 'ceiling': False, 'left': False, 'right': False}
+
+        below = pygame.Rect(self.pos[0], self.pos[1] + 1, self.size[0], self.size[1])
+        for rect in tilemap.colliders_under(self.pos, self.size):
+            if below.colliderect(rect):
+                # Only the first rect touched counts
+                contacts['floor'] = entity_rect.bottom == rect.top
+                break
+
+        above, left, right = entity_rect.move(0, -1), entity_rect.move(-1, 0), entity_rect.move(1, 0)
+        for rect in tilemap.colliders_around(self.pos, self.size):
+            if rect.bottom == entity_rect.top and above.colliderect(rect):
+                contacts['ceiling'] = True
+            if rect.right == entity_rect.left and left.colliderect(rect):
+                contacts['left'] = True
+            if rect.left == entity_rect.right and right.colliderect(rect):
+                contacts['right'] = True
+
+        contacts['wall_slide'] = {}
+        for direction in (1, -1):
+            x = entity_rect.centerx + 11 * direction
+            contacts['wall_slide'][direction] = bool(tilemap.solid_check((x, self.pos[1])) and
+                                                     tilemap.solid_check((x, self.pos[1] + self.size[1])))
+
+        self.contact_record = contacts
+        self.contact_key = (self.pos[0], self.pos[1], tilemap.grid.version, tilemap.colliders_version)
+        return contacts
+
+    def contacts(self):
+        """Contact record of the current position. It only changes when the player moves or the map and doors
+        change, so the many checks of a tick share one query"""
+        tilemap = self.tilemap
+        if self.contact_key != (self.pos[0], self.pos[1], tilemap.grid.version, tilemap.colliders_version):
+            return self.update_contacts()
+        return self.contact_record
+
     def is_on_floor(self):
         """Uses tilemap to check if on (above, standing on) a tile. used for gravity, jump, etc."""
-        for rect in self.tilemap.physics_rects_under(self.pos,self.size) + self.game.doors_rects:
-            entity_rect = pygame.Rect(self.pos[0], self.pos[1] + 1, self.size[0], self.size[1])
-            if entity_rect.colliderect(rect):
-                return self.rect().bottom == rect.top and self.velocity[1] >= 0
-        return False
+        return self.contacts()['floor'] and self.velocity[1] >= 0
 
     def gravity(self):
         """Handles gravity. Gives downwards momentum (capped at 5) if in the air, negates momentum if on the ground, gives back a dash if the
@@ -432,7 +478,9 @@ class PhysicsPlayer:
                 self.dashtime_cur = 0
                 self.tech_momentum_mult = pow(abs(self.dash_direction[0]) + abs(self.dash_direction[1]), 0.5)
                 self.velocity[0] = self.get_direction("x") * self.DASH_SPEED * self.tech_momentum_mult
-                self.velocity[1] /= self.tech_momentum_mult
+                # No dash direction left (keys released during the dash): plain jump
+                if self.tech_momentum_mult:
+                    self.velocity[1] /= self.tech_momentum_mult
 
         '''elif self.dict_kb["key_jump"] == 1 and self.can_walljump["available"] == True and not self.holding_jump and \
                 self.can_walljump["blocks_around"] and self.can_walljump["cooldown"] < 1 and self.can_walljump[
@@ -522,7 +570,7 @@ class PhysicsPlayer:
             if self.can_walljump["timer"] == 0:
                 self.can_walljump["available"] = False
 
-            for rect in tilemap.physics_rects_under(self.pos, self.size) + self.game.doors_rects:
+            for rect in tilemap.colliders_under(self.pos, self.size):
                 if entity_rect.colliderect(rect):
                     if self.velocity[1] > 0:
                         self.pos[1] = rect.top - entity_rect.height
@@ -531,7 +579,7 @@ class PhysicsPlayer:
                         self.can_walljump["buffer"] = True
                         self.can_walljump["available"] = False
 
-            for rect in tilemap.physics_rects_around(self.pos, self.size) + self.game.doors_rects:
+            for rect in tilemap.colliders_around(self.pos, self.size):
                 if entity_rect.colliderect(rect):
                     if self.velocity[1] < 0:
                         self.pos[1] = rect.bottom
@@ -546,7 +594,7 @@ class PhysicsPlayer:
         if axe == "x":
             if self.can_walljump["available"]:
                 self.can_walljump["cooldown"] = max(self.can_walljump["cooldown"]-1,0)
-            for rect in tilemap.physics_rects_around(self.pos, self.size) + self.game.doors_rects:
+            for rect in tilemap.colliders_around(self.pos, self.size):
                 if entity_rect.colliderect(rect):
                     if self.velocity[0] > 0:
                         entity_rect.right = rect.left
@@ -580,8 +628,7 @@ class PhysicsPlayer:
 
     def apply_momentum(self):
         """Applies velocity to the coords of the object. Slows down movement depending on environment"""
-        self.can_walljump["blocks_around"] = (self.tilemap.solid_check((self.rect().centerx + 11*self.last_direction, self.pos[1])) and
-                                              self.tilemap.solid_check((self.rect().centerx + 11*self.last_direction, self.pos[1] + self.size[1])))
+        self.can_walljump["blocks_around"] = self.contacts()['wall_slide'][self.last_direction]
 
         if int(self.velocity[0]) > 0 or not self.get_block_on["left"]:
             self.collision["left"] = False
@@ -589,11 +636,15 @@ class PhysicsPlayer:
             self.collision["right"] = False
         if self.velocity[1] > 0:
             self.collision["bottom"] = False
-        self.pos[0] += self.velocity[0]
+        # Swept on each axis, a fast dash or fall stops on the first collider instead of going through it
+        self.pos[0] += self.tilemap.swept_move(self.pos, self.size, 0, self.velocity[0])
         self.collision_check("x")
 
-        self.pos[1] += self.velocity[1]
+        self.pos[1] += self.tilemap.swept_move(self.pos, self.size, 1, self.velocity[1],
+                                               SOLID | ONE_WAY if self.velocity[1] > 0 else SOLID)
         self.collision_check("y")
+        # Contacts of the new position, everything read until the next move shares them
+        self.contacts()
 
         if self.collision["right"]:
             self.collision_check_walljump_helper(1)
@@ -623,74 +674,44 @@ class PhysicsPlayer:
 
     def dash_ghost_trail(self):
         """Creates ghost images that fade out over time."""
-        # Store current position and image with a timer
-        ghost = {
-            "pos": [self.rect().centerx, self.rect().centery],  # Assuming self.pos is a list or has a copy method
-            "img": self.animation.img().copy(),  # Create a copy of the current image
-            "lifetime": 20,  # How long the ghost remains visible (in frames)
+        # A ghost only keeps the frame it shows, its tinted and rotated image comes from the sprite cache
+        self.ghost_images.append({
+            "pos": self.rect().center,
+            "img": self.animation.img(),
+            "lifetime": GHOST_LIFETIME,  # How long the ghost remains visible (in frames)
             "angle": self.rotation_angle
-        }
-
-        # Add to list of ghost images
-        self.ghost_images.append(ghost)
+        })
 
         # Max number of ghost images to prevent using too much memory
-        max_ghosts = 20
-        if len(self.ghost_images) > max_ghosts:
+        if len(self.ghost_images) > MAX_GHOSTS:
             self.ghost_images.pop(0)
 
     def update_ghost_trail(self):
-        for ghost in self.ghost_images[:]:
+        for ghost in self.ghost_images:
             ghost["lifetime"] -= 1
-            if ghost["lifetime"] <= 0:
-                self.ghost_images.remove(ghost)
+        # Ghosts are added in order, the ones that faded out are at the start
+        while self.ghost_images and self.ghost_images[0]["lifetime"] <= 0:
+            self.ghost_images.pop(0)
 
     def render(self, surf, offset=(0, 0)):
         # 1. Draw Ghosts
-        for ghost in self.ghost_images[:]:
-            alpha = int(255 * (ghost["lifetime"] / 20) ** 2)
-            ghost_surf = ghost["img"].copy()
-
-            # Apply transparency
-            ghost_surf.fill((255, 255, 255, 0), special_flags=pygame.BLEND_RGBA_MAX)
-            ghost_surf.fill((109, 156, 159, 70), special_flags=pygame.BLEND_RGBA_MIN)
-            ghost_surf.set_alpha(alpha)
-
-            # Rotate Ghost
-            if ghost["angle"] != 0:
-                ghost_surf = pygame.transform.rotate(ghost_surf, ghost["angle"])
-
-            # Calculate Ghost Center
-            # Note: We use the ghost's original position + half size to find the center
-            ghost_center_x = ghost["pos"][0] - offset[0] + self.size[0] // 2
-            ghost_center_y = ghost["pos"][1] - offset[1] + self.size[1] // 2
-
-            # Get the new rect centered on that point
-            ghost_rect = ghost_surf.get_rect(center=(ghost_center_x, ghost_center_y))
-
-            # Apply your manual offsets (-11, -5) if they were for visual alignment
-            # (You might need to tweak these depending on your sprite art)
-            ghost_rect.x -= 11
-            ghost_rect.y -= 5
+        for ghost in self.ghost_images:
+            ghost_surf = self.sprites.get(ghost["img"], ghost["angle"], ghost=True)
+            ghost_surf.set_alpha(int(255 * (ghost["lifetime"] / GHOST_LIFETIME) ** 2))
 
+            # Centered on the ghost's original position + half size, (-11, -5) aligns the sprite art
+            ghost_rect = ghost_surf.get_rect(center=(ghost["pos"][0] - offset[0] + self.size[0] // 2 - 11,
+                                                     ghost["pos"][1] - offset[1] + self.size[1] // 2 - 5))
             surf.blit(ghost_surf, ghost_rect)
 
         # 2. Draw Player
-        img = self.animation.img().convert_alpha()
+        img = self.sprites.get(self.animation.img(), self.rotation_angle)
 
         if self.rotation_angle != 0:
-            # Rotate the image
-            rotated_img = pygame.transform.rotate(img, self.rotation_angle)
-
-            # Calculate the center of the hitbox relative to the screen
+            # Rotated image centered on the hitbox center
             center_x = self.pos[0] - offset[0] + self.size[0] // 2
             center_y = self.pos[1] - offset[1] + self.size[1] // 2
-
-            # Get a new rectangle for the rotated image, centered on the hitbox center
-            new_rect = rotated_img.get_rect(center=(center_x, center_y))
-
-            # Blit at the calculated coordinates
-            surf.blit(rotated_img, new_rect)
+            surf.blit(img, img.get_rect(center=(center_x, center_y)))
         else:
             # Standard drawing if no rotation
             surf.blit(img, (self.pos[0] - offset[0], self.pos[1] - offset[1]))
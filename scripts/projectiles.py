@@ -0,0 +1,178 @@
+import numpy as np
+
+from scripts.tilegrid import SOLID, ONE_WAY
+from scripts.timestep import MAX_INTERPOLATED_MOVE
+
+# Projectiles the pool holds before it has to grow
+PROJECTILE_CAPACITY = 256
+# Ticks a projectile flies before it disappears
+PROJECTILE_LIFETIME = 360
+PROJECTILE_DAMAGE = 10
+# Below this many projectiles, update() and render() go through them one by one: the numpy calls cost more than
+# they save on a few projectiles. Measured with benchmarks.projectiles
+PROJECTILE_BATCH_MIN = 48
+
+
+class ProjectilePool:
+    """The projectiles of the game in preallocated arrays (position, direction, timer, damage, type), the free
+    slots are kept in a list. update() moves them all, checks their tile and their hit on the player at once, and
+    render() draws them with one blits call of images converted once per type. With fewer than
+    PROJECTILE_BATCH_MIN projectiles, both go through them one by one and give the same results.
+
+    Projectiles fast enough to skip a tile in one tick are swept one by one like the entities, the others only
+    check the cell they end in."""
+
+    def __init__(self, capacity=PROJECTILE_CAPACITY):
+        self.types = []
+        self.type_ids = {}
+        # Type id -> converted image, filled by render
+        self.images = {}
+        self.allocate(capacity)
+
+    def allocate(self, capacity):
+        self.pos = np.zeros((capacity, 2))
+        # Positions before the last step, the renderer interpolates from them
+        self.previous = np.zeros((capacity, 2))
+        self.direction = np.zeros((capacity, 2))
+        self.timer = np.zeros(capacity, dtype=np.int32)
+        self.damage = np.zeros(capacity, dtype=np.int32)
+        self.type_id = np.zeros(capacity, dtype=np.int32)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.free = list(range(capacity - 1, -1, -1))
+
+    def grow(self):
+        # Doubles the arrays, the projectiles keep their slots
+        capacity = len(self.alive)
+        old = (self.pos, self.previous, self.direction, self.timer, self.damage, self.type_id, self.alive)
+        self.allocate(capacity * 2)
+        for array, values in zip((self.pos, self.previous, self.direction, self.timer, self.damage, self.type_id,
+                                  self.alive), old):
+            array[:capacity] = values
+        self.free = list(range(capacity * 2 - 1, capacity - 1, -1))
+
+    def __len__(self):
+        # Every slot that is not free holds a projectile
+        return len(self.alive) - len(self.free)
+
+    def spawn(self, p_type, pos, direction, damage=PROJECTILE_DAMAGE):
+        """str, tuple, tuple, int -> int
+        adds a projectile of type p_type (its image asset) at pos moving by direction every tick, returns its slot"""
+        if not self.free:
+            self.grow()
+        if p_type not in self.type_ids:
+            self.type_ids[p_type] = len(self.types)
+            self.types.append(p_type)
+        i = self.free.pop()
+        self.pos[i] = pos
+        self.previous[i] = pos
+        self.direction[i] = direction
+        self.timer[i] = 0
+        self.damage[i] = damage
+        self.type_id[i] = self.type_ids[p_type]
+        self.alive[i] = True
+        return i
+
+    def remove(self, slots):
+        """array -> None
+        frees the slots of an array of indices or a boolean mask"""
+        slots = np.flatnonzero(slots) if slots.dtype == bool else slots
+        self.alive[slots] = False
+        self.free.extend(slots.tolist())
+
+    def clear(self):
+        self.alive[:] = False
+        self.free = list(range(len(self.alive) - 1, -1, -1))
+
+    def save_previous(self):
+        # Free slots are copied too, spawn() sets the previous position of a new projectile
+        self.previous[:] = self.pos
+
+    def update(self, tilemap, player_rect):
+        """Tilemap, Rect -> int
+        moves every projectile by its direction, removes the ones that hit a tile or a door, timed out or hit the
+        player, and returns the damage dealt to the player"""
+        slots = np.flatnonzero(self.alive)
+        if not len(slots):
+            return 0
+        if len(slots) < PROJECTILE_BATCH_MIN:
+            return self.update_few(slots.tolist(), tilemap, player_rect)
+        direction = self.direction[slots]
+        steps = np.ones(len(slots))
+        hit = np.zeros(len(slots), dtype=bool)
+        for j in np.flatnonzero(np.abs(direction).sum(axis=1) >= tilemap.tile_size).tolist():
+            # Fast enough to skip a wall between two ticks, swept as a point against tiles and doors
+            impact = tilemap.sweep(self.pos[slots[j]].tolist(), (0, 0), *direction[j].tolist(), SOLID | ONE_WAY)
+            if impact:
+                steps[j], hit[j] = impact[0], True
+        pos = self.pos[slots] + direction * steps[:, None]
+        self.pos[slots] = pos
+        self.timer[slots] += 1
+
+        # Tiles the projectiles end in, like Tilemap.solid_check
+        tilemap.tile_queries += 1
+        cells = np.floor_divide(pos, tilemap.tile_size).astype(np.int64)
+        hit |= (tilemap.grid.solidity_of_cells(cells[:, 0], cells[:, 1]) & (SOLID | ONE_WAY)) != 0
+        gone = hit | (self.timer[slots] > PROJECTILE_LIFETIME)
+
+        # Rect.collidepoint, which truncates the point
+        px, py = np.trunc(pos[:, 0]), np.trunc(pos[:, 1])
+        touching = ~gone & (px >= player_rect.left) & (px < player_rect.right) & (py >= player_rect.top) & \
+            (py < player_rect.bottom)
+        self.remove(slots[gone | touching])
+        return int(self.damage[slots[touching]].sum())
+
+    def update_few(self, slots, tilemap, player_rect):
+        # update() one projectile at a time, with the same operations on the same float values
+        tilemap.tile_queries += 1
+        ts = tilemap.tile_size
+        removed = []
+        damage = 0
+        for i in slots:
+            x, y = self.pos.item(i, 0), self.pos.item(i, 1)
+            dx, dy = self.direction.item(i, 0), self.direction.item(i, 1)
+            step, hit = 1.0, False
+            if abs(dx) + abs(dy) >= ts:
+                impact = tilemap.sweep([x, y], (0, 0), dx, dy, SOLID | ONE_WAY)
+                if impact:
+                    step, hit = impact[0], True
+            x, y = x + dx * step, y + dy * step
+            self.pos[i] = x, y
+            self.timer[i] += 1
+            hit = hit or tilemap.grid.solidity_at(int(x // ts), int(y // ts)) & (SOLID | ONE_WAY) != 0
+            if hit or self.timer.item(i) > PROJECTILE_LIFETIME:
+                removed.append(i)
+            elif player_rect.left <= int(x) < player_rect.right and player_rect.top <= int(y) < player_rect.bottom:
+                removed.append(i)
+                damage += self.damage.item(i)
+        if removed:
+            self.remove(np.array(removed, dtype=np.int64))
+        return damage
+
+    def render(self, surf, assets, offset=(0, 0), alpha=1):
+        """Surface, dict, tuple, float -> None
+        draws the projectiles centered on their position alpha of the way from their previous one"""
+        slots = np.flatnonzero(self.alive)
+        if not len(slots):
+            return
+        type_ids = self.type_id[slots].tolist()
+        for type_id in set(type_ids):
+            if type_id not in self.images:
+                self.images[type_id] = assets[self.types[type_id]].convert_alpha()
+        if len(slots) < PROJECTILE_BATCH_MIN:
+            for i, type_id in zip(slots.tolist(), type_ids):
+                img = self.images[type_id]
+                x, y = self.pos.item(i, 0), self.pos.item(i, 1)
+                mx, my = x - self.previous.item(i, 0), y - self.previous.item(i, 1)
+                if abs(mx) + abs(my) > MAX_INTERPOLATED_MOVE:
+                    mx, my = 0, 0
+                surf.blit(img, (x - mx * (1 - alpha) - img.get_width() / 2 - offset[0],
+                                y - my * (1 - alpha) - img.get_height() / 2 - offset[1]))
+            return
+        pos = self.pos[slots]
+        moved = pos - self.previous[slots]
+        # Teleported projectiles are not interpolated, like interpolated_offset
+        moved[np.abs(moved).sum(axis=1) > MAX_INTERPOLATED_MOVE] = 0
+        images = [self.images[type_id] for type_id in type_ids]
+        sizes = np.array([img.get_size() for img in images], dtype=np.float64)
+        dest = pos - moved * (1 - alpha) - sizes / 2 - offset
+        surf.blits(list(zip(images, map(tuple, dest.tolist()))), doreturn=False)
@@ -0,0 +1,166 @@
+import random
+import struct
+import sys
+import time
+import zlib
+
+# Input recordings (.rec), little endian:
+#   header      REPLAY_MAGIC, format version, level, seed, number of keys
+#   keys        dict_kb key names, utf-8, separated by newlines (u32 byte length first)
+#   events      tick uint32, code uint8, value uint8. code is the index of a key whose state became value, or
+#               CHECKSUM (followed by a uint32 crc of the simulation state) or END on the last tick
+REPLAY_MAGIC = b'ANIMAREC'
+REPLAY_VERSION = 1
+REPLAY_HEADER = struct.Struct('<8sHiQH')
+EVENT = struct.Struct('<IBB')
+CHECKSUM = 0xFE
+END = 0xFF
+REPLAY_EXTENSION = '.rec'
+# Ticks between two checksums, a replay that drifts is caught within this many ticks
+CHECKSUM_INTERVAL = 60
+
+
+class RandomStreams:
+    """One random generator per subsystem, all derived from one seed. A subsystem drawing more or fewer numbers
+    (more particles on screen...) does not change what the others draw, so the AI only depends on the seed and
+    the inputs. Drawing code keeps using the global random module."""
+
+    NAMES = ('ai', 'particles')
+
+    def __init__(self, seed=0):
+        self.seed(seed)
+
+    def seed(self, seed):
+        self.current_seed = seed
+        for name in self.NAMES:
+            setattr(self, name, random.Random(str(seed) + ':' + name))
+
+
+def state_checksum(game):
+    """Game -> int
+    crc of the state that a replay must reproduce exactly: player, enemies, throwables and level"""
+    state = (game.level, game.player.pos, game.player.velocity, game.player_hp,
+             [(enemy.pos, enemy.hp) for enemy in game.enemies], [o.pos for o in game.throwable])
+    return zlib.crc32(repr(state).encode('utf-8'))
+
+
+class InputRecorder:
+    """Writes the changes of dict_kb, tick by tick, to a recording. record() is called at the start of every
+    simulation step with the keys that step will see, end_tick() at its end: the step itself changes some keys
+    (attacks, presses), a change is what the input did to the keys the previous step left."""
+
+    def __init__(self, path, level, seed, keys):
+        self.path = path
+        self.keys = list(keys)
+        self.last = dict.fromkeys(self.keys, 0)
+        self.tick = 0
+        self.file = open(path, 'wb')
+        names = '\n'.join(self.keys).encode('utf-8')
+        self.file.write(REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, level, seed, len(self.keys)))
+        self.file.write(struct.pack('<I', len(names)) + names)
+
+    def record(self, tick, dict_kb, game=None):
+        self.tick = tick
+        for i, key in enumerate(self.keys):
+            state = int(dict_kb.get(key, 0))
+            if state != self.last[key]:
+                self.file.write(EVENT.pack(tick, i, state))
+                self.last[key] = state
+        if game is not None and tick % CHECKSUM_INTERVAL == 0:
+            self.file.write(EVENT.pack(tick, CHECKSUM, 0) + struct.pack('<I', state_checksum(game)))
+
+    def end_tick(self, dict_kb):
+        for key in self.keys:
+            self.last[key] = int(dict_kb.get(key, 0))
+
+    def close(self):
+        if self.file is not None:
+            self.file.write(EVENT.pack(self.tick + 1, END, 0))
+            self.file.close()
+            self.file = None
+
+
+class InputReplayer:
+    """Reads a recording back and sets dict_kb to the recorded keys at each tick. The checksums of the recording
+    are compared to the replayed state, desync_tick is the first tick where they differ (None while they match)."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, version, self.level, self.seed, n_keys = REPLAY_HEADER.unpack_from(data, 0)
+        if magic != REPLAY_MAGIC or version != REPLAY_VERSION:
+            raise ValueError(path + " is not a version " + str(REPLAY_VERSION) + " recording")
+        offset = REPLAY_HEADER.size
+        names_size = struct.unpack_from('<I', data, offset)[0]
+        offset += 4
+        self.keys = data[offset:offset + names_size].decode('utf-8').split('\n') if n_keys else []
+        offset += names_size
+
+        # tick -> [(key, state)], tick -> crc
+        self.events = {}
+        self.checksums = {}
+        self.ticks = 0
+        while offset < len(data):
+            tick, code, value = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            if code == END:
+                self.ticks = tick
+                break
+            if code == CHECKSUM:
+                self.checksums[tick] = struct.unpack_from('<I', data, offset)[0]
+                offset += 4
+            else:
+                self.events.setdefault(tick, []).append((self.keys[code], value))
+            self.ticks = tick + 1
+        self.desync_tick = None
+
+    def apply(self, tick, dict_kb, game=None):
+        """int, dict, Game -> bool
+        sets the keys of the tick in dict_kb, returns False once the recording is over"""
+        for key, state in self.events.get(tick, ()):
+            dict_kb[key] = state
+        if game is not None and tick in self.checksums and self.desync_tick is None:
+            if state_checksum(game) != self.checksums[tick]:
+                self.desync_tick = tick
+        return tick < self.ticks
+
+    def done(self, tick):
+        return tick >= self.ticks
+
+
+def replay(path, watch=False):
+    """Plays a recording back from a fresh game and reports the slowest ticks. It runs headless as fast as
+    possible, or in a window through main_game_logic at the normal speed when watch is True"""
+    from main import Game
+
+    game = Game(headless=not watch)
+    game.start_replay(path)
+    if watch:
+        game.state = "PLAYING"
+        game.game_initialized = True
+        game.start_time = time.time()
+    durations = []
+    while not game.replayer.done(game.game_clock.ticks):
+        start = time.perf_counter()
+        if watch:
+            game.main_game_logic()
+        else:
+            game.step()
+        durations.append(time.perf_counter() - start)
+    ticks = game.game_clock.ticks
+    total = sum(durations)
+    print(path + ': %d ticks in %.0f ms, %.0f us/tick' % (ticks, total * 1000, total / max(ticks, 1) * 1e6))
+    if not watch:
+        for duration, tick in sorted(zip(durations, range(ticks)), reverse=True)[:5]:
+            print('  tick %d: %.2f ms' % (tick, duration * 1000))
+    if game.replayer.desync_tick is None:
+        print('  identical to the recording')
+    else:
+        print('  desync at tick %d' % game.replayer.desync_tick)
+    return game
+
+
+if __name__ == '__main__':
+    # python -m scripts.replay [--watch] recordings..., plays recordings back (headless unless --watch)
+    for recording in [arg for arg in sys.argv[1:] if arg != '--watch']:
+        replay(recording, watch='--watch' in sys.argv)
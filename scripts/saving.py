@@ -114,7 +114,7 @@ class Save:
                 set_game_volume(self.game, volume)
                 self.game.keyboard_layout = save_data["settings"].get("keyboard_layout", "qwerty")
                 self.game.selected_language = save_data["settings"].get("language", "English")
-                if hasattr(self.game, "menu"):
+                if getattr(self.game, "menu", None) is not None:
                     self.game.menu.update_settings_from_game()
             # --- Finalize Load ---
             # Set scroll to player position
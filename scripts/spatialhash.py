@@ -0,0 +1,53 @@
+class SpatialHash:
+    """Buckets items by the cell their point (x, y) falls in, so that the items around a rect are found by
+    looking at a few cells instead of every item.
+
+    Items are inserted with an integer key, queries return them sorted by key so that callers can keep an order
+    (drawing order of decorations...) by giving increasing keys."""
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.buckets = {}
+        self.cells = {}
+
+    def __len__(self):
+        return len(self.cells)
+
+    def cell_of(self, x, y):
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def insert(self, key, x, y, item):
+        cell = self.cell_of(x, y)
+        self.buckets.setdefault(cell, {})[key] = item
+        self.cells[key] = cell
+
+    def remove(self, key):
+        cell = self.cells.pop(key)
+        bucket = self.buckets[cell]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[cell]
+
+    def clear(self):
+        self.buckets = {}
+        self.cells = {}
+
+    def query(self, left, top, right, bottom):
+        """int, int, int, int -> list
+        returns the items of every cell overlapping the box, sorted by key"""
+        x0, y0 = self.cell_of(left, top)
+        x1, y1 = self.cell_of(right, bottom)
+        found = []
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self.buckets):
+            # Box bigger than the populated area, walking the buckets is cheaper
+            for (cx, cy), bucket in self.buckets.items():
+                if x0 <= cx <= x1 and y0 <= cy <= y1:
+                    found.extend(bucket.items())
+        else:
+            for cx in range(x0, x1 + 1):
+                for cy in range(y0, y1 + 1):
+                    bucket = self.buckets.get((cx, cy))
+                    if bucket:
+                        found.extend(bucket.items())
+        found.sort(key=lambda entry: entry[0])
+        return [item for key, item in found]
@@ -0,0 +1,267 @@
+import os
+import queue
+import struct
+import sys
+import threading
+
+import numpy as np
+import pygame
+
+from scripts.levelfile import pad, pack_level, unpack_level, offgrid_from_level, map_file, STREAM_EXTENSION
+from scripts.tilegrid import CHUNK_SIZE
+from scripts.utils import load_doors, load_activators
+
+# Streamed levels (.lvls) cut a map in square regions that are loaded and unloaded around the camera, little endian:
+#   header      STREAM_MAGIC, format version, tile size, region size (tiles), number of regions,
+#               objects offset uint64, objects size uint64
+#   regions     rx int32, ry int32, offset uint64, size uint64 for each region
+#   objects     the tiles of the level wide objects of all the regions as one binary level, 8 bytes aligned
+#   levels      the tiles and offgrid tiles of each region as a binary level (see levelfile), 8 bytes aligned
+STREAM_MAGIC = b'ANIMASTR'
+STREAM_VERSION = 2
+STREAM_HEADER = struct.Struct('<8sHHIIQQ')
+REGION_ENTRY = struct.Struct('<iiQQ')
+# In tiles, a whole number of chunks so that unloading a region drops whole chunks
+REGION_SIZE = 2 * CHUNK_SIZE
+# Lists of the Game holding the objects of a region, parked while the region is unloaded
+STREAMED_OBJECTS = ('enemies', 'throwable', 'spikes', 'leaf_spawners', 'crystal_spawners', 'light_emitting_tiles')
+
+
+def object_pos(obj):
+    """object -> tuple
+    position of a streamed object, entities have a pos, spawners are rects and lights are dicts"""
+    if isinstance(obj, pygame.Rect):
+        return obj.topleft
+    if isinstance(obj, dict):
+        return obj['pos']
+    return obj.pos
+
+
+def level_object_pairs():
+    """-> list
+    (type, variant) of the tiles of the level wide objects, the ones Game.populate_level_logic looks for"""
+    pairs = [("checkpoint", 0), ('spawners', 0), ("transition", 0)]
+    pairs += [(door, 0) for door in load_doors('editor')]
+    pairs += [(activator, 0) for activator in load_activators()]
+    return pairs
+
+
+def write_streamed_level(path, tile_size, grid, offgrid_tiles, object_pairs=(), region_size=REGION_SIZE):
+    """str, int, TileGrid, list, list, int -> None
+    writes a map as a streamed level, the tiles of the given (type, variant) are also written to the objects table
+    that LevelStream.find reads"""
+    xs, ys, types, variants = grid.to_arrays()
+    object_pairs = set(object_pairs)
+    is_object = np.zeros(len(xs), dtype=bool)
+    for name, variant in object_pairs:
+        if name in grid.type_ids:
+            is_object |= (types == grid.type_ids[name]) & (variants == variant)
+    tile_regions = {}
+    for i, key in enumerate(zip((xs // region_size).tolist(), (ys // region_size).tolist())):
+        tile_regions.setdefault(key, []).append(i)
+    region_px = region_size * tile_size
+    offgrid_regions = {}
+    for tile in offgrid_tiles:
+        key = (int(tile['pos'][0] // region_px), int(tile['pos'][1] // region_px))
+        offgrid_regions.setdefault(key, []).append(tile)
+
+    def pack(cells, offgrid):
+        infos = {(x, y): grid.infos[(x, y)] for x, y in zip(xs[cells].tolist(), ys[cells].tolist())
+                 if (x, y) in grid.infos}
+        level = pack_level(tile_size, grid.type_names, (xs[cells], ys[cells], types[cells], variants[cells]), infos,
+                           offgrid)
+        return level + bytes(pad(len(level)))
+
+    levels = []
+    # Objects in the order of the regions, the tiles then the offgrid tiles
+    object_cells = []
+    object_offgrid = []
+    for key in sorted(set(tile_regions) | set(offgrid_regions)):
+        cells = np.array(tile_regions.get(key, []), dtype=np.int64)
+        offgrid = offgrid_regions.get(key, [])
+        levels.append((key, pack(cells, offgrid)))
+        object_cells.append(cells[is_object[cells]])
+        object_offgrid += [tile for tile in offgrid if (tile['type'], tile['variant']) in object_pairs]
+    objects = pack(np.concatenate(object_cells) if object_cells else np.zeros(0, dtype=np.int64), object_offgrid)
+
+    objects_offset = STREAM_HEADER.size + REGION_ENTRY.size * len(levels)
+    objects_offset += pad(objects_offset)
+    offset = objects_offset + len(objects)
+    with open(path, 'wb') as f:
+        f.write(STREAM_HEADER.pack(STREAM_MAGIC, STREAM_VERSION, tile_size, region_size, len(levels),
+                                   objects_offset, len(objects)))
+        for key, level in levels:
+            f.write(REGION_ENTRY.pack(key[0], key[1], offset, len(level)))
+            offset += len(level)
+        f.write(bytes(objects_offset - f.tell()))
+        f.write(objects)
+        for key, level in levels:
+            f.write(level)
+
+
+class LevelStream:
+    """Keeps the regions of a streamed level that are around the camera loaded in a Tilemap.
+
+    update() is called every frame with the camera rect: regions within radius of it are loaded, regions further
+    than radius + 1 are unloaded (the margin avoids loading and unloading a region again and again on its border).
+    A background thread reads the regions that are about to be needed in the direction of travel, so that most
+    loads only have to put ready arrays in the grid."""
+
+    def __init__(self, tilemap, path, radius=1, prefetch=True):
+        self.tilemap = tilemap
+        self.path = path
+        self.radius = radius
+        self.data = map_file(path)
+        magic, version, self.tile_size, self.region_size, n_regions, objects_offset, _ = STREAM_HEADER.unpack_from(
+            self.data, 0)
+        if magic != STREAM_MAGIC or version != STREAM_VERSION:
+            raise ValueError(path + " is not a version " + str(STREAM_VERSION) + " streamed level")
+        self.regions = {}
+        for i in range(n_regions):
+            rx, ry, offset, size = REGION_ENTRY.unpack_from(self.data, STREAM_HEADER.size + i * REGION_ENTRY.size)
+            self.regions[(rx, ry)] = offset
+        # Level wide objects, read once instead of going through every region at each find
+        self.objects = unpack_level(self.data, objects_offset, name=self.path)
+        # Region -> offgrid tiles it added to the tilemap
+        self.loaded = {}
+        self.prefetched = {}
+        self.requested = set()
+        self.lock = threading.Lock()
+        self.requests = queue.Queue()
+        self.thread = None
+        if prefetch:
+            self.thread = threading.Thread(target=self.prefetch_loop, daemon=True)
+            self.thread.start()
+
+        tilemap.clear()
+        tilemap.tile_size = self.tile_size
+
+    def region_rect(self, region):
+        """tuple -> Rect
+        returns the area covered by a region, in pixels"""
+        size = self.region_size * self.tile_size
+        return pygame.Rect(region[0] * size, region[1] * size, size, size)
+
+    def regions_around(self, view, radius):
+        size = self.region_size * self.tile_size
+        x0, y0 = int(view.left // size) - radius, int(view.top // size) - radius
+        x1, y1 = int((view.right - 1) // size) + radius, int((view.bottom - 1) // size) + radius
+        return {(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1) if (x, y) in self.regions}
+
+    def read_region(self, region):
+        # Copies the arrays of a region out of the file, safe to call from the prefetch thread
+        level = unpack_level(self.data, self.regions[region], name=self.path)
+        for key in ('xs', 'ys', 'types', 'variants', 'offgrid_types', 'offgrid_variants', 'offgrid_pos'):
+            level[key] = level[key].copy()
+        return level
+
+    def prefetch_loop(self):
+        while True:
+            region = self.requests.get()
+            if region is None:
+                return
+            level = self.read_region(region)
+            with self.lock:
+                if region in self.requested:
+                    self.prefetched[region] = level
+                    self.requested.discard(region)
+
+    def update(self, view, velocity=(0, 0)):
+        """Rect, tuple -> tuple
+        loads and unloads regions for a camera at view moving at velocity, returns the lists of the regions
+        that were (loaded, unloaded)"""
+        wanted = self.regions_around(view, self.radius)
+        kept = self.regions_around(view, self.radius + 1)
+        unloaded = [region for region in self.loaded if region not in kept]
+        for region in unloaded:
+            self.unload_region(region)
+        loaded = [region for region in sorted(wanted) if region not in self.loaded]
+        for region in loaded:
+            self.load_region(region)
+
+        with self.lock:
+            if self.thread is not None and (velocity[0] or velocity[1]):
+                size = self.region_size * self.tile_size
+                ahead = view.move(int(np.sign(velocity[0])) * size, int(np.sign(velocity[1])) * size)
+                for region in self.regions_around(ahead, self.radius):
+                    if region not in self.loaded and region not in self.prefetched and region not in self.requested:
+                        self.requested.add(region)
+                        self.requests.put(region)
+            # Forgets what was read for regions the camera went away from
+            near = self.regions_around(view, self.radius + 2)
+            for region in [region for region in self.prefetched if region not in near]:
+                del self.prefetched[region]
+            self.requested &= near
+        return loaded, unloaded
+
+    def load_region(self, region):
+        with self.lock:
+            level = self.prefetched.pop(region, None)
+            self.requested.discard(region)
+        if level is None:
+            level = self.read_region(region)
+        self.tilemap.grid.add_arrays(level['type_names'], level['xs'], level['ys'], level['types'],
+                                     level['variants'], level['infos'])
+        offgrid = offgrid_from_level(level)
+        for tile in offgrid:
+            self.tilemap.add_offgrid_tile(tile)
+        self.loaded[region] = offgrid
+
+    def unload_region(self, region):
+        x0, y0 = region[0] * self.region_size // CHUNK_SIZE, region[1] * self.region_size // CHUNK_SIZE
+        n = self.region_size // CHUNK_SIZE
+        self.tilemap.grid.drop_chunks([(x0 + x, y0 + y) for x in range(n) for y in range(n)])
+        for tile in self.loaded.pop(region):
+            if id(tile) in self.tilemap.offgrid_keys:
+                self.tilemap.remove_offgrid_tile(tile)
+
+    def find(self, id_pairs):
+        """list -> list
+        returns the tiles of the given (type, variant) of the whole level, loaded or not, with their position in
+        pixels like Tilemap.extract. Only the objects table is read (see level_object_pairs), nothing is added to
+        the map"""
+        id_pairs = set(id_pairs)
+        level = self.objects
+        names = level['type_names']
+        found = []
+        wanted = [(t, variant) for t, name in enumerate(names) for n, variant in id_pairs if n == name]
+        if wanted:
+            matches = np.zeros(len(level['xs']), dtype=bool)
+            for t, variant in wanted:
+                matches |= (level['types'] == t) & (level['variants'] == variant)
+            for i in np.nonzero(matches)[0].tolist():
+                x, y = int(level['xs'][i]), int(level['ys'][i])
+                tile = {'type': names[level['types'][i]], 'variant': int(level['variants'][i]),
+                        'pos': [x * self.tile_size, y * self.tile_size]}
+                tile.update(level['infos'].get((x, y), {}))
+                found.append(tile)
+        for tile in offgrid_from_level(level):
+            if (tile['type'], tile['variant']) in id_pairs:
+                found.append(tile)
+        return found
+
+    def close(self):
+        if self.thread is not None:
+            self.requests.put(None)
+            self.thread.join()
+            self.thread = None
+
+
+def convert(path):
+    """Converts a json map to a streamed level next to it"""
+    import json
+    from scripts.tilegrid import TileGrid
+
+    with open(path, 'r') as f:
+        map_data = json.load(f)
+    grid = TileGrid()
+    grid.from_dict(map_data['tilemap'])
+    out = os.path.splitext(path)[0] + STREAM_EXTENSION
+    write_streamed_level(out, map_data['tilesize'], grid, map_data['offgrid'], level_object_pairs())
+    return out
+
+
+if __name__ == '__main__':
+    # python -m scripts.streaming maps..., converts json maps to streamed levels
+    for map_path in sys.argv[1:]:
+        print(map_path + ' -> ' + convert(map_path))
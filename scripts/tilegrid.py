@@ -0,0 +1,505 @@
+import numpy as np
+
+CHUNK_SIZE = 32
+EMPTY = -1
+
+# Values of the solidity bitmap
+SOLID = 1
+ONE_WAY = 2
+
+# Bits of the neighbour masks, one per side with a tile of the same type
+RIGHT = 1
+LEFT = 2
+UP = 4
+DOWN = 8
+
+
+class Chunk:
+    def __init__(self, order=0):
+        # Rank of the chunk among the chunks created by its grid, the order TileGrid.chunks keeps them in
+        self.order = order
+        # Arrays are indexed [y][x] with coordinates local to the chunk
+        self.types = np.full((CHUNK_SIZE, CHUNK_SIZE), EMPTY, dtype=np.int16)
+        self.variants = np.zeros((CHUNK_SIZE, CHUNK_SIZE), dtype=np.int16)
+        self.solid = np.zeros((CHUNK_SIZE, CHUNK_SIZE), dtype=np.uint8)
+        self.count = 0
+        # Number of tiles of each (type id, variant) in the chunk
+        self.census = {}
+        # mask -> (version, labels, rects) of the merged collision rectangles, see TileGrid.merged
+        self.merged = {}
+        # Bumped on every edit so that anything derived from the chunk (baked surfaces...) knows it's outdated
+        self.version = 0
+
+
+class TileGrid:
+    """Chunked storage for the on-grid tiles of a map.
+
+    Tiles are stored as a type id and a variant in CHUNK_SIZE x CHUNK_SIZE integer arrays, so lookups
+    only use integer coordinates. The few extra keys some tiles carry (ids, destinations...) live in a
+    sparse dict. The "x;y" dict form is only produced by to_dict() for saving.
+
+    Each (type id, variant) knows the chunks holding it (kinds), so finding the tiles of a kind only looks at
+    those chunks.
+
+    solidity is a function (tile type, variant) -> SOLID, ONE_WAY or 0 used to keep a solidity bitmap next to
+    the tiles, so that physics never has to look at tile types."""
+
+    def __init__(self, solidity=None):
+        self.solidity = solidity
+        self.solidity_cache = {}
+        self.chunks = {}
+        self.type_names = []
+        self.type_ids = {}
+        self.infos = {}
+        self.count = 0
+        self.kinds = {}
+        # Never reset, so chunks created after a clear() can't be confused with old ones
+        self.version = 0
+        self.chunks_created = 0
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, pos):
+        return self.type_at(pos[0], pos[1]) != EMPTY
+
+    def type_id(self, tile_type):
+        # Registers the tile type in the string table if it's the first time we see it
+        if tile_type not in self.type_ids:
+            self.type_ids[tile_type] = len(self.type_names)
+            self.type_names.append(tile_type)
+        return self.type_ids[tile_type]
+
+    def chunk_at(self, x, y):
+        return self.chunks.get((x // CHUNK_SIZE, y // CHUNK_SIZE))
+
+    def type_at(self, x, y):
+        chunk = self.chunks.get((x // CHUNK_SIZE, y // CHUNK_SIZE))
+        if chunk is None:
+            return EMPTY
+        return chunk.types.item(y % CHUNK_SIZE, x % CHUNK_SIZE)
+
+    def solidity_of(self, t, variant):
+        if self.solidity is None:
+            return 0
+        if (t, variant) not in self.solidity_cache:
+            self.solidity_cache[(t, variant)] = self.solidity(self.type_names[t], variant)
+        return self.solidity_cache[(t, variant)]
+
+    def solidity_table(self, max_variant):
+        """int -> array
+        returns the solidity of every (type id, variant) pair as an array indexed [type id][variant]"""
+        table = np.zeros((len(self.type_names), max_variant + 1), dtype=np.uint8)
+        for t in range(len(self.type_names)):
+            for variant in range(max_variant + 1):
+                table[t, variant] = self.solidity_of(t, variant)
+        return table
+
+    def solidity_at(self, x, y):
+        chunk = self.chunks.get((x // CHUNK_SIZE, y // CHUNK_SIZE))
+        if chunk is None:
+            return 0
+        return chunk.solid.item(y % CHUNK_SIZE, x % CHUNK_SIZE)
+
+    def solidity_of_cells(self, xs, ys):
+        """array, array -> array
+        returns the solidity of the cells xs, ys (integer arrays of the same shape), read chunk by chunk"""
+        xs, ys = np.asarray(xs, dtype=np.int64), np.asarray(ys, dtype=np.int64)
+        solidity = np.zeros(xs.size, dtype=np.uint8)
+        cx, cy = (xs // CHUNK_SIZE).ravel(), (ys // CHUNK_SIZE).ravel()
+        lx, ly = (xs % CHUNK_SIZE).ravel(), (ys % CHUNK_SIZE).ravel()
+        if not xs.size:
+            return solidity.reshape(xs.shape)
+        if cx.min() == cx.max() and cy.min() == cy.max():
+            # All in one chunk, no need to group the cells
+            chunk = self.chunks.get((int(cx[0]), int(cy[0])))
+            if chunk is not None:
+                solidity = chunk.solid[ly, lx]
+            return solidity.reshape(xs.shape)
+        _, first, inverse = np.unique(cx * (1 << 32) + cy, return_index=True, return_inverse=True)
+        for i, (key_x, key_y) in enumerate(zip(cx[first].tolist(), cy[first].tolist())):
+            chunk = self.chunks.get((key_x, key_y))
+            if chunk is not None:
+                cells = inverse == i
+                solidity[cells] = chunk.solid[ly[cells], lx[cells]]
+        return solidity.reshape(xs.shape)
+
+    def solidity_window(self, x0, y0, x1, y1):
+        """int, int, int, int -> array
+        returns the solidity of the cells between x0, y0 and x1, y1 (included) as one array indexed [y][x]"""
+        window = np.zeros((y1 - y0 + 1, x1 - x0 + 1), dtype=np.uint8)
+        for cx in range(x0 // CHUNK_SIZE, x1 // CHUNK_SIZE + 1):
+            for cy in range(y0 // CHUNK_SIZE, y1 // CHUNK_SIZE + 1):
+                chunk = self.chunks.get((cx, cy))
+                if chunk is None:
+                    continue
+                ox, oy = cx * CHUNK_SIZE, cy * CHUNK_SIZE
+                lx0, ly0 = max(x0 - ox, 0), max(y0 - oy, 0)
+                lx1, ly1 = min(x1 - ox, CHUNK_SIZE - 1), min(y1 - oy, CHUNK_SIZE - 1)
+                window[oy + ly0 - y0:oy + ly1 + 1 - y0, ox + lx0 - x0:ox + lx1 + 1 - x0] = \
+                    chunk.solid[ly0:ly1 + 1, lx0:lx1 + 1]
+        return window
+
+    def solid_cells(self, x0, y0, x1, y1, mask=SOLID):
+        """int, int, int, int, int -> list
+        returns the (x, y) of the cells between x0, y0 and x1, y1 (included) whose solidity is in mask,
+        sorted column by column"""
+        cells = []
+        chunks_seen = 0
+        for cx in range(x0 // CHUNK_SIZE, x1 // CHUNK_SIZE + 1):
+            for cy in range(y0 // CHUNK_SIZE, y1 // CHUNK_SIZE + 1):
+                chunk = self.chunks.get((cx, cy))
+                if chunk is None:
+                    continue
+                chunks_seen += 1
+                ox, oy = cx * CHUNK_SIZE, cy * CHUNK_SIZE
+                lx0, ly0 = max(x0 - ox, 0), max(y0 - oy, 0)
+                lx1, ly1 = min(x1 - ox, CHUNK_SIZE - 1), min(y1 - oy, CHUNK_SIZE - 1)
+                # Collision boxes are a few cells wide, tolist() is cheaper than nonzero() at that size
+                columns = chunk.solid[ly0:ly1 + 1, lx0:lx1 + 1].T.tolist()
+                for x, column in enumerate(columns, ox + lx0):
+                    for y, flags in enumerate(column, oy + ly0):
+                        if flags & mask:
+                            cells.append((x, y))
+        if chunks_seen > 1:
+            cells.sort()
+        return cells
+
+    def count_kind(self, key, chunk, kind, n):
+        # Keeps the census of a chunk and the chunks of each kind in sync
+        count = chunk.census.get(kind, 0) + n
+        if count:
+            if not chunk.census.get(kind):
+                self.kinds.setdefault(kind, set()).add(key)
+            chunk.census[kind] = count
+        else:
+            del chunk.census[kind]
+            self.kinds[kind].discard(key)
+            if not self.kinds[kind]:
+                del self.kinds[kind]
+
+    def take_census(self, key, chunk):
+        """Recounts the kinds of a chunk after its arrays were changed in bulk"""
+        for kind in chunk.census:
+            self.kinds[kind].discard(key)
+            if not self.kinds[kind]:
+                del self.kinds[kind]
+        filled = chunk.types != EMPTY
+        kinds, counts = np.unique(chunk.types[filled].astype(np.int32) << 16 | chunk.variants[filled],
+                                  return_counts=True)
+        chunk.census = {(kind >> 16, kind & 0xFFFF): count for kind, count in zip(kinds.tolist(), counts.tolist())}
+        for kind in chunk.census:
+            self.kinds.setdefault(kind, set()).add(key)
+
+    def find(self, kinds, box=None):
+        """iterable, tuple -> list
+        returns the (x, y) of the tiles whose (type id, variant) is in kinds, in the order of cells(). box
+        (x0, y0, x1, y1 included) limits the search to an area"""
+        kinds = set(kinds)
+        keys = set()
+        for kind in kinds:
+            keys.update(self.kinds.get(kind, ()))
+        if box is not None:
+            keys = [key for key in keys if box[0] // CHUNK_SIZE <= key[0] <= box[2] // CHUNK_SIZE
+                    and box[1] // CHUNK_SIZE <= key[1] <= box[3] // CHUNK_SIZE]
+        found = []
+        # Only the chunks holding one of the kinds are looked at, sorted back in the order of self.chunks
+        for key in sorted(keys, key=lambda key: self.chunks[key].order):
+            chunk = self.chunks[key]
+            matches = np.zeros((CHUNK_SIZE, CHUNK_SIZE), dtype=bool)
+            for t, variant in kinds:
+                if (t, variant) in chunk.census:
+                    matches |= (chunk.types == t) & (chunk.variants == variant)
+            ys, xs = np.nonzero(matches)
+            cells = zip((xs + key[0] * CHUNK_SIZE).tolist(), (ys + key[1] * CHUNK_SIZE).tolist())
+            if box is not None:
+                cells = [(x, y) for x, y in cells if box[0] <= x <= box[2] and box[1] <= y <= box[3]]
+            found.extend(cells)
+        return found
+
+    def padded_types(self, cx, cy):
+        """int, int -> array
+        returns the types of a chunk with a one cell border copied from the chunks around it"""
+        pad = np.full((CHUNK_SIZE + 2, CHUNK_SIZE + 2), EMPTY, dtype=np.int16)
+        pad[1:-1, 1:-1] = self.chunks[(cx, cy)].types
+        left, right = self.chunks.get((cx - 1, cy)), self.chunks.get((cx + 1, cy))
+        up, down = self.chunks.get((cx, cy - 1)), self.chunks.get((cx, cy + 1))
+        if left is not None:
+            pad[1:-1, 0] = left.types[:, -1]
+        if right is not None:
+            pad[1:-1, -1] = right.types[:, 0]
+        if up is not None:
+            pad[0, 1:-1] = up.types[-1, :]
+        if down is not None:
+            pad[-1, 1:-1] = down.types[0, :]
+        return pad
+
+    def neighbour_masks(self, cx, cy):
+        """int, int -> array
+        returns, for every cell of the chunk, the RIGHT | LEFT | UP | DOWN mask of the sides where the
+        neighbour has the same type"""
+        pad = self.padded_types(cx, cy)
+        types = pad[1:-1, 1:-1]
+        masks = (pad[1:-1, 2:] == types) * np.uint8(RIGHT)
+        masks |= (pad[1:-1, :-2] == types) * np.uint8(LEFT)
+        masks |= (pad[:-2, 1:-1] == types) * np.uint8(UP)
+        masks |= (pad[2:, 1:-1] == types) * np.uint8(DOWN)
+        return masks
+
+    def set_variants(self, cx, cy, variants):
+        """Replaces the whole variant array of a chunk, keeping the solidity bitmap in sync"""
+        chunk = self.chunks[(cx, cy)]
+        changed = chunk.variants != variants
+        if not changed.any():
+            return
+        chunk.variants = variants.astype(np.int16)
+        self.take_census((cx, cy), chunk)
+        if self.solidity is not None:
+            types, variants = chunk.types[changed], chunk.variants[changed]
+            chunk.solid[changed] = self.solidity_table(int(variants.max()))[types, variants]
+        self.version += 1
+        chunk.version = self.version
+
+    def merged(self, cx, cy, mask=SOLID):
+        """int, int, int -> tuple
+        merges the cells of the chunk whose solidity is in mask into rectangles, greedily: each rectangle grows
+        right as far as it can, then down while the whole row below is free. Returns the rectangles as
+        (x0, y0, x1, y1) in local cells (included) and an array [y][x] of the rectangle index of each cell (-1 for
+        none). Results are kept until the chunk is edited"""
+        chunk = self.chunks.get((cx, cy))
+        if chunk is None:
+            return None
+        cached = chunk.merged.get(mask)
+        if cached is not None and cached[0] == chunk.version:
+            return cached[1], cached[2]
+        cells = ((chunk.solid & mask) != 0).tolist()
+        labels = [[-1] * CHUNK_SIZE for _ in range(CHUNK_SIZE)]
+        rects = []
+        for y in range(CHUNK_SIZE):
+            row = cells[y]
+            for x in range(CHUNK_SIZE):
+                if not row[x] or labels[y][x] >= 0:
+                    continue
+                x1 = x
+                while x1 + 1 < CHUNK_SIZE and row[x1 + 1] and labels[y][x1 + 1] < 0:
+                    x1 += 1
+                y1 = y
+                while y1 + 1 < CHUNK_SIZE and all(cells[y1 + 1][i] and labels[y1 + 1][i] < 0 for i in range(x, x1 + 1)):
+                    y1 += 1
+                for ly in range(y, y1 + 1):
+                    labels[ly][x:x1 + 1] = [len(rects)] * (x1 - x + 1)
+                rects.append((x, y, x1, y1))
+        labels = np.array(labels, dtype=np.int16)
+        chunk.merged[mask] = (chunk.version, labels, rects)
+        return labels, rects
+
+    def merged_cells(self, x0, y0, x1, y1, mask=SOLID, columns=False):
+        """int, int, int, int, int, bool -> list
+        returns the merged rectangles touching the box x0, y0, x1, y1 cut to the box, as (x0, y0, x1, y1) in cells
+        (included), sorted like solid_cells(). With columns, rectangles are also cut into one cell wide columns"""
+        found = []
+        for cx in range(x0 // CHUNK_SIZE, x1 // CHUNK_SIZE + 1):
+            for cy in range(y0 // CHUNK_SIZE, y1 // CHUNK_SIZE + 1):
+                merged = self.merged(cx, cy, mask)
+                if merged is None:
+                    continue
+                labels, rects = merged
+                ox, oy = cx * CHUNK_SIZE, cy * CHUNK_SIZE
+                lx0, ly0 = max(x0 - ox, 0), max(y0 - oy, 0)
+                lx1, ly1 = min(x1 - ox, CHUNK_SIZE - 1), min(y1 - oy, CHUNK_SIZE - 1)
+                for i in set(labels[ly0:ly1 + 1, lx0:lx1 + 1].ravel().tolist()):
+                    if i >= 0:
+                        rx0, ry0, rx1, ry1 = rects[i]
+                        rx0, ry0, rx1, ry1 = max(rx0, lx0) + ox, max(ry0, ly0) + oy, min(rx1, lx1) + ox, min(ry1, ly1) + oy
+                        if columns:
+                            found.extend((x, ry0, x, ry1) for x in range(rx0, rx1 + 1))
+                        else:
+                            found.append((rx0, ry0, rx1, ry1))
+        found.sort()
+        return found
+
+    def get(self, x, y):
+        """int, int -> tuple or None
+        returns (type id, variant) of the tile at x, y"""
+        chunk = self.chunks.get((x // CHUNK_SIZE, y // CHUNK_SIZE))
+        if chunk is None:
+            return None
+        lx, ly = x % CHUNK_SIZE, y % CHUNK_SIZE
+        t = chunk.types.item(ly, lx)
+        if t == EMPTY:
+            return None
+        return t, chunk.variants.item(ly, lx)
+
+    def set(self, x, y, tile_type, variant, infos=None):
+        key = (x // CHUNK_SIZE, y // CHUNK_SIZE)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            chunk = self.new_chunk(key)
+        lx, ly = x % CHUNK_SIZE, y % CHUNK_SIZE
+        old = chunk.types.item(ly, lx)
+        if old == EMPTY:
+            chunk.count += 1
+            self.count += 1
+        else:
+            self.count_kind(key, chunk, (old, chunk.variants.item(ly, lx)), -1)
+        t = self.type_id(tile_type)
+        self.count_kind(key, chunk, (t, variant), 1)
+        chunk.types[ly, lx] = t
+        chunk.variants[ly, lx] = variant
+        chunk.solid[ly, lx] = self.solidity_of(t, variant)
+        self.version += 1
+        chunk.version = self.version
+        if infos:
+            self.infos[(x, y)] = dict(infos)
+        else:
+            self.infos.pop((x, y), None)
+
+    def new_chunk(self, key):
+        chunk = self.chunks[key] = Chunk(self.chunks_created)
+        self.chunks_created += 1
+        return chunk
+
+    def remove(self, x, y):
+        key = (x // CHUNK_SIZE, y // CHUNK_SIZE)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            return False
+        lx, ly = x % CHUNK_SIZE, y % CHUNK_SIZE
+        t = chunk.types.item(ly, lx)
+        if t == EMPTY:
+            return False
+        self.count_kind(key, chunk, (t, chunk.variants.item(ly, lx)), -1)
+        chunk.types[ly, lx] = EMPTY
+        chunk.variants[ly, lx] = 0
+        chunk.solid[ly, lx] = 0
+        chunk.count -= 1
+        self.count -= 1
+        self.version += 1
+        chunk.version = self.version
+        if not chunk.count:
+            del self.chunks[key]
+        self.infos.pop((x, y), None)
+        return True
+
+    def tile(self, x, y):
+        """int, int -> dict or None
+        builds the dict form of the tile at x, y"""
+        cell = self.get(x, y)
+        if cell is None:
+            return None
+        tile = {'type': self.type_names[cell[0]], 'variant': cell[1], 'pos': [x, y]}
+        if (x, y) in self.infos:
+            tile.update(self.infos[(x, y)])
+        return tile
+
+    def cells(self):
+        """Yields (x, y, type id, variant) for every tile of the grid"""
+        for (cx, cy), chunk in list(self.chunks.items()):
+            ys, xs = np.nonzero(chunk.types != EMPTY)
+            for ly, lx in zip(ys.tolist(), xs.tolist()):
+                yield (cx * CHUNK_SIZE + lx, cy * CHUNK_SIZE + ly,
+                       chunk.types.item(ly, lx), chunk.variants.item(ly, lx))
+
+    def clear(self):
+        self.chunks = {}
+        self.type_names = []
+        self.type_ids = {}
+        self.infos = {}
+        self.count = 0
+        self.kinds = {}
+        self.solidity_cache = {}
+
+    def from_dict(self, tilemap):
+        # Imports the {"x;y": tile} form used by the json maps
+        self.clear()
+        for tile in tilemap.values():
+            infos = {k: v for k, v in tile.items() if k not in ('type', 'variant', 'pos')}
+            self.set(int(tile['pos'][0]), int(tile['pos'][1]), tile['type'], tile['variant'], infos)
+
+    def to_dict(self):
+        tilemap = {}
+        for x, y, t, variant in self.cells():
+            tile = {'type': self.type_names[t], 'variant': variant, 'pos': [x, y]}
+            if (x, y) in self.infos:
+                tile.update(self.infos[(x, y)])
+            tilemap[str(x) + ';' + str(y)] = tile
+        return tilemap
+
+    def from_arrays(self, type_names, xs, ys, types, variants, infos=None):
+        """Imports tiles given as parallel arrays (binary levels) without going through set() for each of them.
+        Chunks are created in the order of their first tile, like from_dict() would"""
+        self.clear()
+        self.add_arrays(type_names, xs, ys, types, variants, infos)
+
+    def add_arrays(self, type_names, xs, ys, types, variants, infos=None):
+        """Adds tiles given as parallel arrays, type ids being indexes in type_names. Chunks that don't exist yet
+        are filled at once, tiles landing in existing chunks go through set()"""
+        if not len(xs):
+            return
+        # Type ids of the arrays to the ids of the grid
+        ids = np.array([self.type_id(name) for name in type_names], dtype=np.int16)
+        types = ids[types]
+        infos = infos or {}
+        xs, ys = xs.astype(np.int64), ys.astype(np.int64)
+        cxs, cys = xs // CHUNK_SIZE, ys // CHUNK_SIZE
+        # Two int32 chunk coordinates packed in one int64 key
+        keys = (cxs << 32) | (cys & 0xFFFFFFFF)
+        unique_keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.searchsorted(inverse[order], np.arange(len(unique_keys) + 1))
+        solidity = self.solidity_table(int(variants.max())) if self.solidity is not None else None
+        for k in np.argsort(first).tolist():
+            cells = order[bounds[k]:bounds[k + 1]]
+            key = (int(cxs[cells[0]]), int(cys[cells[0]]))
+            if key in self.chunks:
+                for i in cells.tolist():
+                    x, y = int(xs[i]), int(ys[i])
+                    self.set(x, y, self.type_names[types[i]], int(variants[i]), infos.get((x, y)))
+                continue
+            chunk = self.new_chunk(key)
+            lx, ly = xs[cells] % CHUNK_SIZE, ys[cells] % CHUNK_SIZE
+            chunk.types[ly, lx] = types[cells]
+            chunk.variants[ly, lx] = variants[cells]
+            if solidity is not None:
+                chunk.solid[ly, lx] = solidity[types[cells], variants[cells]]
+            chunk.count = len(cells)
+            self.take_census(key, chunk)
+            self.version += 1
+            chunk.version = self.version
+            self.count += chunk.count
+            for x, y in zip(xs[cells].tolist(), ys[cells].tolist()):
+                if (x, y) in infos:
+                    self.infos[(x, y)] = dict(infos[(x, y)])
+
+    def drop_chunks(self, keys):
+        """Removes whole chunks (streamed regions being unloaded) with their infos"""
+        dropped = set()
+        for key in keys:
+            chunk = self.chunks.pop(key, None)
+            if chunk is None:
+                continue
+            for kind in chunk.census:
+                self.kinds[kind].discard(key)
+                if not self.kinds[kind]:
+                    del self.kinds[kind]
+            self.count -= chunk.count
+            self.version += 1
+            dropped.add(key)
+        if dropped:
+            self.infos = {pos: infos for pos, infos in self.infos.items()
+                          if (pos[0] // CHUNK_SIZE, pos[1] // CHUNK_SIZE) not in dropped}
+
+    def to_arrays(self):
+        """Returns the x, y, type id and variant arrays of every tile, in the order of cells()"""
+        xs, ys, types, variants = [], [], [], []
+        for (cx, cy), chunk in self.chunks.items():
+            cell_ys, cell_xs = np.nonzero(chunk.types != EMPTY)
+            xs.append(cell_xs + cx * CHUNK_SIZE)
+            ys.append(cell_ys + cy * CHUNK_SIZE)
+            types.append(chunk.types[cell_ys, cell_xs])
+            variants.append(chunk.variants[cell_ys, cell_xs])
+        if not xs:
+            return (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32),
+                    np.zeros(0, dtype=np.int16), np.zeros(0, dtype=np.int16))
+        return (np.concatenate(xs).astype(np.int32), np.concatenate(ys).astype(np.int32),
+                np.concatenate(types), np.concatenate(variants))
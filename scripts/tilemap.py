@@ -2,9 +2,14 @@ import pygame
 
 import json
 
+import numpy as np
+
 from pygame import BLEND_ADD, BLEND_MAX, BLEND_RGBA_MULT, BLEND_RGBA_SUB, BLEND_RGBA_ADD
 
 from scripts.utils import round_up
+from scripts.levelfile import BINARY_EXTENSION, read_level, write_level, offgrid_from_level
+from scripts.spatialhash import SpatialHash
+from scripts.tilegrid import TileGrid, EMPTY, CHUNK_SIZE, SOLID, ONE_WAY, RIGHT, LEFT, UP, DOWN
 
 AUTOTILE_MAP = {
     tuple(sorted([(1, 0), (0, 1)])): 0,
@@ -19,188 +24,616 @@ AUTOTILE_MAP = {
 
 }
 
+# AUTOTILE_MAP as a table indexed by the neighbour masks of the grid, -1 where the tile keeps its variant
+NEIGHBOR_BITS = {(1, 0): RIGHT, (-1, 0): LEFT, (0, -1): UP, (0, 1): DOWN}
+AUTOTILE_LUT = np.full(16, -1, dtype=np.int16)
+for neighbors, autotile_variant in AUTOTILE_MAP.items():
+    AUTOTILE_LUT[sum(NEIGHBOR_BITS[n] for n in neighbors)] = autotile_variant
+
 PHYSICS_TILES = {'grass','stone', 'vine','mossy_stone', 'gray_mossy_stone', 'blue_grass'}
 TRANSPARENT_TILES = {'vine_transp':[0,1,2], 'vine_transp_back':[0,1,2], 'dark_vine':[0,1,2],'hanging_vine':[0,1,2]}
 AUTOTILE_TYPES = {'grass', 'stone', 'mossy_stone', 'blue_grass'}
 LEVER_TILES = {'lever': [0, 1]}
+BACK_LAYER_TILES = {'vine_transp_back', 'dark_vine'}
+
+# Tiles can be bigger than the grid (big spikes, large decor...), baked chunks get this many extra tiles on the
+# right and bottom so those are not cut at the chunk border
+CHUNK_OVERHANG = 3
+MAX_BAKED_CHUNKS = 64
+MAX_TINTED_IMAGES = 512
+# Offgrid tiles are indexed by their position in cells of this size. It's also the size of the biggest tile images,
+# so a decoration seen in a rect always has its position in the cells of the rect or just above / left of them
+OFFGRID_CELL = 64
+# Biggest number of cells raycast_many reads at once, rays spread further apart are cast one by one
+MAX_RAYCAST_WINDOW = 1 << 16
+
+def tile_solidity(tile_type, variant):
+    # What the solidity bitmap of the grid holds for a tile
+    if tile_type in PHYSICS_TILES:
+        return SOLID
+    if tile_type in TRANSPARENT_TILES and variant in TRANSPARENT_TILES[tile_type]:
+        return ONE_WAY
+    return 0
+
+def sweep_box(pos, size, dx, dy, rect):
+    """list, tuple, float, float, Rect -> tuple
+    time of impact in [0, 1] and normal of the box at pos moving by (dx, dy) against rect, None if it doesn't enter
+    the rect during the move (touching is not entering)"""
+    entry, exit_time, normal = 0.0, 1.0, (0, 0)
+    for axis, move in ((0, dx), (1, dy)):
+        near, far = pos[axis], pos[axis] + size[axis]
+        low, high = rect[axis], rect[axis] + rect[axis + 2]
+        if move == 0:
+            if far <= low or near >= high:
+                return None
+            continue
+        if move > 0:
+            axis_entry, axis_exit = (low - far) / move, (high - near) / move
+        else:
+            axis_entry, axis_exit = (high - near) / move, (low - far) / move
+        if axis_entry > entry or (axis_entry == entry and normal == (0, 0)):
+            entry = axis_entry
+            normal = (-1 if move > 0 else 1, 0) if axis == 0 else (0, -1 if move > 0 else 1)
+        exit_time = min(exit_time, axis_exit)
+    if normal == (0, 0) or entry >= exit_time:
+        return None
+    return entry, normal
+
 
 class Tilemap:
     def __init__(self, game, tile_size = 16):
         self.game = game
         self.tile_size = tile_size
-        self.tilemap = {}
-        self.offgrid_tiles = []
+        self.grid = TileGrid(tile_solidity)
+        # Key -> tile of the offgrid tiles, keys only grow so the dict keeps them in drawing order
+        self.offgrid_tiles = {}
+        self.offgrid_index = SpatialHash(OFFGRID_CELL)
+        self.offgrid_keys = {}
+        # (type, variant) -> {key: tile} of the offgrid tiles
+        self.offgrid_kinds = {}
+        self.next_offgrid_key = 0
         self.show_collisions = False
+        # When True, set_tile and remove_tile autotile the edited cell and its neighbours
+        self.live_autotile = False
+        # When True, collision queries return solid runs merged into bigger rects instead of one rect per tile
+        self.merge_colliders = True
+        self.colliders = []
+        self.collider_buckets = {}
+        # Bumped when the colliders change, with grid.version it tells when cached contacts are stale
+        self.colliders_version = 0
+        # Tile queries (collision rects, solid checks) since the game last reset it, once per tick
+        self.tile_queries = 0
+        self.baked_chunks = {}
+        self.tinted_images = {}
+        self.reset_raycasts()
+
+    def get_tile(self, pos):
+        """tuple -> dict or None
+        returns the tile placed at the grid position pos"""
+        return self.grid.tile(pos[0], pos[1])
+
+    def has_tile(self, pos):
+        return self.grid.type_at(pos[0], pos[1]) != EMPTY
+
+    def set_tile(self, pos, tile_type, variant, **infos):
+        self.grid.set(pos[0], pos[1], tile_type, variant, infos)
+        if self.live_autotile:
+            self.autotile_around(pos)
+
+    def update_tile(self, pos, **infos):
+        # Changes the extra infos (id, destination...) of a tile, its type and variant are kept
+        if self.has_tile(pos):
+            self.grid.infos.setdefault((pos[0], pos[1]), {}).update(infos)
+
+    def remove_tile(self, pos):
+        tile = self.grid.tile(pos[0], pos[1])
+        if tile is not None:
+            self.grid.remove(pos[0], pos[1])
+            if self.live_autotile:
+                self.autotile_around(pos)
+        return tile
+
+    def tiles(self):
+        """Yields the dict form of every on-grid tile"""
+        for x, y, t, variant in self.grid.cells():
+            yield self.grid.tile(x, y)
+
+    def is_empty(self):
+        return not len(self.grid)
+
+    def clear(self):
+        # Empties the map, streamed levels start from here
+        self.grid.clear()
+        self.set_colliders([])
+        self.set_offgrid_tiles([])
 
-    def extract(self, id_pairs, keep=False):
-        """dict, bool -> list
+    def set_offgrid_tiles(self, tiles):
+        self.offgrid_tiles = {}
+        self.offgrid_index.clear()
+        self.offgrid_keys = {}
+        self.offgrid_kinds = {}
+        for tile in tiles:
+            self.add_offgrid_tile(tile)
+
+    def add_offgrid_tile(self, tile):
+        # Keys only grow, so the index gives tiles back in the order they were added (drawing order)
+        self.offgrid_tiles[self.next_offgrid_key] = tile
+        self.offgrid_keys[id(tile)] = self.next_offgrid_key
+        self.offgrid_index.insert(self.next_offgrid_key, tile['pos'][0], tile['pos'][1], tile)
+        self.offgrid_kinds.setdefault((tile['type'], tile['variant']), {})[self.next_offgrid_key] = tile
+        self.next_offgrid_key += 1
+
+    def remove_offgrid_tile(self, tile):
+        del self.offgrid_tiles[self.offgrid_keys[id(tile)]]
+        self.unindex_offgrid_tile(tile)
+
+    def unindex_offgrid_tile(self, tile):
+        key = self.offgrid_keys.pop(id(tile))
+        self.offgrid_index.remove(key)
+        kind = self.offgrid_kinds[(tile['type'], tile['variant'])]
+        del kind[key]
+        if not kind:
+            del self.offgrid_kinds[(tile['type'], tile['variant'])]
+
+    def offgrid_in(self, rect):
+        """Rect -> list
+        returns the offgrid tiles that may overlap rect (pixels), in drawing order"""
+        return self.offgrid_index.query(rect.left - OFFGRID_CELL, rect.top - OFFGRID_CELL, rect.right, rect.bottom)
+
+    def extract(self, id_pairs, keep=False, area=None):
+        """dict, bool, Rect -> list
         extract a list of all elements in the map which are of type id_pairs[n][0] and variant id_pairs[n][1],
-        where 0 <= n < len(id_pairs)"""
+        where 0 <= n < len(id_pairs). When area is given (pixels), only the elements placed in it are extracted"""
         matches = []
-        for tile in self.offgrid_tiles.copy():
-            if (tile['type'], tile['variant']) in id_pairs:
-                matches.append(tile.copy())
-                if not keep:
-                    self.offgrid_tiles.remove(tile)
-        for loc in self.tilemap.copy():
-            tile = self.tilemap[loc]
-            if (tile['type'], tile['variant']) in id_pairs:
-                matches.append(tile.copy())
-                matches[-1]['pos'] = list(matches[-1]['pos']).copy()
-                matches[-1]['pos'][0] *= self.tile_size
-                matches[-1]['pos'][1] *= self.tile_size
-                if not keep:
-                    del self.tilemap[loc]
-        return matches
+        id_pairs = set(id_pairs)
+        # Only the tiles of the requested kinds are looked at, in the order of offgrid_tiles
+        offgrid = []
+        for kind in id_pairs:
+            offgrid.extend(self.offgrid_kinds.get(kind, {}).items())
+        if area is not None:
+            offgrid = [(key, tile) for key, tile in offgrid if area.collidepoint(tile['pos'])]
+        offgrid.sort(key=lambda entry: entry[0])
+        for key, tile in offgrid:
+            matches.append(tile.copy())
+            if not keep:
+                self.remove_offgrid_tile(tile)
 
-    def neighbor_offset(self, size):
-        offset = []
-        tiles_x = round_up(size[0]/self.tile_size) + 1
-        tiles_y = round_up(size[1]/self.tile_size) + 1
-        for x in range(-1, tiles_x):
-            for y in range(-1, tiles_y):
-                offset.append((x, y))
-        return offset
+        kinds = [(self.grid.type_ids[tile_type], variant) for tile_type, variant in id_pairs
+                 if tile_type in self.grid.type_ids]
+        box = None
+        if area is not None:
+            box = (area.left // self.tile_size, area.top // self.tile_size,
+                   (area.right - 1) // self.tile_size, (area.bottom - 1) // self.tile_size)
+        for x, y in self.grid.find(kinds, box):
+            matches.append(self.grid.tile(x, y))
+            matches[-1]['pos'][0] *= self.tile_size
+            matches[-1]['pos'][1] *= self.tile_size
+            if not keep:
+                self.grid.remove(x, y)
+        return matches
 
     def between_check(self,p_pos,e_pos):
+        """list, list -> bool
+        checks if a tile blocks the row of e_pos between the x of p_pos and the x of e_pos"""
+        return self.raycast(*self.sight_line(p_pos, e_pos)) is not None
+
+    def sight_line(self, p_pos, e_pos):
+        # The segment between_check casts, used to batch the checks of every enemy with raycast_many
         y = e_pos[1]
-        x_min, x_max = int(min(p_pos[0], e_pos[0])),int(max(p_pos[0], e_pos[0]))
-        for x in range(x_min, x_max+1):
-            if self.solid_check((x,y)):
-                return True
-        return False
-
-    def under_offset(self, size):
-        u_offset = []
-        tiles_x = round_up(size[0] / self.tile_size)
-        tiles_y = round_up(size[1] / self.tile_size)
-        for x in range(-1, tiles_x + 1):
-            for y in range(tiles_y, tiles_y+1):
-                u_offset.append((x, y))
-        return u_offset
+        return (int(min(p_pos[0], e_pos[0])), y), (int(max(p_pos[0], e_pos[0])), y)
+
+    def reset_raycasts(self):
+        """Forgets the raycasts memorized during the frame"""
+        self.raycasts = {}
+        self.raycasts_version = self.grid.version
+
+    def ray_setup(self, start, end):
+        # Cells and DDA state (steps, distance to the next cell borders, distance between borders) of a ray,
+        # distances are fractions of the segment
+        ts = self.tile_size
+        cell = [int(start[0] // ts), int(start[1] // ts)]
+        end_cell = (int(end[0] // ts), int(end[1] // ts))
+        step, t_max, t_delta = [0, 0], [float('inf'), float('inf')], [float('inf'), float('inf')]
+        for axis in (0, 1):
+            d = end[axis] - start[axis]
+            if d > 0:
+                step[axis] = 1
+                t_max[axis] = ((cell[axis] + 1) * ts - start[axis]) / d
+                t_delta[axis] = ts / d
+            elif d < 0:
+                step[axis] = -1
+                t_max[axis] = (cell[axis] * ts - start[axis]) / d
+                t_delta[axis] = -ts / d
+        return cell, end_cell, step, t_max, t_delta
+
+    def raycast(self, start, end, mask=SOLID | ONE_WAY):
+        """tuple, tuple, int -> tuple or None
+        walks the cells crossed by the segment start -> end (pixels) and returns the first one whose solidity is
+        in mask. Results are memorized until reset_raycasts() or an edit of the map"""
+        key = (start[0], start[1], end[0], end[1], mask)
+        if self.raycasts_version != self.grid.version:
+            self.reset_raycasts()
+        if key in self.raycasts:
+            return self.raycasts[key]
+
+        cell, end_cell, step, t_max, t_delta = self.ray_setup(start, end)
+        hit = None
+        for _ in range(abs(end_cell[0] - cell[0]) + abs(end_cell[1] - cell[1]) + 1):
+            if self.grid.solidity_at(cell[0], cell[1]) & mask:
+                hit = (cell[0], cell[1])
+                break
+            # Stepping on x when it's the closest border, never past the end cell
+            if cell[1] == end_cell[1] or (cell[0] != end_cell[0] and t_max[0] < t_max[1]):
+                cell[0] += step[0]
+                t_max[0] += t_delta[0]
+            else:
+                cell[1] += step[1]
+                t_max[1] += t_delta[1]
+        self.raycasts[key] = hit
+        return hit
+
+    def raycast_many(self, segments, mask=SOLID | ONE_WAY):
+        """list, int -> list
+        casts every segment at once on a window of the solidity bitmap, results are the same as raycast()"""
+        if self.raycasts_version != self.grid.version:
+            self.reset_raycasts()
+        todo = {}
+        for start, end in segments:
+            key = (start[0], start[1], end[0], end[1], mask)
+            if key not in self.raycasts:
+                todo[key] = (start, end)
+        if todo:
+            rays = [self.ray_setup(start, end) for start, end in todo.values()]
+            cells = np.array([ray[0] for ray in rays], dtype=np.int64)
+            end_cells = np.array([ray[1] for ray in rays], dtype=np.int64)
+            x0, y0 = np.minimum(cells, end_cells).min(axis=0).tolist()
+            x1, y1 = np.maximum(cells, end_cells).max(axis=0).tolist()
+            if (x1 - x0 + 1) * (y1 - y0 + 1) > MAX_RAYCAST_WINDOW:
+                # Rays too far apart for one window
+                for start, end in todo.values():
+                    self.raycast(start, end, mask)
+            else:
+                window = self.grid.solidity_window(x0, y0, x1, y1) & mask
+                step = np.array([ray[2] for ray in rays], dtype=np.int64)
+                t_max = np.array([ray[3] for ray in rays])
+                t_delta = np.array([ray[4] for ray in rays])
+                steps_left = np.abs(end_cells - cells).sum(axis=1)
+                hits = np.full(len(rays), -1, dtype=np.int64)
+                active = np.ones(len(rays), dtype=bool)
+                for i in range(int(steps_left.max()) + 1):
+                    blocked = active & (window[cells[:, 1] - y0, cells[:, 0] - x0] != 0)
+                    hits[blocked] = i
+                    active &= ~blocked & (steps_left > i)
+                    if not active.any():
+                        break
+                    on_x = ((cells[:, 1] == end_cells[:, 1])
+                            | ((cells[:, 0] != end_cells[:, 0]) & (t_max[:, 0] < t_max[:, 1])))
+                    axis = np.where(on_x, 0, 1)
+                    moving = np.nonzero(active)[0]
+                    cells[moving, axis[moving]] += step[moving, axis[moving]]
+                    t_max[moving, axis[moving]] += t_delta[moving, axis[moving]]
+                for key, hit, cell in zip(todo, hits.tolist(), cells.tolist()):
+                    self.raycasts[key] = tuple(cell) if hit >= 0 else None
+        return [self.raycasts[(start[0], start[1], end[0], end[1], mask)] for start, end in segments]
+
+    def region_around(self, pos, size):
+        """list, tuple -> tuple
+        returns the box (x0, y0, x1, y1) of the cells that may collide with an entity of the given size"""
+        tile_loc = (int((pos[0]+size[0]/2) // self.tile_size), int((pos[1]+size[0]/2) // self.tile_size))
+        return (tile_loc[0] - 1, tile_loc[1] - 1,
+                tile_loc[0] + round_up(size[0] / self.tile_size), tile_loc[1] + round_up(size[1] / self.tile_size))
+
+    def region_under(self, pos, size):
+        # The row of cells right under the entity
+        tile_loc = (int((pos[0]+size[0]/2) // self.tile_size), int((pos[1]+size[0]/2) // self.tile_size))
+        y = tile_loc[1] + round_up(size[1] / self.tile_size)
+        return tile_loc[0] - 1, y, tile_loc[0] + round_up(size[0] / self.tile_size), y
+
+    def cells_in(self, region):
+        for x in range(region[0], region[2] + 1):
+            for y in range(region[1], region[3] + 1):
+                yield x, y
+
+    def show_region(self, region, color):
+        for x, y in self.cells_in(region):
+            pygame.draw.rect(self.game.display, color,
+                             (x * self.tile_size - int(self.game.scroll[0]),
+                              y * self.tile_size - int(self.game.scroll[1]),
+                              16,
+                              16))
 
     def tiles_around(self, pos, size):
         tiles = []
-        tile_loc = (int((pos[0]+size[0]/2) // self.tile_size), int((pos[1]+size[0]/2) // self.tile_size))
-        for offset in self.neighbor_offset(size):
-            check_loc = str(tile_loc[0] + offset[0]) + ';' + str(tile_loc[1] + offset[1])
-            if self.show_collisions:
-                pygame.draw.rect(self.game.display, (255, 0, 255),
-                                 ((tile_loc[0] + offset[0]) * self.tile_size - int(self.game.scroll[0]),
-                                  (tile_loc[1] + offset[1]) * self.tile_size - int(self.game.scroll[1]),
-                                  16,
-                                  16))
-            if check_loc in self.tilemap:
-                tiles.append(self.tilemap[check_loc])
+        for x, y in self.cells_in(self.region_around(pos, size)):
+            tile = self.grid.tile(x, y)
+            if tile is not None:
+                tiles.append(tile)
         return tiles
 
     def tiles_under(self, pos, size):
         u_tiles = []
-        u_tile_loc = (int((pos[0]+size[0]/2) // self.tile_size), int((pos[1]+size[0]/2) // self.tile_size))
-        for offset in self.under_offset(size):
-            check_loc = str(u_tile_loc[0] + offset[0]) + ';' + str(u_tile_loc[1] + offset[1])
-            if self.show_collisions:
-                pygame.draw.rect(self.game.display, (0, 0, 255),
-                                ((u_tile_loc[0] + offset[0]) * self.tile_size - int(self.game.scroll[0]),
-                                  (u_tile_loc[1] + offset[1]) * self.tile_size - int(self.game.scroll[1]),
-                                  16,
-                                  16))
-            if check_loc in self.tilemap:
-                u_tiles.append(self.tilemap[check_loc])
+        for x, y in self.cells_in(self.region_under(pos, size)):
+            tile = self.grid.tile(x, y)
+            if tile is not None:
+                u_tiles.append(tile)
         return u_tiles
 
+    def export(self):
+        """Returns the map in its json (dict) form"""
+        return {'tilemap': self.grid.to_dict(),
+                'tilesize': self.tile_size,
+                'offgrid': list(self.offgrid_tiles.values())}
+
+    def import_data(self, map_data):
+        self.grid.from_dict(map_data['tilemap'])
+        self.set_colliders([])
+        self.tile_size = map_data['tilesize']
+        self.set_offgrid_tiles(map_data['offgrid'])
+
     def save(self, path):
+        """Saves the map as json, or as a binary level if path ends with .lvl"""
+        if path.endswith(BINARY_EXTENSION):
+            write_level(path, self.tile_size, self.grid, list(self.offgrid_tiles.values()))
+            return
         f = open(path, 'w')
-        json.dump({'tilemap': self.tilemap,
-                   'tilesize': self.tile_size,
-                   'offgrid': self.offgrid_tiles}, f)
+        json.dump(self.export(), f)
         f.close()
 
     def load(self, path):
+        if path.endswith(BINARY_EXTENSION):
+            level = read_level(path)
+            self.grid.from_arrays(level['type_names'], level['xs'], level['ys'], level['types'], level['variants'],
+                                  level['infos'])
+            self.set_colliders([])
+            self.tile_size = level['tilesize']
+            self.set_offgrid_tiles(offgrid_from_level(level))
+            return
         f = open(path, 'r')
         map_data = json.load(f)
         f.close()
 
-        self.tilemap = map_data['tilemap']
-        self.tile_size = map_data['tilesize']
-        self.offgrid_tiles = map_data['offgrid']
+        self.import_data(map_data)
 
     def autotile(self):
-        for loc in self.tilemap:
-            tile = self.tilemap[loc]
-            neighbors = set()
-            for shift in [(1, 0), (-1, 0), (0, -1), (0, 1)]:
-                check_loc = str(tile['pos'][0] + shift[0]) + ";" + str(tile['pos'][1] + shift[1])
-                if check_loc in self.tilemap:
-                    if self.tilemap[check_loc]['type'] == tile['type']:
-                        neighbors.add(shift)
-            neighbors = tuple(sorted(neighbors))
-            if (tile['type'] in AUTOTILE_TYPES) and (neighbors in AUTOTILE_MAP):
-                tile['variant'] = AUTOTILE_MAP[neighbors]
+        """Gives every tile of AUTOTILE_TYPES the variant matching its neighbours of the same type.
+        Works on whole chunks at once with the neighbour masks of the grid"""
+        # Indexed by type id, the extra False is what EMPTY (-1) cells read
+        autotiled = np.array([name in AUTOTILE_TYPES for name in self.grid.type_names] + [False])
+        for cx, cy in list(self.grid.chunks):
+            chunk = self.grid.chunks[(cx, cy)]
+            variants = AUTOTILE_LUT[self.grid.neighbour_masks(cx, cy)]
+            variants = np.where(autotiled[chunk.types] & (variants >= 0), variants, chunk.variants)
+            self.grid.set_variants(cx, cy, variants)
+
+    def autotile_cell(self, x, y):
+        # Same as autotile() for a single cell
+        t = self.grid.type_at(x, y)
+        if t == EMPTY or self.grid.type_names[t] not in AUTOTILE_TYPES:
+            return
+        mask = 0
+        for (dx, dy), bit in NEIGHBOR_BITS.items():
+            if self.grid.type_at(x + dx, y + dy) == t:
+                mask |= bit
+        variant = AUTOTILE_LUT.item(mask)
+        if variant >= 0 and self.grid.get(x, y)[1] != variant:
+            self.grid.set(x, y, self.grid.type_names[t], variant, self.grid.infos.get((x, y)))
+
+    def autotile_around(self, pos):
+        """Autotiles the cell at pos and its 4 neighbours, the only ones whose variant can change after an edit"""
+        self.autotile_cell(pos[0], pos[1])
+        for dx, dy in NEIGHBOR_BITS:
+            self.autotile_cell(pos[0] + dx, pos[1] + dy)
+
+    def is_solid(self, x, y, one_way=True):
+        """int, int, bool -> bool
+        checks if the cell x, y blocks entities. Transparent tiles (one way platforms) only count when one_way is True"""
+        return bool(self.grid.solidity_at(x, y) & (SOLID | ONE_WAY if one_way else SOLID))
 
     def solid_check(self, pos):
-        tile_loc = str(int(pos[0] // self.tile_size)) + ";" + str(int(pos[1] // self.tile_size))
-        if tile_loc in self.tilemap:
-            tile = self.tilemap[tile_loc]
-            if tile["type"] in PHYSICS_TILES:
-                return self.tilemap[tile_loc]
-            elif tile['type'] in set(TRANSPARENT_TILES.keys()) and tile['variant'] in TRANSPARENT_TILES[tile['type']]:
-                return self.tilemap[tile_loc]
+        self.tile_queries += 1
+        x, y = int(pos[0] // self.tile_size), int(pos[1] // self.tile_size)
+        if self.is_solid(x, y):
+            return self.grid.tile(x, y)
+
+    def region_rects(self, region, mask, color=None):
+        self.tile_queries += 1
+        if self.show_collisions and color:
+            self.show_region(region, color)
+        return [pygame.Rect(x * self.tile_size, y * self.tile_size, self.tile_size, self.tile_size)
+                for x, y in self.grid.solid_cells(*region, mask=mask)]
+
+    def merged_rects(self, region, mask, color=None, columns=False):
+        """tuple, int -> list
+        same as region_rects but with the solid cells merged into bigger rects (cut to the region)"""
+        self.tile_queries += 1
+        if self.show_collisions and color:
+            self.show_region(region, color)
+        ts = self.tile_size
+        return [pygame.Rect(x0 * ts, y0 * ts, (x1 - x0 + 1) * ts, (y1 - y0 + 1) * ts)
+                for x0, y0, x1, y1 in self.grid.merged_cells(*region, mask=mask, columns=columns)]
+
+    def terrain_rects(self, region, mask, color=None, columns=False):
+        # The static colliders of a region, merged or tile by tile depending on merge_colliders
+        if self.merge_colliders:
+            return self.merged_rects(region, mask, color, columns)
+        return self.region_rects(region, mask, color)
 
     def physics_rects_around(self, pos, size):
-        rects = []
-        for tile in self.tiles_around(pos, size):
-            if tile['type'] in PHYSICS_TILES:
-                rects.append(pygame.Rect(tile['pos'][0] * self.tile_size, tile['pos'][1] * self.tile_size, self.tile_size, self.tile_size))
-        return rects
+        return self.region_rects(self.region_around(pos, size), SOLID, (255, 0, 255))
 
     def physics_rects_under(self, pos, size):
-        u_rects = []
-        for tile in self.tiles_under(pos, size):
-            if tile['type'] in PHYSICS_TILES:
-                u_rects.append(pygame.Rect(tile['pos'][0] * self.tile_size, tile['pos'][1] * self.tile_size, self.tile_size, self.tile_size))
-            elif tile['type'] in set(TRANSPARENT_TILES.keys()) and tile['variant'] in TRANSPARENT_TILES[tile['type']]:
-                u_rects.append(pygame.Rect(tile['pos'][0] * self.tile_size, tile['pos'][1] * self.tile_size, self.tile_size,self.tile_size))
-        return u_rects
+        return self.region_rects(self.region_under(pos, size), SOLID | ONE_WAY, (0, 0, 255))
+
+    def set_colliders(self, rects):
+        """Registers the colliders that are not tiles (closed doors), replacing the previous ones.
+        They are bucketed by chunk so that collision queries only see the ones close to them"""
+        rects = list(rects)
+        if rects == self.colliders:
+            return
+        self.colliders_version += 1
+        chunk_px = CHUNK_SIZE * self.tile_size
+        self.colliders = rects
+        self.collider_buckets = {}
+        for i, rect in enumerate(self.colliders):
+            for cx in range(rect.left // chunk_px, (rect.right - 1) // chunk_px + 1):
+                for cy in range(rect.top // chunk_px, (rect.bottom - 1) // chunk_px + 1):
+                    self.collider_buckets.setdefault((cx, cy), []).append(i)
+
+    def colliders_in(self, region):
+        # Colliders touching the region, grown by a tile so that fast entities already inside a door still see it
+        if not self.colliders:
+            return []
+        chunk_px = CHUNK_SIZE * self.tile_size
+        box = pygame.Rect((region[0] - 1) * self.tile_size, (region[1] - 1) * self.tile_size,
+                          (region[2] - region[0] + 3) * self.tile_size, (region[3] - region[1] + 3) * self.tile_size)
+        found = set()
+        for cx in range(box.left // chunk_px, (box.right - 1) // chunk_px + 1):
+            for cy in range(box.top // chunk_px, (box.bottom - 1) // chunk_px + 1):
+                found.update(self.collider_buckets.get((cx, cy), ()))
+        return [self.colliders[i] for i in sorted(found) if self.colliders[i].colliderect(box)]
+
+    def colliders_around(self, pos, size):
+        """list, tuple -> list
+        every rect (tiles and doors) an entity of the given size may collide with, in a single query"""
+        region = self.region_around(pos, size)
+        # Cut in columns: PhysicsPlayer finds the walls next to it from the x of the rects it gets
+        return self.terrain_rects(region, SOLID, (255, 0, 255), columns=True) + self.colliders_in(region)
+
+    def colliders_under(self, pos, size):
+        region = self.region_under(pos, size)
+        return self.terrain_rects(region, SOLID | ONE_WAY, (0, 0, 255)) + self.colliders_in(region)
+
+    def colliding_rects(self, rect, one_way=False):
+        """Rect, bool -> list
+        returns the rects of the solid cells and colliders overlapping rect"""
+        region = (rect.left // self.tile_size, rect.top // self.tile_size,
+                  (rect.right - 1) // self.tile_size, (rect.bottom - 1) // self.tile_size)
+        rects = self.terrain_rects(region, SOLID | ONE_WAY if one_way else SOLID)
+        return rects + [r for r in self.colliders_in(region) if r.colliderect(rect)]
+
+    def sweep(self, pos, size, dx, dy, mask=SOLID, colliders=True, merged=True):
+        """list, tuple, float, float, int, bool, bool -> tuple
+        swept AABB test of the box at pos moving by (dx, dy) against the tiles of mask and, unless colliders is
+        False, the colliders, in a single query. Returns (time of impact in [0, 1], normal, rect) of the first rect
+        the box runs into, or None when the move is free. Rects the box already overlaps are left to the overlap
+        resolution. With merged False the tiles are tested one by one even when merge_colliders is True"""
+        left, top = min(pos[0], pos[0] + dx), min(pos[1], pos[1] + dy)
+        right, bottom = max(pos[0], pos[0] + dx) + size[0], max(pos[1], pos[1] + dy) + size[1]
+        ts = self.tile_size
+        region = (int(left // ts) - 1, int(top // ts) - 1, int(right // ts) + 1, int(bottom // ts) + 1)
+        hit = None
+        rects = self.terrain_rects(region, mask) if merged else self.region_rects(region, mask)
+        if colliders:
+            rects += self.colliders_in(region)
+        for rect in rects:
+            impact = sweep_box(pos, size, dx, dy, rect)
+            if impact is not None and (hit is None or impact[0] < hit[0]):
+                hit = impact + (rect,)
+        return hit
+
+    def swept_move(self, pos, size, axis, move, mask=SOLID, colliders=True):
+        """list, tuple, int, float, int, bool -> float
+        length of a move along axis (0 for x, 1 for y) that cannot skip a collider: the whole move, or when it
+        would go through a rect, the move that ends just inside it so that the overlap resolution stops the
+        entity on it as for any other hit. mask and colliders have to give the rects the overlap resolution of
+        the move looks at, a rect it doesn't look at would leave the entity inside it"""
+        if abs(move) < self.tile_size:
+            # Colliders are at least a tile thick, a shorter move always ends overlapping the ones it reaches
+            return move
+        # Tile by tile: a merged rect the entity already overlaps by a fraction of a pixel would hide the tiles
+        # after it, and ending deep in one could let the overlap resolution use another face than the one hit
+        hit = self.sweep(pos, size, move * (1 - axis), move * axis, mask, colliders, merged=False)
+        if hit is None:
+            return move
+        toi, normal, rect = hit
+        end = pos[axis] + move
+        if rect[axis] < end + size[axis] and end < rect[axis] + rect[axis + 2]:
+            # Ends in the rect, nothing was skipped
+            return move
+        # A pixel and a half inside, the entity rect still overlaps it once its position is truncated
+        if normal[axis] < 0:
+            return rect[axis] - size[axis] + 1.5 - pos[axis]
+        return rect[axis] + rect[axis + 2] - 1.5 - pos[axis]
 
     def get_type_from_rect(self, rect):
-        for tile in self.tilemap:
-            if str(rect.x//self.tile_size) + ";" + str(rect.y//self.tile_size) == tile:
-                return self.tilemap[tile]["type"]
+        t = self.grid.type_at(rect.x//self.tile_size, rect.y//self.tile_size)
+        if t != EMPTY:
+            return self.grid.type_names[t]
 
     def get_variant_from_rect(self, rect):
-        for tile in self.tilemap:
-            if str(rect.x//self.tile_size) + ";" + str(rect.y//self.tile_size) == tile:
-                return self.tilemap[tile]["variant"]
+        cell = self.grid.get(rect.x//self.tile_size, rect.y//self.tile_size)
+        if cell is not None:
+            return cell[1]
+
+    def tinted(self, tile_type, variant, opacity):
+        """str, int, int -> Surface
+        returns the image of the tile with its alpha multiplied by opacity / 255. Tinted images are cached, so
+        drawing a faded map (editor properties mode) doesn't allocate anything once every tile has been seen"""
+        img = self.game.assets[tile_type][variant]
+        key = (tile_type, variant, opacity)
+        cached = self.tinted_images.pop(key, None)
+        # The assets can be reloaded (editor environments), a cached image is only valid for the image it was made of
+        if cached is None or cached[0] is not img:
+            tinted_img = img.copy()
+            tinted_img.fill((255, 255, 255, opacity), special_flags=BLEND_RGBA_MULT)
+            cached = (img, tinted_img)
+        self.tinted_images[key] = cached
+        if len(self.tinted_images) > MAX_TINTED_IMAGES:
+            del self.tinted_images[next(iter(self.tinted_images))]
+        return cached[1]
+
+    def bake_chunk(self, chunk, layer, mask_opacity, exception):
+        """Chunk, str, int, set -> Surface or None
+        draws every tile of a chunk belonging to the layer ('back' or 'front') on a single surface"""
+        chunk_px = CHUNK_SIZE * self.tile_size
+        baked = None
+        # Transposed so that tiles are drawn column by column, like the screen used to be
+        xs, ys = np.nonzero(chunk.types.T != EMPTY)
+        for lx, ly in zip(xs.tolist(), ys.tolist()):
+            tile_type = self.grid.type_names[chunk.types.item(ly, lx)]
+            if (tile_type in BACK_LAYER_TILES) != (layer == 'back'):
+                continue
+            if baked is None:
+                baked = pygame.Surface((chunk_px + CHUNK_OVERHANG * self.tile_size,
+                                        chunk_px + CHUNK_OVERHANG * self.tile_size), pygame.SRCALPHA)
+            baked.blit(self.tinted(tile_type, chunk.variants.item(ly, lx), 255 if tile_type in exception else mask_opacity),
+                       (lx * self.tile_size, ly * self.tile_size))
+        return baked
+
+    def render_chunks(self, surf, offset, layer, mask_opacity, exception):
+        # Only chunks edited since they were baked (or baked with another opacity) are drawn again
+        chunk_px = CHUNK_SIZE * self.tile_size
+        style = (mask_opacity, frozenset(exception))
+        visible = 0
+        for cx in range((offset[0] - CHUNK_OVERHANG * self.tile_size) // chunk_px,
+                        (offset[0] + surf.get_width()) // chunk_px + 1):
+            for cy in range((offset[1] - CHUNK_OVERHANG * self.tile_size) // chunk_px,
+                            (offset[1] + surf.get_height()) // chunk_px + 1):
+                chunk = self.grid.chunks.get((cx, cy))
+                key = (layer, cx, cy)
+                if chunk is None:
+                    self.baked_chunks.pop(key, None)
+                    continue
+                visible += 1
+                baked = self.baked_chunks.pop(key, None)
+                if baked is None or baked[0] != chunk.version or baked[1] != style:
+                    baked = (chunk.version, style, self.bake_chunk(chunk, layer, mask_opacity, exception))
+                # Reinserted at the end, so the first entries are always the least recently used
+                self.baked_chunks[key] = baked
+                if baked[2] is not None:
+                    surf.blit(baked[2], (cx * chunk_px - offset[0], cy * chunk_px - offset[1]))
+
+        while len(self.baked_chunks) > max(MAX_BAKED_CHUNKS, visible * 2):
+            del self.baked_chunks[next(iter(self.baked_chunks))]
 
     def render(self, surf, offset = (0, 0), mask_opacity=255, exception=()):
-        for tile in self.offgrid_tiles:
-            img = self.game.assets[tile['type']][tile['variant']].copy()
-            img.fill((255, 255, 255, 255 if tile['type'] in exception else mask_opacity), special_flags=BLEND_RGBA_MULT)
-            surf.blit(self.game.assets[tile['type']][tile['variant']], (tile['pos'][0] - offset[0], tile['pos'][1] - offset[1] ))
-
-        for x in range(offset[0]// self.tile_size, (offset[0] + surf.get_width()) // self.tile_size + 1):
-            for y in range(offset[1] // self.tile_size, (offset[1] + surf.get_height()) // self.tile_size + 1):
-                loc = str(x) + ";" + str(y)
-                if loc in self.tilemap:
-                    tile = self.tilemap[loc]
-                    if tile['type'] in {'vine_transp_back','dark_vine'}:
-                        img = self.game.assets[tile['type']][tile['variant']].copy()
-                        img.fill((255, 255, 255, 255 if tile['type'] in exception else mask_opacity), special_flags=BLEND_RGBA_MULT)
-                        surf.blit(img, (
-                        tile['pos'][0] * self.tile_size - offset[0], tile['pos'][1] * self.tile_size - offset[1]))
+        view = pygame.Rect(offset[0], offset[1], surf.get_width(), surf.get_height())
+        for tile in self.offgrid_in(view):
+            img = self.tinted(tile['type'], tile['variant'], 255 if tile['type'] in exception else mask_opacity)
+            surf.blit(img, (tile['pos'][0] - offset[0], tile['pos'][1] - offset[1]))
+
+        self.render_chunks(surf, offset, 'back', mask_opacity, exception)
 
     def render_over(self, surf, offset = (0, 0), mask_opacity=255, exception=()):
-        # In order to make the render more optimized, we make blocks render only if they are visible on the screen
-        for x in range(offset[0] // self.tile_size - 3, (offset[0] + surf.get_width()) // self.tile_size + 4):
-            # There the coordinates are only in those seen on the screen
-            for y in range(offset[1] // self.tile_size - 3, (offset[1] + surf.get_height()) // self.tile_size + 4):
-                loc = str(x) + ";" + str(y)
-                if loc in self.tilemap:
-                    tile = self.tilemap[loc]
-                    if tile['type'] not in {'vine_transp_back','dark_vine'}:
-                        img = self.game.assets[tile['type']][tile['variant']].copy()
-                        img.fill((255, 255, 255, 255 if tile['type'] in exception else mask_opacity),
-                                 special_flags=BLEND_RGBA_MULT)
-                        surf.blit(img, (
-                            tile['pos'][0] * self.tile_size - offset[0], tile['pos'][1] * self.tile_size - offset[1]))
\ No newline at end of file
+        # Static tiles are pre-rendered by chunks, so only the handful of chunks seen on the screen are blitted
+        self.render_chunks(surf, offset, 'front', mask_opacity, exception)
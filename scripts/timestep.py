@@ -0,0 +1,71 @@
+TICK_RATE = 60
+# Steps simulated at most in one frame, the time of a slower frame is dropped and the game slows down for a moment
+MAX_CATCH_UP_STEPS = 5
+# Objects moving more than this in one step were teleported (respawn, level change), they are not interpolated
+MAX_INTERPOLATED_MOVE = 64
+
+
+class FixedTimestep:
+    """Turns the variable duration of the frames into a whole number of simulation steps of fixed length.
+
+    The time left after the steps of a frame is kept for the next one. alpha() tells how far into the next step the
+    frame is, the renderer draws the moving objects that far between their last two states."""
+
+    def __init__(self, rate=TICK_RATE, max_steps=MAX_CATCH_UP_STEPS):
+        self.step_ms = 1000 / rate
+        self.max_steps = max_steps
+        self.accumulator = 0
+
+    def advance(self, frame_ms):
+        """float -> int
+        adds the duration of a frame in milliseconds, returns the number of steps to simulate for it"""
+        self.accumulator += frame_ms
+        steps = min(int(self.accumulator // self.step_ms), self.max_steps)
+        self.accumulator -= steps * self.step_ms
+        if self.accumulator >= self.step_ms:
+            # Too far behind to catch up, the backlog is dropped
+            self.accumulator %= self.step_ms
+        return steps
+
+    def alpha(self):
+        """-> float
+        fraction of a step between the last simulated state and the frame, in [0, 1["""
+        return self.accumulator / self.step_ms
+
+    def reset(self):
+        self.accumulator = 0
+
+
+class GameClock:
+    """Time of the simulation, in seconds: it advances by one step per simulation tick, so it stops while the game
+    is paused and runs faster than real time in headless runs. Gameplay timers (stuns, cooldowns, doors) read it
+    instead of the wall clock, which makes them the same on every replay."""
+
+    def __init__(self, rate=TICK_RATE):
+        self.step_seconds = 1 / rate
+        self.ticks = 0
+
+    def tick(self):
+        self.ticks += 1
+
+    def time(self):
+        return self.ticks * self.step_seconds
+
+    def reset(self):
+        self.ticks = 0
+
+
+def interpolate(previous, current, alpha):
+    """tuple, tuple, float -> tuple
+    the point alpha of the way from previous to current"""
+    return previous[0] + (current[0] - previous[0]) * alpha, previous[1] + (current[1] - previous[1]) * alpha
+
+
+def interpolated_offset(offset, previous, current, alpha):
+    """tuple, tuple, tuple, float -> tuple
+    render offset drawing an object that is at current at its interpolated position instead, so that its render
+    method does not have to know about interpolation"""
+    if previous is None or abs(current[0] - previous[0]) + abs(current[1] - previous[1]) > MAX_INTERPOLATED_MOVE:
+        return offset
+    return (offset[0] + (current[0] - previous[0]) * (1 - alpha),
+            offset[1] + (current[1] - previous[1]) * (1 - alpha))
@@ -1,6 +1,7 @@
 import pygame
 import os
 import json
+import math
 
 
 
@@ -114,3 +115,44 @@ class Animation:
 
 
 
+# Spin of the player in degrees per tick, rotated sprites are cached at multiples of it
+ROTATION_STEP = 6.5
+MAX_CACHED_SPRITES = 1024
+GHOST_TINT = (109, 156, 159, 70)
+
+
+class SpriteCache:
+    """Converted, rotated and ghost tinted versions of animation frames, made the first time they are drawn and
+    reused after that. Angles are rounded to ROTATION_STEP, so a spinning frame needs at most
+    ceil(360 / ROTATION_STEP) images. Drawing a cached image allocates nothing."""
+
+    def __init__(self, step=ROTATION_STEP, max_images=MAX_CACHED_SPRITES):
+        self.step = step
+        # The step doesn't have to divide 360, the last bucket is then a bit less than a step away from 360
+        self.buckets = math.ceil(360 / step)
+        self.max_images = max_images
+        self.images = {}
+
+    def get(self, img, angle=0, ghost=False):
+        """Surface, float, bool -> Surface
+        returns img rotated by angle (rounded to the step), tinted like a dash ghost when ghost is True"""
+        # The angle is wrapped before rounding, a bucket at 360 is the same as 0
+        key = (img, round(angle % 360 / self.step) % self.buckets, ghost)
+        cached = self.images.get(key)
+        if cached is None:
+            if ghost:
+                cached = img.copy()
+                cached.fill((255, 255, 255, 0), special_flags=pygame.BLEND_RGBA_MAX)
+                cached.fill(GHOST_TINT, special_flags=pygame.BLEND_RGBA_MIN)
+            else:
+                cached = img.convert_alpha()
+            if key[1]:
+                cached = pygame.transform.rotate(cached, key[1] * self.step)
+            self.images[key] = cached
+            if len(self.images) > self.max_images:
+                # The oldest image goes, a hit doesn't reorder the dict so that drawing stays free of allocations
+                del self.images[next(iter(self.images))]
+        return cached
+
+    def clear(self):
+        self.images = {}
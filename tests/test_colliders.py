@@ -0,0 +1,58 @@
+import random
+
+import pygame
+
+from scripts.entities import PhysicsEntity
+from scripts.tilemap import Tilemap
+
+MAP = 'data/maps/0.json'
+SIZES = [(16, 16), (8, 15), (12, 30)]
+SPOTS = 60
+TICKS = 200
+
+
+def free_spots(tilemap, size, count, rng):
+    """count positions of the map where a box of size overlaps no tile"""
+    cells = [(x, y) for x, y, t, variant in tilemap.grid.cells()]
+    spots = []
+    while len(spots) < count:
+        x, y = rng.choice(cells)
+        pos = [(x + rng.uniform(-3, 3)) * tilemap.tile_size, (y + rng.uniform(-3, 0)) * tilemap.tile_size]
+        if not tilemap.colliding_rects(pygame.Rect(pos, size), one_way=True):
+            spots.append(pos)
+    return spots
+
+
+def walk(tilemap, size, pos, seed):
+    """positions and collisions of an entity walking, jumping and being thrown around from pos. The velocity
+    changes like in PhysicsEntity.finish_update"""
+    rng = random.Random(seed)
+    entity = PhysicsEntity(None, 'test', pos, size)
+    steps = []
+    for _ in range(TICKS):
+        movement = (rng.choice((-3, -1.5, -1, 0, 0.5, 1, 1.5, 3)), 0)
+        if rng.random() < 0.05:
+            # Knocked back or launched, fast enough to be swept
+            entity.velocity = [rng.choice((-24, -17, 17, 24)), rng.choice((-20, -4, 0))]
+        elif entity.collisions['down'] and rng.random() < 0.1:
+            entity.velocity[1] = rng.choice((-3, -5))
+        entity.move(tilemap, movement)
+        entity.velocity[0] *= 0.5
+        entity.velocity[1] = min(5, entity.velocity[1] + 0.1)
+        if entity.collisions['down'] or entity.collisions['up']:
+            entity.velocity[1] = 0
+        steps.append((tuple(entity.pos), tuple(sorted(entity.collisions.items()))))
+    return steps
+
+
+def test_merged_colliders_give_the_same_moves():
+    # Merged rects have seams at other places than tiles, entities must still hit the same faces
+    tilemap = Tilemap(None)
+    tilemap.load(MAP)
+    rng = random.Random(0)
+    for size in SIZES:
+        for seed, pos in enumerate(free_spots(tilemap, size, SPOTS, rng)):
+            tilemap.merge_colliders = True
+            merged = walk(tilemap, size, pos, seed)
+            tilemap.merge_colliders = False
+            assert merged == walk(tilemap, size, pos, seed), (size, pos)
@@ -0,0 +1,60 @@
+import pygame
+
+from main import Game
+from scripts.entities import PhysicsEntity, Enemy, active_entities, update_entities, REDUCED_RATE
+from scripts.tilemap import Tilemap
+
+
+def door_above(entity_pos):
+    """A tilemap with a closed door, two tiles high, whose bottom is 8 pixels above an entity at entity_pos"""
+    tilemap = Tilemap(None)
+    tilemap.set_colliders([pygame.Rect(entity_pos[0], entity_pos[1] - 40, 16, 32)])
+    return tilemap
+
+
+def test_fast_move_up_into_a_door_is_not_stopped_inside_it():
+    # Moving up, PhysicsEntity.move doesn't push entities out of doors, a fast move must go as far as slow moves
+    tilemap = door_above((0, 0))
+    fast = PhysicsEntity(None, 'test', (0, 0), (16, 16))
+    fast.move(tilemap, (0, -60))
+    slow = PhysicsEntity(None, 'test', (0, 0), (16, 16))
+    for _ in range(6):
+        slow.move(tilemap, (0, -10))
+    assert fast.pos == slow.pos == [0, -60]
+    assert not fast.collisions['up']
+
+
+def test_fast_move_up_stops_under_a_tile():
+    tilemap = door_above((0, 0))
+    tilemap.set_tile((0, -3), 'stone', 0)
+    entity = PhysicsEntity(None, 'test', (0, 0), (16, 16))
+    entity.move(tilemap, (0, -60))
+    assert entity.pos == [0, -32]
+    assert entity.collisions['up']
+
+
+def walk_enemy(game, view_offset, ticks=40):
+    """position of an enemy walking on a floor of level 0 for ticks, with the camera view offset from it, and the
+    number of ticks it thought"""
+    enemy = Enemy(game, 'picko', (96, -160), (16, 16), 100,
+                  {'attack_distance': 20, 'attack_dmg': 10, 'attack_time': 1.5})
+    enemy.walking = ticks
+    thought = 0
+    for tick in range(ticks):
+        view = pygame.Rect(enemy.pos[0] + view_offset, enemy.pos[1] - 100, 480, 288)
+        enemies, thinking = active_entities([enemy], view, game.player.rect(), tick)
+        assert enemies == [enemy]
+        update_entities(enemies, game.tilemap, thinking=thinking)
+        thought += len(thinking)
+    return enemy.pos, thought
+
+
+def test_enemies_thinking_at_the_reduced_rate_move_at_full_speed():
+    game = Game(headless=True)
+    game.load_level(0)
+    # In the view it thinks every tick, 150 pixels left of it only every REDUCED_RATE ticks
+    on_screen, thought = walk_enemy(game, -100)
+    assert thought == 40 and on_screen[0] > 110
+    reduced, thought = walk_enemy(game, 150)
+    assert thought == 40 // REDUCED_RATE
+    assert reduced == on_screen
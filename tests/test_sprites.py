@@ -0,0 +1,24 @@
+import pygame
+
+from scripts.utils import SpriteCache
+
+
+def test_angles_near_360_are_not_drawn_upright():
+    # 6.5 doesn't divide 360, an angle just under 360 is closer to the last bucket (357.5) than to 0
+    pygame.display.init()
+    pygame.display.set_mode((1, 1))
+    img = pygame.Surface((16, 4), pygame.SRCALPHA)
+    cache = SpriteCache(step=6.5)
+    assert cache.get(img, 359) is cache.get(img, 357.5)
+    assert cache.get(img, 359) is not cache.get(img, 0)
+    assert cache.get(img, 360) is cache.get(img, 0)
+    assert cache.get(img, -1) is cache.get(img, 359)
+
+
+def test_step_dividing_360_wraps_to_0():
+    pygame.display.init()
+    pygame.display.set_mode((1, 1))
+    img = pygame.Surface((16, 4), pygame.SRCALPHA)
+    cache = SpriteCache(step=8)
+    assert cache.get(img, 359) is cache.get(img, 0)
+    assert len(cache.images) == 1
@@ -0,0 +1,58 @@
+import numpy as np
+
+from scripts.tilegrid import TileGrid, CHUNK_SIZE
+
+
+class WatchedChunks(dict):
+    # Chunks of a grid that remember the keys looked up and refuse to be walked through
+    def __init__(self, chunks):
+        super().__init__(chunks)
+        self.visited = set()
+
+    def __getitem__(self, key):
+        self.visited.add(key)
+        return super().__getitem__(key)
+
+    def __iter__(self):
+        raise AssertionError('find walked through every chunk')
+
+    def items(self):
+        raise AssertionError('find walked through every chunk')
+
+    def values(self):
+        raise AssertionError('find walked through every chunk')
+
+
+def grass_grid(chunks=20):
+    """A row of chunks filled with grass, one of them also holding a stone tile"""
+    grid = TileGrid()
+    xs = np.arange(chunks * CHUNK_SIZE)
+    grid.add_arrays(['grass'], xs, np.zeros(len(xs)), np.zeros(len(xs), dtype=np.int16),
+                    np.zeros(len(xs), dtype=np.int16))
+    grid.set(5 * CHUNK_SIZE + 3, 7, 'stone', 1)
+    return grid
+
+
+def test_find_only_visits_chunks_of_the_kinds():
+    grid = grass_grid()
+    grid.chunks = WatchedChunks(grid.chunks)
+    assert grid.find([(grid.type_ids['stone'], 1)]) == [(5 * CHUNK_SIZE + 3, 7)]
+    assert grid.chunks.visited == {(5, 0)}
+
+
+def test_find_in_box_only_visits_chunks_of_the_box():
+    grid = grass_grid()
+    grid.chunks = WatchedChunks(grid.chunks)
+    found = grid.find([(grid.type_ids['grass'], 0)], (2 * CHUNK_SIZE, 0, 3 * CHUNK_SIZE, 0))
+    assert found == [(x, 0) for x in range(2 * CHUNK_SIZE, 3 * CHUNK_SIZE + 1)]
+    assert grid.chunks.visited == {(2, 0), (3, 0)}
+
+
+def test_find_keeps_the_order_of_cells():
+    grid = TileGrid()
+    for x, y in ((100, 0), (-40, 3), (0, 0), (70, -2), (-40, 1)):
+        grid.set(x, y, 'grass', 0)
+    grid.remove(0, 0)
+    grid.set(0, 0, 'grass', 0)
+    expected = [(x, y) for x, y, t, variant in grid.cells()]
+    assert grid.find([(grid.type_ids['grass'], 0)]) == expected